@@ -85,7 +85,8 @@ def dashboard_header(moniker, member_type, user_id=None,
                      override_enabled=False, override_url='',
                      ipns_name=None, avatar_cid=None):
     """Shared profile header for dashboard views."""
-    moniker_slug = moniker.lower().replace(' ', '-')
+    import db as _db
+    moniker_slug = _db.moniker_slug(moniker)
     ui.add_head_html('''
     <style>
       html, body { background-color: #0d0d0d !important; }
@@ -198,8 +199,6 @@ def dashboard_header(moniker, member_type, user_id=None,
                     override_input.bind_visibility_from(override_toggle, 'value')
 
                 if user_id:
-                    import db as _db
-
                     async def _save_override():
                         await _db.upsert_profile_settings(
                             user_id,
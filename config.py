@@ -27,7 +27,24 @@ MAILTRAP_API_TOKEN = os.environ["MAILTRAP_API_TOKEN"]
 
 # --- App ---
 APP_SECRET_KEY = os.environ["APP_SECRET_KEY"]
+# Empty or sqlite:///path -> SQLite; postgresql://... -> Postgres via asyncpg
+DATABASE_URL = os.getenv("DATABASE_URL", "")
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/collective.db")
+DATABASE_READERS = int(os.getenv("DATABASE_READERS", "4"))
+DATABASE_BUSY_TIMEOUT_MS = int(os.getenv("DATABASE_BUSY_TIMEOUT_MS", "5000"))
+DATABASE_STATEMENT_CACHE = int(os.getenv("DATABASE_STATEMENT_CACHE", "256"))
+DATABASE_WRITE_BATCH = int(os.getenv("DATABASE_WRITE_BATCH", "64"))  # writes per group commit
+DATABASE_CACHE_SIZE = int(os.getenv("DATABASE_CACHE_SIZE", "4096"))  # entries per cache
+DATABASE_CACHE_TTL = float(os.getenv("DATABASE_CACHE_TTL", "30"))  # seconds
+DATABASE_METRICS = os.getenv("DATABASE_METRICS", "").lower() in ("1", "true", "yes")
+DATABASE_SLOW_QUERY_MS = float(os.getenv("DATABASE_SLOW_QUERY_MS", "100"))
+DATABASE_BACKUP_DIR = os.getenv("DATABASE_BACKUP_DIR", "./data/backups")
+DATABASE_BACKUP_INTERVAL = float(os.getenv("DATABASE_BACKUP_INTERVAL", "0"))  # seconds, 0 = off
+DATABASE_BACKUP_KEEP = int(os.getenv("DATABASE_BACKUP_KEEP", "7"))  # snapshots retained
+DATABASE_BACKUP_PAGES = int(os.getenv("DATABASE_BACKUP_PAGES", "256"))  # pages per backup step (non-WAL)
+DATABASE_ARCHIVE_INTERVAL = float(os.getenv("DATABASE_ARCHIVE_INTERVAL", "86400"))  # seconds, 0 = off
+DATABASE_ARCHIVE_AFTER_DAYS = float(os.getenv("DATABASE_ARCHIVE_AFTER_DAYS", "90"))
+DATABASE_ARCHIVE_BATCH = int(os.getenv("DATABASE_ARCHIVE_BATCH", "500"))  # rows moved per write
 
 # --- Network ---
 NET = os.getenv("STELLAR_NETWORK", "testnet")
@@ -61,7 +78,40 @@ CONTRACTS = {
 }
 
 # --- IPFS/Kubo ---
+# http(s)://host:port/api/v0, or unix:///path/to/api.sock for a Unix socket
 KUBO_API = os.getenv("KUBO_API", "http://127.0.0.1:5001/api/v0")
+IPFS_CID_VERSION = int(os.getenv("IPFS_CID_VERSION", "0"))  # 0 = Qm..., 1 = bafy.../bafk... (raw leaves)
+KUBO_MAX_CONNECTIONS = int(os.getenv("KUBO_MAX_CONNECTIONS", "32"))  # pooled keep-alive connections
+# Other gateway nodes that replicate every pin and IPNS publish (comma-separated API URLs)
+KUBO_REPLICAS = [api.strip() for api in os.getenv("KUBO_REPLICAS", "").split(",") if api.strip()]
+# IPFS_PATH of each replica, in KUBO_REPLICAS order, where its keystore is readable from this host
+KUBO_REPLICA_REPOS = [path.strip() for path in os.getenv("KUBO_REPLICA_REPOS", "").split(",")]
+KUBO_WRITE_POLICY = os.getenv("KUBO_WRITE_POLICY", "best-effort")  # or "quorum" (majority of nodes)
+KUBO_BREAKER_FAILURES = int(os.getenv("KUBO_BREAKER_FAILURES", "3"))  # consecutive errors that trip a node
+KUBO_BREAKER_COOLDOWN = float(os.getenv("KUBO_BREAKER_COOLDOWN", "30"))  # seconds before a tripped node is retried
+KUBO_RECONCILE_INTERVAL = float(os.getenv("KUBO_RECONCILE_INTERVAL", "60"))  # seconds between replica repairs, 0 = off
+KUBO_CONNECT_TIMEOUT = float(os.getenv("KUBO_CONNECT_TIMEOUT", "2"))  # seconds to connect to a node
+KUBO_READ_TIMEOUT = float(os.getenv("KUBO_READ_TIMEOUT", "5"))  # cat, name/resolve, routing/get
+KUBO_WRITE_TIMEOUT = float(os.getenv("KUBO_WRITE_TIMEOUT", "30"))  # add, pin, key and other calls
+KUBO_LONG_TIMEOUT = float(os.getenv("KUBO_LONG_TIMEOUT", "120"))  # name/publish, repo/gc, batches
+LINKTREE_FETCH_BUDGET = float(os.getenv("LINKTREE_FETCH_BUDGET", "2"))  # seconds a visitor waits on IPFS
+IPNS_SIGNING = os.getenv("IPNS_SIGNING", "local")  # "local" (app-signed records) or "kubo" (Kubo keystore)
+IPNS_RECORD_LIFETIME = float(os.getenv("IPNS_RECORD_LIFETIME", "172800"))  # seconds a signed record stays valid
+IPNS_RECORD_TTL = float(os.getenv("IPNS_RECORD_TTL", "300"))  # seconds resolvers may cache a record
+IPNS_REFRESH_INTERVAL = float(os.getenv("IPNS_REFRESH_INTERVAL", "3600"))  # seconds between expiry sweeps, 0 = off
+IPNS_SIGN_PROCESSES = int(os.getenv("IPNS_SIGN_PROCESSES", "0"))  # record-signing worker processes, 0 = inline
+REPUBLISH_DEBOUNCE = float(os.getenv("REPUBLISH_DEBOUNCE", "2"))  # seconds of quiet before publishing
+REPUBLISH_CONCURRENCY = int(os.getenv("REPUBLISH_CONCURRENCY", "4"))  # publishes in flight, all users
+REPUBLISH_RETRY_DELAY = float(os.getenv("REPUBLISH_RETRY_DELAY", "30"))  # seconds before the first retry, doubling
+REPUBLISH_RETRIES = int(os.getenv("REPUBLISH_RETRIES", "5"))  # retries before waiting for the next restart
+IPFS_GC_INTERVAL = float(os.getenv("IPFS_GC_INTERVAL", "86400"))  # seconds between repo/gc runs, 0 = off
+IPFS_CAT_CACHE_MB = float(os.getenv("IPFS_CAT_CACHE_MB", "64"))  # in-memory ipfs_cat cache size
+IPFS_CAT_CACHE_DIR = os.getenv("IPFS_CAT_CACHE_DIR", "")  # on-disk ipfs_cat cache, empty = off
+IPFS_CAT_CACHE_DISK_MB = float(os.getenv("IPFS_CAT_CACHE_DISK_MB", "1024"))  # on-disk cache size, 0 = unbounded
+IPFS_GC_THRESHOLD_MB = float(os.getenv("IPFS_GC_THRESHOLD_MB", "256"))  # unpinned MB that triggers gc early
+IPFS_UNPIN_INTERVAL = float(os.getenv("IPFS_UNPIN_INTERVAL", "60"))  # seconds between batched unpins, 0 = off
+IPFS_UNPIN_GRACE = float(os.getenv("IPFS_UNPIN_GRACE", "300"))  # seconds an unreferenced CID stays pinned
+IPFS_PIN_AUDIT_INTERVAL = float(os.getenv("IPFS_PIN_AUDIT_INTERVAL", "86400"))  # seconds between pin/ls audits, 0 = off
 KUBO_GATEWAY = os.getenv("KUBO_GATEWAY", "http://127.0.0.1:8081")
 
 # --- Denomination Wallets ---
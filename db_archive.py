@@ -0,0 +1,69 @@
+"""Periodic move of cold rows into the archive tables.
+
+See ``db.archive_cold_rows``: spent/discarded denom wallets, completed
+payments and delivered card orders older than DATABASE_ARCHIVE_AFTER_DAYS
+leave the hot tables, and stay readable through the ``<table>_all`` views.
+
+Runs every DATABASE_ARCHIVE_INTERVAL seconds from the app, or once from the
+command line::
+
+    python db_archive.py [--days N]
+"""
+
+import argparse
+import asyncio
+
+import db
+from config import DATABASE_ARCHIVE_AFTER_DAYS, DATABASE_ARCHIVE_INTERVAL
+
+_scheduler = None
+
+
+async def _archive_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await db.archive_cold_rows()
+        except Exception:
+            pass  # Try again next interval; never take the app down
+
+
+def start_scheduler(interval=DATABASE_ARCHIVE_INTERVAL):
+    """Start the periodic archive task (registered with ``app.on_startup``;
+    a no-op when the interval is 0)."""
+    global _scheduler
+    if interval <= 0 or _scheduler is not None:
+        return
+    _scheduler = asyncio.create_task(_archive_loop(interval))
+
+
+async def stop_scheduler():
+    global _scheduler
+    task, _scheduler = _scheduler, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+async def _run(days):
+    await db.init_db()
+    try:
+        return await db.archive_cold_rows(older_than_days=days)
+    finally:
+        await db.close_pool()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move cold rows into the archive tables.')
+    parser.add_argument('--days', type=float, default=DATABASE_ARCHIVE_AFTER_DAYS,
+                        help='archive rows finished more than this many days ago')
+    args = parser.parse_args(argv)
+    for table, moved in asyncio.run(_run(args.days)).items():
+        print(f'{table}: {moved}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Online snapshots of the SQLite database.
+
+Snapshots are taken with SQLite's backup API. A WAL-mode database (the
+app's) is copied in one step from a read snapshot, which never blocks
+writers. Other journal modes copy a few pages per step and release the
+source lock between steps; a write in between restarts the copy, so it
+gives up after MAX_RESTARTS. The copy itself runs in a worker thread, so
+the event loop is never blocked.
+
+Run from the app via ``start_scheduler`` (DATABASE_BACKUP_INTERVAL) or as a
+CLI::
+
+    python db_backup.py backup [--dir DIR] [--keep N] [--no-compress]
+    python db_backup.py verify SNAPSHOT
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from config import (
+    DATABASE_PATH, DATABASE_BACKUP_DIR, DATABASE_BACKUP_KEEP,
+    DATABASE_BACKUP_INTERVAL, DATABASE_BACKUP_PAGES, DATABASE_BUSY_TIMEOUT_MS,
+)
+
+# Pause between backup steps, giving writers a window on the source file
+STEP_SLEEP = 0.05
+# Incremental copies that start over more often than this are abandoned
+MAX_RESTARTS = 5
+
+_scheduler = None
+
+
+def _snapshot_name(source):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    return f'{stem}-{stamp}.db'
+
+
+def _copy(source, dest, pages):
+    src = sqlite3.connect(f'file:{source}?mode=ro', uri=True,
+                          timeout=DATABASE_BUSY_TIMEOUT_MS / 1000)
+    try:
+        mode = src.execute('PRAGMA journal_mode').fetchone()[0]
+        if mode.lower() == 'wal':
+            # One step reads a consistent snapshot while writers go on;
+            # stepping would restart after every commit
+            pages = -1
+        left, restarts = None, 0
+
+        def progress(status, remaining, total):
+            nonlocal left, restarts
+            if left is not None and remaining > left:
+                restarts += 1
+                if restarts > MAX_RESTARTS:
+                    raise sqlite3.OperationalError(
+                        f'backup restarted {restarts} times; source is written too often'
+                    )
+            left = remaining
+
+        dst = sqlite3.connect(dest)
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=STEP_SLEEP)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+
+def _compress(path):
+    with open(path, 'rb') as raw, gzip.open(path + '.gz', 'wb') as packed:
+        shutil.copyfileobj(raw, packed)
+    os.remove(path)
+    return path + '.gz'
+
+
+def snapshots(dest_dir=DATABASE_BACKUP_DIR, source=DATABASE_PATH):
+    """Existing snapshots of ``source`` in ``dest_dir``, oldest first."""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    paths = glob.glob(os.path.join(dest_dir, f'{stem}-*.db')) + \
+        glob.glob(os.path.join(dest_dir, f'{stem}-*.db.gz'))
+    return sorted(paths, key=os.path.basename)
+
+
+def prune(dest_dir=DATABASE_BACKUP_DIR, keep=DATABASE_BACKUP_KEEP, source=DATABASE_PATH):
+    """Delete all but the newest ``keep`` snapshots; returns removed paths."""
+    existing = snapshots(dest_dir, source)
+    stale = existing[:-keep] if keep > 0 else []
+    for path in stale:
+        os.remove(path)
+    return stale
+
+
+async def backup(dest_dir=DATABASE_BACKUP_DIR, *, source=DATABASE_PATH,
+                 compress=True, keep=DATABASE_BACKUP_KEEP, pages=DATABASE_BACKUP_PAGES):
+    """Write a timestamped snapshot of ``source`` and apply retention.
+
+    Returns the snapshot path. Only the SQLite backend can be snapshotted
+    this way; use pg_dump for Postgres.
+    """
+    import db
+    if db.DIALECT != 'sqlite':
+        raise RuntimeError('Online backup is only available for the SQLite backend')
+    os.makedirs(dest_dir, exist_ok=True)
+    final = os.path.join(dest_dir, _snapshot_name(source))
+    # Build under a temp name so a half-written file never looks like a snapshot
+    partial = final + '.partial'
+    try:
+        await asyncio.to_thread(_copy, source, partial, pages)
+        os.replace(partial, final)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    if compress:
+        final = await asyncio.to_thread(_compress, final)
+    prune(dest_dir, keep, source)
+    return final
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        messages = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        try:
+            version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+        except sqlite3.DatabaseError:
+            version = None
+    finally:
+        conn.close()
+    return {'ok': messages == ['ok'], 'messages': messages, 'schema_version': version}
+
+
+def _verify(path):
+    if not path.endswith('.gz'):
+        return _integrity_check(path)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, 'snapshot.db')
+        with gzip.open(path, 'rb') as packed, open(plain, 'wb') as raw:
+            shutil.copyfileobj(packed, raw)
+        return _integrity_check(plain)
+
+
+async def verify(path):
+    """Open a snapshot (plain or .gz) and run ``PRAGMA integrity_check``.
+
+    Returns ``{'ok': bool, 'messages': [...], 'schema_version': int|None}``.
+    """
+    try:
+        return await asyncio.to_thread(_verify, path)
+    except (sqlite3.DatabaseError, OSError) as exc:
+        return {'ok': False, 'messages': [str(exc)], 'schema_version': None}
+
+
+# -- scheduling --
+
+async def _backup_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await backup()
+        except Exception:
+            pass  # Try again next interval; never take the app down
+
+
+def start_scheduler(interval=DATABASE_BACKUP_INTERVAL):
+    """Start periodic backups every ``interval`` seconds (registered with
+    ``app.on_startup``; a no-op when the interval is 0 or Postgres is used)."""
+    global _scheduler
+    import db
+    if interval <= 0 or db.DIALECT != 'sqlite' or _scheduler is not None:
+        return
+    _scheduler = asyncio.create_task(_backup_loop(interval))
+
+
+async def stop_scheduler():
+    global _scheduler
+    task, _scheduler = _scheduler, None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Snapshot or verify the collective database.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    take = sub.add_parser('backup', help='write a snapshot of DATABASE_PATH')
+    take.add_argument('--dir', default=DATABASE_BACKUP_DIR)
+    take.add_argument('--keep', type=int, default=DATABASE_BACKUP_KEEP)
+    take.add_argument('--no-compress', action='store_true')
+    check = sub.add_parser('verify', help='run an integrity check on a snapshot')
+    check.add_argument('snapshot')
+    args = parser.parse_args(argv)
+
+    if args.command == 'backup':
+        path = asyncio.run(backup(args.dir, compress=not args.no_compress, keep=args.keep))
+        print(path)
+        return 0
+    result = asyncio.run(verify(args.snapshot))
+    print('\n'.join(result['messages']))
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
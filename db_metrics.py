@@ -0,0 +1,284 @@
+"""Opt-in instrumentation for db.py.
+
+When ``DATABASE_METRICS`` is on, every public db function records call
+count, errors, a latency histogram, rows returned and time spent waiting
+for a pooled connection. Individual statements slower than
+``DATABASE_SLOW_QUERY_MS`` land in a bounded slow-query log together with
+their query plan, and queries are also tallied per page (see
+``page_scope``). ``registry.snapshot()`` returns everything as plain data.
+"""
+
+import functools
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import DATABASE_METRICS, DATABASE_SLOW_QUERY_MS
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float('inf'))
+SLOW_LOG_SIZE = 200
+
+_current_call = ContextVar('db_metrics_call', default=None)
+_current_page = ContextVar('db_metrics_page', default=None)
+
+
+def _histogram():
+    return [0] * len(BUCKETS_MS)
+
+
+def _observe(histogram, ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            histogram[i] += 1
+            return
+
+
+class _FunctionStats:
+    __slots__ = ('calls', 'errors', 'total_ms', 'max_ms', 'rows', 'wait_ms',
+                 'queries', 'histogram')
+
+    def __init__(self):
+        self.calls = self.errors = self.rows = self.queries = 0
+        self.total_ms = self.max_ms = self.wait_ms = 0.0
+        self.histogram = _histogram()
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'rows': self.rows,
+            'queries': self.queries,
+            'wait_ms': round(self.wait_ms, 3),
+            'histogram': dict(zip(map(str, BUCKETS_MS), self.histogram)),
+        }
+
+
+class _Call:
+    """Per-invocation accumulator for one instrumented db function."""
+
+    __slots__ = ('name', 'wait_ms', 'queries')
+
+    def __init__(self, name):
+        self.name = name
+        self.wait_ms = 0.0
+        self.queries = 0
+
+
+class PageScope:
+    """Queries issued while serving one request (see ``page_scope``)."""
+
+    __slots__ = ('calls', 'queries', 'db_ms')
+
+    def __init__(self):
+        self.calls = self.queries = 0
+        self.db_ms = 0.0
+
+
+class Registry:
+    def __init__(self, enabled=DATABASE_METRICS, slow_ms=DATABASE_SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.reset()
+
+    def reset(self):
+        self.functions = {}
+        self.pages = {}
+        self.pool_wait_ms = 0.0
+        self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+
+    def record_call(self, name, ms, call, rows, error=False):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = _FunctionStats()
+        stats.calls += 1
+        stats.errors += error
+        stats.total_ms += ms
+        stats.max_ms = max(stats.max_ms, ms)
+        stats.rows += rows or 0
+        stats.queries += call.queries
+        stats.wait_ms += call.wait_ms
+        _observe(stats.histogram, ms)
+        page = _current_page.get()
+        if page is not None:
+            page.calls += 1
+            page.queries += call.queries
+            # Nested db calls (one helper calling another) would double count
+            if _current_call.get() is None:
+                page.db_ms += ms
+
+    def record_page(self, route, scope):
+        if not scope.calls:
+            return
+        stats = self.pages.setdefault(
+            route, {'requests': 0, 'calls': 0, 'queries': 0, 'max_queries': 0, 'db_ms': 0.0}
+        )
+        stats['requests'] += 1
+        stats['calls'] += scope.calls
+        stats['queries'] += scope.queries
+        stats['max_queries'] = max(stats['max_queries'], scope.queries)
+        stats['db_ms'] = round(stats['db_ms'] + scope.db_ms, 3)
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'slow_query_ms': self.slow_ms,
+            'pool_wait_ms': round(self.pool_wait_ms, 3),
+            'functions': {name: s.as_dict() for name, s in sorted(self.functions.items())},
+            'pages': dict(self.pages),
+            'slow_queries': list(self.slow_queries),
+        }
+
+
+registry = Registry()
+
+
+def _row_count(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) or hasattr(result, 'keys'):
+        return 1  # a single record / row
+    return 0
+
+
+def instrumented(fn):
+    """Wrap a db coroutine function so calls are recorded when enabled."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not registry.enabled:
+            return await fn(*args, **kwargs)
+        call = _Call(name)
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            _current_call.reset(token)
+            registry.record_call(name, (time.perf_counter() - start) * 1000, call, 0, error=True)
+            raise
+        _current_call.reset(token)
+        registry.record_call(name, (time.perf_counter() - start) * 1000, call, _row_count(result))
+        return result
+
+    return wrapper
+
+
+def record_wait(seconds):
+    """Time a caller spent waiting for a pooled connection."""
+    if not registry.enabled:
+        return
+    ms = seconds * 1000
+    registry.pool_wait_ms += ms
+    call = _current_call.get()
+    if call is not None:
+        call.wait_ms += ms
+
+
+@contextmanager
+def page_scope():
+    """Attribute db calls made inside the block to one page/request."""
+    scope = PageScope()
+    token = _current_page.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_page.reset(token)
+
+
+# -- statement timing --
+
+_EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+
+class _TimedResult:
+    """Stands in for ``conn.execute()``'s awaitable / async-context result."""
+
+    def __init__(self, timed, sql, params):
+        self._timed, self._sql, self._params = timed, sql, params
+        self._cm = None
+        self._start = 0.0
+
+    def __await__(self):
+        return self._timed._run(self._timed.conn.execute(self._sql, self._params),
+                                self._sql, self._params).__await__()
+
+    async def __aenter__(self):
+        self._start = time.perf_counter()
+        self._cm = self._timed.conn.execute(self._sql, self._params)
+        return await self._cm.__aenter__()
+
+    async def __aexit__(self, *exc):
+        try:
+            return await self._cm.__aexit__(*exc)
+        finally:
+            await self._timed._finish(self._start, self._sql, self._params)
+
+
+class TimedConnection:
+    """Connection proxy that times each statement and feeds the slow log."""
+
+    def __init__(self, conn, dialect):
+        self.conn = conn
+        self.dialect = dialect
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def execute(self, sql, params=()):
+        return _TimedResult(self, sql, params)
+
+    async def execute_fetchall(self, sql, params=()):
+        return await self._run(self.conn.execute_fetchall(sql, params), sql, params)
+
+    async def executemany(self, sql, params):
+        return await self._run(self.conn.executemany(sql, params), sql, None)
+
+    async def executescript(self, script):
+        return await self._run(self.conn.executescript(script), script, None)
+
+    async def _run(self, awaitable, sql, params):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            await self._finish(start, sql, params)
+
+    async def _finish(self, start, sql, params):
+        ms = (time.perf_counter() - start) * 1000
+        call = _current_call.get()
+        if call is not None:
+            call.queries += 1
+        if ms < registry.slow_ms:
+            return
+        registry.slow_queries.append({
+            'function': call.name if call is not None else None,
+            'ms': round(ms, 3),
+            'sql': ' '.join(sql.split()),
+            'plan': await self._explain(sql, params),
+            'at': time.time(),
+        })
+
+    async def _explain(self, sql, params):
+        if params is None or not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        prefix = 'EXPLAIN QUERY PLAN ' if self.dialect == 'sqlite' else 'EXPLAIN '
+        try:
+            rows = await self.conn.execute_fetchall(prefix + sql, params)
+        except Exception as exc:  # the plan is best-effort diagnostics
+            return f'unavailable: {exc}'
+        return [row[-1] for row in rows]
+
+
+def wrap_connection(conn, dialect):
+    """Return ``conn`` wrapped for statement timing when metrics are on."""
+    if not registry.enabled or isinstance(conn, TimedConnection):
+        return conn
+    return TimedConnection(conn, dialect)
@@ -0,0 +1,214 @@
+"""asyncpg-backed connection pool for running db.py against PostgreSQL.
+
+Selected by a ``postgres://`` / ``postgresql://`` DATABASE_URL. It exposes
+the same interface as ``db.ConnectionPool`` (``reader()``, ``writer()``,
+``transaction()``, ``after_transaction()``, ``open()``, ``close()``) and
+hands out connections that speak the small aiosqlite surface db.py uses
+(``execute``, ``execute_fetchall``, ``executemany``, ``executescript``), so
+every query helper runs unchanged on either backend.
+"""
+
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import asyncpg
+
+import db_metrics
+from config import DATABASE_READERS, DATABASE_STATEMENT_CACHE
+
+
+@lru_cache(maxsize=1024)
+def _translate(sql):
+    """Rewrite qmark placeholders as $1, $2, ... (skipping quoted text)."""
+    out, n, quote = [], 0, None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '?':
+            n += 1
+            out.append(f'${n}')
+            continue
+        out.append(ch)
+    return ''.join(out)
+
+
+class _Cursor:
+    """Awaitable / async-context result of ``PgConnection.execute``."""
+
+    row_factory = None  # asyncpg Records are already tuple-like
+
+    def __init__(self, conn, sql, params):
+        self._conn, self._sql, self._params = conn, sql, params
+        self._rows = None
+
+    @property
+    def description(self):
+        # Only the column names are used (db._columns); they are only
+        # needed when there is at least one row to decode
+        keys = self._rows[0].keys() if self._rows else ()
+        return tuple((key, None, None, None, None, None, None) for key in keys)
+
+    async def _run(self):
+        self._rows = await self._conn.fetch(self._sql, *self._params)
+        return self
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        return await self._run()
+
+    async def __aexit__(self, *exc):
+        self._rows = None
+
+    async def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    async def fetchall(self):
+        return list(self._rows)
+
+
+class PgConnection:
+    """aiosqlite-shaped wrapper around an asyncpg connection."""
+
+    def __init__(self, conn):
+        self.raw = conn
+
+    def execute(self, sql, params=()):
+        return _Cursor(self.raw, _translate(sql), tuple(params))
+
+    async def execute_fetchall(self, sql, params=()):
+        return await self.raw.fetch(_translate(sql), *params)
+
+    async def executemany(self, sql, params):
+        params = [tuple(p) for p in params]
+        if params:
+            await self.raw.executemany(_translate(sql), params)
+
+    async def executescript(self, script):
+        # No parameters: asyncpg sends it as one simple-query message
+        await self.raw.execute(script)
+
+
+async def _init_connection(conn):
+    # Hand timestamps back as text, matching what SQLite returns
+    await conn.set_type_codec(
+        'timestamp', schema='pg_catalog', encoder=str, decoder=str, format='text',
+    )
+
+
+class PostgresPool:
+    """asyncpg connection pool behind the ``db.ConnectionPool`` interface.
+
+    Each ``writer()`` block runs in its own transaction on a pooled
+    connection; Postgres handles concurrent writers itself, so there is no
+    writer task. Statements are prepared and cached per connection by
+    asyncpg (``DATABASE_STATEMENT_CACHE`` entries).
+    """
+
+    dialect = 'postgres'
+    IntegrityError = asyncpg.exceptions.IntegrityConstraintViolationError
+
+    def __init__(self, dsn, size=DATABASE_READERS + 1):
+        self.dsn = dsn
+        self.size = max(1, size)
+        self._pool = None
+        self._loop = None
+        self._open_lock = asyncio.Lock()
+        # (connection, after-exit callbacks) of the transaction owned by
+        # the current task, if any
+        self._tx = contextvars.ContextVar('db_transaction', default=None)
+
+    @property
+    def in_transaction(self):
+        return self._tx.get() is not None
+
+    @property
+    def is_open(self):
+        return self._pool is not None
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._pool = await asyncpg.create_pool(
+            self.dsn, min_size=1, max_size=self.size,
+            statement_cache_size=DATABASE_STATEMENT_CACHE,
+            init=_init_connection,
+        )
+        self._loop = asyncio.get_running_loop()
+
+    async def close(self):
+        pool, loop = self._pool, self._loop
+        self._pool, self._loop = None, None
+        self._open_lock = asyncio.Lock()
+        if pool is None:
+            return
+        if loop is asyncio.get_running_loop():
+            await pool.close()
+        else:
+            pool.terminate()
+
+    async def _ensure_open(self):
+        if self._pool is not None and self._loop is not asyncio.get_running_loop():
+            # asyncpg pools are bound to the loop that created them
+            await self.close()
+        if not self.is_open:
+            async with self._open_lock:
+                await self.open()
+
+    @asynccontextmanager
+    async def reader(self):
+        tx = self._tx.get()
+        if tx is not None:
+            yield tx[0]
+            return
+        await self._ensure_open()
+        start = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            db_metrics.record_wait(time.perf_counter() - start)
+            yield db_metrics.wrap_connection(PgConnection(conn), self.dialect)
+
+    @asynccontextmanager
+    async def writer(self, *, exclusive=False):
+        """Run the block in a transaction; commit on success, roll back on
+        error. ``exclusive`` is accepted for interface parity with SQLite."""
+        tx = self._tx.get()
+        if tx is not None:
+            yield tx[0]
+            return
+        await self._ensure_open()
+        start = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            db_metrics.record_wait(time.perf_counter() - start)
+            async with conn.transaction():
+                yield db_metrics.wrap_connection(PgConnection(conn), self.dialect)
+
+    @asynccontextmanager
+    async def transaction(self):
+        if self._tx.get() is not None:
+            yield self._tx.get()[0]
+            return
+        callbacks = []
+        try:
+            async with self.writer() as conn:
+                token = self._tx.set((conn, callbacks))
+                try:
+                    yield conn
+                finally:
+                    self._tx.reset(token)
+        finally:
+            for callback in callbacks:
+                callback()
+
+    def after_transaction(self, callback):
+        tx = self._tx.get()
+        if tx is None:
+            callback()
+        else:
+            tx[1].append(callback)
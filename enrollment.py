@@ -3,21 +3,28 @@ from stellar_sdk import Keypair
 from hvym_stellar import Stellar25519KeyPair, StellarSharedKey
 import db
 import ipfs_client
+import ipns_record
 from auth import hash_password
 from email_service import send_welcome_email
-from config import BANKER_25519, GUARDIAN_25519, NET
+from config import BANKER_25519, GUARDIAN_25519, NET, IPNS_SIGNING
 from stellar_ops import fund_account, register_on_roster
 
 
 async def _setup_ipns(user_id, moniker, member_type, stellar_address=None):
     """Generate IPNS key, publish initial linktree, store in DB."""
     key_name = f"{user_id}-linktree"
-    ipns_name = await ipfs_client.ipns_key_gen(key_name)
-
-    # Export key and encrypt with Guardian for backup
-    key_bytes = await ipfs_client.ipns_key_export(key_name)
-    encryptor = StellarSharedKey(BANKER_25519, GUARDIAN_25519.public_key())
-    encrypted_backup = encryptor.encrypt(key_bytes)
+    if IPNS_SIGNING == 'local':
+        # The app holds the key and signs records itself; Kubo never sees it
+        node = None
+        key_bytes = ipns_record.generate_key()
+        ipns_name = ipns_record.ipns_name(key_bytes)
+    else:
+        node = ipfs_client.place_key(key_name)
+        ipns_name = await ipfs_client.ipns_key_gen(key_name, node)
+        key_bytes = await ipfs_client.ipns_key_export(key_name, node)
+
+    # Encrypt with Guardian for backup
+    encrypted_backup = ipfs_client.encrypt_key_backup(key_bytes)
 
     # Build initial (empty) linktree JSON
     initial_linktree = ipfs_client.build_linktree_json(
@@ -27,15 +34,19 @@ async def _setup_ipns(user_id, moniker, member_type, stellar_address=None):
         links=[],
         colors=None,
     )
-    new_cid, _ = await ipfs_client.publish_linktree(key_name, initial_linktree)
+    new_cid, _ = await ipfs_client.publish_linktree(
+        key_name, initial_linktree, placement=node, user_id=user_id,
+        private_key=key_bytes if IPNS_SIGNING == 'local' else None,
+    )
 
     # Update user record with IPNS data
     await db.update_user(
         user_id,
         ipns_key_name=key_name,
         ipns_name=ipns_name,
+        ipns_node=node,
         linktree_cid=new_cid,
-        ipns_key_backup=encrypted_backup.decode() if isinstance(encrypted_backup, bytes) else encrypted_backup,
+        ipns_key_backup=encrypted_backup,
     )
     return ipns_name
 
@@ -79,31 +90,30 @@ async def process_paid_enrollment(email, moniker, password_hash, order_id,
     encryptor = StellarSharedKey(BANKER_25519, GUARDIAN_25519.public_key())
     encrypted_secret = encryptor.encrypt(user_keys.secret.encode())
 
-    # 4. Store user record
+    # 4-5. Store user + payment records atomically (one commit)
     user_id = str(uuid.uuid4())
-    await db.create_user(
-        user_id=user_id,
-        email=email.strip(),
-        moniker=moniker.strip(),
-        member_type=tier_key,
-        password_hash=password_hash,
-        stellar_address=user_keys.public_key,
-        shared_pub=user_25519.public_key(),
-        encrypted_token=encrypted_secret.decode() if isinstance(encrypted_secret, bytes) else encrypted_secret,
-        network=NET,
-    )
-
-    # 5. Store payment record
     price_usd = get_tier_price(tier_key, payment_method if payment_method == 'stellar' else 'card', 'join')
-    await db.create_payment(
-        user_id=user_id,
-        method=payment_method,
-        amount=str(price_usd),
-        xlm_price_usd=xlm_price_usd,
-        memo=order_id,
-        tx_hash=tx_hash,
-        status='completed',
-    )
+    async with db.transaction():
+        await db.create_user(
+            user_id=user_id,
+            email=email.strip(),
+            moniker=moniker.strip(),
+            member_type=tier_key,
+            password_hash=password_hash,
+            stellar_address=user_keys.public_key,
+            shared_pub=user_25519.public_key(),
+            encrypted_token=encrypted_secret.decode() if isinstance(encrypted_secret, bytes) else encrypted_secret,
+            network=NET,
+        )
+        await db.create_payment(
+            user_id=user_id,
+            method=payment_method,
+            amount=str(price_usd),
+            xlm_price_usd=xlm_price_usd,
+            memo=order_id,
+            tx_hash=tx_hash,
+            status='completed',
+        )
 
     # 6. Register on roster contract
     try:
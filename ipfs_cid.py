@@ -0,0 +1,156 @@
+"""Compute IPFS CIDs locally, the way Kubo's ``ipfs add`` does.
+
+``compute_cid(data)`` returns the CID Kubo assigns to ``data`` added as a
+single file (no wrapping directory) with the parameters in ``ADD_PARAMS``:
+fixed-size 256 KiB chunks, balanced DAG layout with at most 174 links per
+node, dag-pb/UnixFS nodes and sha2-256. CIDv0 uses dag-pb leaves; CIDv1
+defaults to raw leaves, as Kubo does. ``ipfs_client`` sends the same
+parameters with every add so the two always agree.
+"""
+
+import base64
+import hashlib
+
+CHUNK_SIZE = 262144
+MAX_LINKS = 174
+
+DAG_PB = 0x70
+RAW = 0x55
+
+_SHA2_256 = 0x12
+_UNIXFS_FILE = 2
+_B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def add_params(cid_version: int = 0, raw_leaves: bool | None = None) -> dict:
+    """Kubo ``/add`` query parameters matching ``compute_cid``."""
+    if raw_leaves is None:
+        raw_leaves = cid_version == 1
+    return {
+        "cid-version": str(cid_version),
+        "raw-leaves": "true" if raw_leaves else "false",
+        "chunker": f"size-{CHUNK_SIZE}",
+    }
+
+
+# ── Encoding ──
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _uint_field(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _bytes_field(number: int, value: bytes) -> bytes:
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _unixfs_file(data: bytes, filesize: int, blocksizes=()) -> bytes:
+    out = _uint_field(1, _UNIXFS_FILE)
+    if data:
+        out += _bytes_field(2, data)
+    out += _uint_field(3, filesize)
+    for size in blocksizes:
+        out += _uint_field(4, size)
+    return out
+
+
+def _pb_node(unixfs: bytes, links=()) -> bytes:
+    """dag-pb PBNode; canonical form puts Links before Data."""
+    out = b"".join(
+        _bytes_field(2, _bytes_field(1, cid) + _bytes_field(2, b"") + _uint_field(3, tsize))
+        for cid, tsize in links
+    )
+    return out + _bytes_field(1, unixfs)
+
+
+def _base58(raw: bytes) -> str:
+    n = int.from_bytes(raw, "big")
+    out = ""
+    while n:
+        n, rem = divmod(n, 58)
+        out = _B58_ALPHABET[rem] + out
+    pad = len(raw) - len(raw.lstrip(b"\0"))
+    return "1" * pad + out
+
+
+class _Builder:
+    def __init__(self, cid_version: int, raw_leaves: bool):
+        self.cid_version = cid_version
+        self.raw_leaves = raw_leaves
+
+    def cid(self, block: bytes, codec: int) -> bytes:
+        """Binary CID of ``block`` (CIDv0 is the bare multihash)."""
+        multihash = bytes([_SHA2_256, 32]) + hashlib.sha256(block).digest()
+        if self.cid_version == 0:
+            return multihash
+        return _varint(1) + _varint(codec) + multihash
+
+    def leaf(self, chunk: bytes):
+        """(cid, tsize, filesize) of one leaf."""
+        if self.raw_leaves:
+            return self.cid(chunk, RAW), len(chunk), len(chunk)
+        block = _pb_node(_unixfs_file(chunk, len(chunk)))
+        return self.cid(block, DAG_PB), len(block), len(chunk)
+
+    def branch(self, children):
+        """(cid, tsize, filesize) of an internal node over ``children``."""
+        filesize = sum(child[2] for child in children)
+        block = _pb_node(
+            _unixfs_file(b"", filesize, [child[2] for child in children]),
+            [(child[0], child[1]) for child in children],
+        )
+        tsize = len(block) + sum(child[1] for child in children)
+        return self.cid(block, DAG_PB), tsize, filesize
+
+
+def _balanced(builder: _Builder, chunks):
+    """Balanced layout: each new root adopts the previous (full) root as its
+    first child and fills the rest with subtrees of the same depth."""
+    root = builder.leaf(next(chunks))
+    pending = [next(chunks, None)]
+
+    def take():
+        chunk, pending[0] = pending[0], next(chunks, None)
+        return chunk
+
+    def fill(children, depth):
+        while len(children) < MAX_LINKS and pending[0] is not None:
+            if depth == 1:
+                children.append(builder.leaf(take()))
+            else:
+                children.append(builder.branch(fill([], depth - 1)))
+        return children
+
+    depth = 1
+    while pending[0] is not None:
+        root = builder.branch(fill([root], depth))
+        depth += 1
+    return root
+
+
+def compute_cid(data: bytes, cid_version: int = 0, raw_leaves: bool | None = None) -> str:
+    """The CID Kubo returns for ``/add`` of ``data`` with ``add_params``."""
+    if raw_leaves is None:
+        raw_leaves = cid_version == 1
+    if cid_version == 0 and raw_leaves:
+        raise ValueError("CIDv0 cannot address raw leaves")
+    builder = _Builder(cid_version, raw_leaves)
+    chunks = (data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE))
+    if not data:
+        cid = builder.leaf(b"")[0]
+    else:
+        cid = _balanced(builder, chunks)[0]
+    if cid_version == 0:
+        return _base58(cid)
+    return "b" + base64.b32encode(cid).decode().lower().rstrip("=")
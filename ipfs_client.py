@@ -2,143 +2,944 @@
 
 import asyncio
 import base64
+import bisect
+import hashlib
 import json
 import os
+import socket
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 import httpx
-from config import KUBO_API
+from hvym_stellar import StellarSharedKey, StellarSharedDecryption
+import ipfs_cid
+import ipns_record
+from config import (
+    BANKER_25519, GUARDIAN_25519, BANKER_KP,
+    IPNS_SIGNING, IPNS_RECORD_LIFETIME, IPNS_RECORD_TTL, IPNS_REFRESH_INTERVAL,
+    IPNS_SIGN_PROCESSES,
+    KUBO_API, KUBO_REPLICAS, KUBO_REPLICA_REPOS, KUBO_WRITE_POLICY, KUBO_BREAKER_FAILURES,
+    KUBO_BREAKER_COOLDOWN, KUBO_RECONCILE_INTERVAL, KUBO_MAX_CONNECTIONS, REPUBLISH_DEBOUNCE, REPUBLISH_CONCURRENCY,
+    KUBO_CONNECT_TIMEOUT, KUBO_READ_TIMEOUT, KUBO_WRITE_TIMEOUT, KUBO_LONG_TIMEOUT, LINKTREE_FETCH_BUDGET,
+    REPUBLISH_RETRY_DELAY, REPUBLISH_RETRIES,
+    IPFS_GC_INTERVAL, IPFS_GC_THRESHOLD_MB, IPFS_CID_VERSION,
+    IPFS_UNPIN_INTERVAL, IPFS_UNPIN_GRACE, IPFS_PIN_AUDIT_INTERVAL,
+    IPFS_CAT_CACHE_MB, IPFS_CAT_CACHE_DIR, IPFS_CAT_CACHE_DISK_MB,
+)
+
+
+# ── Kubo Nodes ──
+
+# Every Kubo call goes through a KuboNode, which keeps one pooled client per
+# node so requests reuse keep-alive connections instead of paying connection
+# setup each time. Clients are opened and closed with the app (open_client /
+# close_client) and created lazily for scripts and tests that never run the
+# app's startup hooks.
+_LIMITS = httpx.Limits(
+    max_connections=KUBO_MAX_CONNECTIONS,
+    max_keepalive_connections=KUBO_MAX_CONNECTIONS,
+    keepalive_expiry=30.0,
+)
+READ_TIMEOUT = httpx.Timeout(KUBO_READ_TIMEOUT, connect=KUBO_CONNECT_TIMEOUT)
+TIMEOUT = httpx.Timeout(KUBO_WRITE_TIMEOUT, connect=KUBO_CONNECT_TIMEOUT)
+LONG_TIMEOUT = httpx.Timeout(KUBO_LONG_TIMEOUT, connect=KUBO_CONNECT_TIMEOUT)
+
+# Latency budget per API path (TIMEOUT if not listed). A call that runs
+# over its budget is a transport error and counts against the node's
+# breaker; callers that know better (batches) pass their own timeout.
+BUDGETS = {
+    "cat": READ_TIMEOUT,
+    "name/resolve": READ_TIMEOUT,
+    "routing/get": READ_TIMEOUT,
+    "version": READ_TIMEOUT,
+    "name/publish": LONG_TIMEOUT,
+    "repo/gc": LONG_TIMEOUT,
+}
+
+
+class KuboUnavailable(httpx.TransportError):
+    """Raised without contacting a node whose circuit breaker is open."""
+
+
+def _client_args(api: str = KUBO_API):
+    """(base_url, transport) for a Kubo API URL. ``unix:///path/to/api.sock``
+    talks to Kubo over a Unix domain socket, with the API under /api/v0."""
+    if api.startswith("unix://"):
+        transport = httpx.AsyncHTTPTransport(uds=api[len("unix://"):], limits=_LIMITS)
+        return "http://kubo/api/v0", transport
+    return api, httpx.AsyncHTTPTransport(limits=_LIMITS)
+
+
+class KuboNode:
+    """One Kubo API endpoint: its pooled client and a circuit breaker.
+
+    ``max_failures`` consecutive transport errors (refused connections,
+    timeouts) open the breaker, and calls then fail fast with
+    KuboUnavailable. After ``cooldown`` seconds calls are let through again
+    and the first success closes it. Error statuses mean Kubo answered, so
+    they don't count against the node.
+    """
+
+    def __init__(self, api: str, repo_path: str = None,
+                 max_failures=KUBO_BREAKER_FAILURES, cooldown=KUBO_BREAKER_COOLDOWN):
+        self.api = api
+        self.repo_path = repo_path  # IPFS_PATH, if its keystore is readable from here
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self._client = None
+        self._client_loop = None
+        self.failures = 0
+        self.opened_at = None
+        self.requests = self.errors = self.trips = self.rejected = 0
+
+    async def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # A client left over from another event loop can't be reused
+            base_url, transport = _client_args(self.api)
+            self._client = httpx.AsyncClient(base_url=base_url, transport=transport, timeout=TIMEOUT)
+            self._client_loop = loop
+        return self._client
+
+    async def close(self):
+        client, loop = self._client, self._client_loop
+        self._client, self._client_loop = None, None
+        if client is not None and loop is asyncio.get_running_loop():
+            await client.aclose()
+
+    @property
+    def healthy(self) -> bool:
+        return self.opened_at is None
+
+    def available(self) -> bool:
+        """Whether calls may go to this node (breaker closed or cooled down)."""
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown
+
+    def _failed(self):
+        self.errors += 1
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        if not self.available():
+            self.rejected += 1
+            raise KuboUnavailable(f"Kubo node {self.api} is unavailable")
+        client = await self.client()
+        self.requests += 1
+        kwargs.setdefault("timeout", BUDGETS.get(path, TIMEOUT))
+        try:
+            resp = await client.post(path, **kwargs)
+        except httpx.TransportError:
+            self._failed()
+            raise
+        self.failures = 0
+        self.opened_at = None
+        return resp
+
+    @asynccontextmanager
+    async def stream(self, path: str, **kwargs):
+        """Like ``post``, for reading a long response as it arrives."""
+        if not self.available():
+            self.rejected += 1
+            raise KuboUnavailable(f"Kubo node {self.api} is unavailable")
+        client = await self.client()
+        self.requests += 1
+        kwargs.setdefault("timeout", BUDGETS.get(path, TIMEOUT))
+        try:
+            async with client.stream("POST", path, **kwargs) as resp:
+                self.failures = 0
+                self.opened_at = None
+                yield resp
+        except httpx.TransportError:
+            self._failed()
+            raise
+
+    async def check(self) -> bool:
+        """Health probe (``/version``); its outcome feeds the breaker."""
+        try:
+            resp = await self.post("version")
+            resp.raise_for_status()
+        except httpx.HTTPError:
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "api": self.api,
+            "healthy": self.healthy,
+            "consecutive_failures": self.failures,
+            "requests": self.requests,
+            "errors": self.errors,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+# KUBO_API first: the primary serves reads and holds the IPNS keys of users
+# placed before sharding. Every node pins the same content.
+nodes = [
+    KuboNode(KUBO_API, os.environ.get("IPFS_PATH", os.path.expanduser("~/.ipfs"))),
+    *(KuboNode(api, repo or None)
+      for api, repo in zip(KUBO_REPLICAS, KUBO_REPLICA_REPOS + [""] * len(KUBO_REPLICAS))),
+]
+
+
+async def open_client() -> httpx.AsyncClient:
+    """Open every node's client; returns the primary's."""
+    for node in nodes[1:]:
+        await node.client()
+    return await nodes[0].client()
+
+
+async def close_client():
+    for node in nodes:
+        await node.close()
+
+
+async def _post(path: str, **kwargs) -> httpx.Response:
+    """Call the primary node."""
+    return await nodes[0].post(path, **kwargs)
+
+
+async def _read(path: str, **kwargs) -> httpx.Response:
+    """Call the first node that is reachable, in ``nodes`` order, so reads
+    fail over to the replicas while the primary is down."""
+    error = None
+    for node in nodes:
+        try:
+            return await node.post(path, **kwargs)
+        except httpx.TransportError as exc:
+            error = exc
+    raise error
+
+
+# ── IPNS Key Placement ──
+
+# Each IPNS key lives on one node, which handles every publish for it; the
+# resulting record is then copied to the other nodes. users.ipns_node
+# records the placement (NULL for keys made on the primary before sharding).
+RING_POINTS = 64  # ring positions per node
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode()).digest()[:8], "big")
+
+
+_rings = {}
+
+
+def _ring(apis: tuple) -> tuple:
+    """Consistent-hash ring over ``apis``: sorted (hashes, apis) lists."""
+    ring = _rings.get(apis)
+    if ring is None:
+        points = sorted((_ring_hash(f"{api}#{i}"), api) for api in apis for i in range(RING_POINTS))
+        ring = _rings[apis] = ([h for h, _ in points], [api for _, api in points])
+    return ring
+
+
+def place_key(key_name: str) -> str:
+    """API URL of the node a new key ``key_name`` belongs on. Adding a node
+    moves only about 1/N of the keys (see ipns_rebalance)."""
+    hashes, apis = _ring(tuple(node.api for node in nodes))
+    return apis[bisect.bisect(hashes, _ring_hash(key_name)) % len(apis)]
+
+
+def key_node(placement: str = None) -> KuboNode:
+    """The node for a users.ipns_node value (None = the primary)."""
+    if placement is None:
+        return nodes[0]
+    for node in nodes:
+        if node.api == placement:
+            return node
+    raise LookupError(f"IPNS keys placed on {placement}, which is not configured")
+
+
+def _required(total: int) -> int:
+    """Nodes a replicated write must reach under KUBO_WRITE_POLICY."""
+    return total // 2 + 1 if KUBO_WRITE_POLICY == "quorum" else 1
+
+
+async def _fan_out(call, targets=None) -> list:
+    """Run ``call(node)`` on every node concurrently. Returns
+    ``[(node, result), ...]`` with the exception as the result for nodes
+    that failed."""
+    targets = list(nodes if targets is None else targets)
+    results = await asyncio.gather(*(call(node) for node in targets), return_exceptions=True)
+    return list(zip(targets, results))
+
+
+async def _settle(results: list, cids=(), action: str = "pin"):
+    """Apply KUBO_WRITE_POLICY to ``_fan_out`` results.
+
+    Raises the first failure if too few nodes succeeded. Otherwise each
+    node that failed gets ``action`` on ``cids`` queued for the
+    ReplicaReconciler.
+    """
+    failed = [(node, result) for node, result in results if isinstance(result, Exception)]
+    if len(results) - len(failed) < _required(len(results)):
+        raise failed[0][1]
+    if failed and cids:
+        import db as _db
+
+        for node, _ in failed:
+            await _db.queue_replica_repairs(node.api, list(cids), action)
+
+
+def _succeeded(results: list) -> list:
+    return [result for _, result in results if not isinstance(result, Exception)]
 
 
 # ── Content Operations ──
 
+# Import parameters are sent explicitly so Kubo's CIDs always match
+# compute_cid(), whatever the node's own defaults are
+_ADD_PARAMS = {"pin": "true", **ipfs_cid.add_params(IPFS_CID_VERSION)}
+
+
+def compute_cid(data: bytes) -> str:
+    """The CID ``ipfs_add(data)`` will return, computed without Kubo."""
+    return ipfs_cid.compute_cid(data, IPFS_CID_VERSION)
+
+
+def _json_bytes(obj: dict) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+async def _add_on(node: KuboNode, parts: list, timeout=TIMEOUT) -> dict:
+    """Add multipart ``parts`` on one node; returns ``{part_name: cid}``."""
+    resp = await node.post("add", files=parts, params=_ADD_PARAMS, timeout=timeout)
+    resp.raise_for_status()
+    # Kubo answers with one JSON line per file, keyed by the part's name
+    by_name = {}
+    for line in resp.text.splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            by_name[entry["Name"]] = entry["Hash"]
+    return by_name
+
+
 async def ipfs_add(data: bytes, filename: str = "data") -> str:
-    """Pin bytes to IPFS, return CID."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{KUBO_API}/add",
-            files={"file": (filename, data)},
-            params={"pin": "true"},
-        )
-        resp.raise_for_status()
-        return resp.json()["Hash"]
+    """Pin bytes to IPFS on every node, return CID."""
+    results = await _fan_out(lambda node: _add_on(node, [("file", (filename, data))]))
+    added = _succeeded(results)
+    await _settle(results, [added[0][filename]] if added else (), "pin")
+    return added[0][filename]
+
+
+async def ipfs_add_many(files: list[tuple[str, bytes]]) -> list[str]:
+    """Pin several files with one ``/add`` request per node; returns their
+    CIDs in input order. ``files`` is a list of ``(filename, data)``."""
+    if not files:
+        return []
+    # An index prefix keeps repeated filenames apart
+    parts = [("file", (f"{i}_{name}", data)) for i, (name, data) in enumerate(files)]
+    results = await _fan_out(lambda node: _add_on(node, parts, LONG_TIMEOUT))
+    added = _succeeded(results)
+    cids = [added[0][f"{i}_{name}"] for i, (name, _) in enumerate(files)] if added else []
+    await _settle(results, dict.fromkeys(cids), "pin")
+    return cids
 
 
 async def ipfs_add_json(obj: dict) -> str:
     """Pin JSON object to IPFS, return CID."""
-    data = json.dumps(obj, separators=(",", ":")).encode()
-    return await ipfs_add(data, "linktree.json")
+    return await ipfs_add(_json_bytes(obj), "linktree.json")
 
 
 async def ipfs_cat(cid: str) -> bytes:
-    """Retrieve content by CID."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{KUBO_API}/cat", params={"arg": cid})
+    """Retrieve content by CID (through ``cat_cache``)."""
+    return await cat_cache.get(cid, _cat_uncached)
+
+
+async def _cat_uncached(cid: str) -> bytes:
+    resp = await _read("cat", params={"arg": cid})
+    resp.raise_for_status()
+    return resp.content
+
+
+async def ipfs_cat_path(cid: str) -> str | None:
+    """Filesystem path of ``cid``'s content in the on-disk cat cache,
+    fetching it if needed; None when IPFS_CAT_CACHE_DIR is not set."""
+    path = cat_cache.path(cid)
+    if path is None:
+        return None
+    data = await ipfs_cat(cid)  # a miss writes the file through the cache
+    if not os.path.exists(path):
+        await cat_cache.store(cid, data)  # a memory-tier hit
+    return path
+
+
+class CatCache:
+    """Cache for ``ipfs_cat``. Content addressed by a CID never changes, so
+    entries need no invalidation.
+
+    Two tiers: an in-memory LRU bounded by total bytes and, when
+    ``directory`` is set, one file per CID on disk. Once the files pass
+    ``disk_max_bytes`` (0 = unbounded) the least recently used are deleted;
+    disk hits refresh a file's mtime. Concurrent misses for the same CID
+    share a single fetch.
+    """
+
+    def __init__(self, max_bytes=int(IPFS_CAT_CACHE_MB * 2**20), directory=IPFS_CAT_CACHE_DIR,
+                 disk_max_bytes=int(IPFS_CAT_CACHE_DISK_MB * 2**20)):
+        self.max_bytes = max_bytes
+        self.directory = os.path.abspath(directory) if directory else None
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_bytes = None  # measured on the first store
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.bytes = 0
+        self.hits = self.disk_hits = self.misses = self.shared = 0
+        self.disk_evictions = 0
+
+    def path(self, cid: str) -> str | None:
+        if self.directory is None or not cid.isalnum():
+            return None
+        return os.path.join(self.directory, cid)
+
+    def owns(self, path: str) -> bool:
+        """Whether ``path`` is a cache file (callers must not delete it)."""
+        return (self.directory is not None and path is not None
+                and os.path.dirname(os.path.abspath(path)) == self.directory)
+
+    def _remember(self, cid: str, data: bytes):
+        if len(data) > self.max_bytes or cid in self._entries:
+            return
+        self._entries[cid] = data
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    async def get(self, cid: str, fetch) -> bytes:
+        data = self._entries.get(cid)
+        if data is not None:
+            self._entries.move_to_end(cid)
+            self.hits += 1
+            return data
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(cid)
+        if task is not None and task.get_loop() is loop:
+            self.shared += 1
+        else:
+            task = loop.create_task(self._load(cid, fetch))
+            self._inflight[cid] = task
+            task.add_done_callback(lambda t: self._landed(cid, t))
+        # Shielded: one caller giving up must not cancel the shared fetch
+        return await asyncio.shield(task)
+
+    def _landed(self, cid: str, task):
+        if self._inflight.get(cid) is task:
+            del self._inflight[cid]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter left
+
+    async def _load(self, cid: str, fetch) -> bytes:
+        path = self.path(cid)
+        if path is not None:
+            try:
+                data = await asyncio.to_thread(_read_file, path, True)
+            except OSError:
+                pass
+            else:
+                self.disk_hits += 1
+                self._remember(cid, data)
+                return data
+        data = await fetch(cid)
+        self.misses += 1
+        self._remember(cid, data)
+        await self.store(cid, data)
+        return data
+
+    async def store(self, cid: str, data: bytes):
+        path = self.path(cid)
+        if path is None:
+            return
+        try:
+            # A CID's content never changes: an existing file is only touched
+            written = await asyncio.to_thread(_write_new_file, path, data)
+            if self.disk_bytes is None:
+                self.disk_bytes, _ = await asyncio.to_thread(_trim_dir, self.directory, None)
+            elif written:
+                self.disk_bytes += len(data)
+            if self.disk_max_bytes > 0 and self.disk_bytes > self.disk_max_bytes:
+                self.disk_bytes, removed = await asyncio.to_thread(
+                    _trim_dir, self.directory, self.disk_max_bytes,
+                )
+                self.disk_evictions += removed
+        except OSError:
+            pass  # the disk tier is best-effort
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "disk_bytes": self.disk_bytes or 0,
+            "disk_max_bytes": self.disk_max_bytes,
+            "disk_evictions": self.disk_evictions,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "shared_fetches": self.shared,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _read_file(path: str, touch: bool = False) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    if touch:
+        os.utime(path)
+    return data
+
+
+def _trim_dir(directory: str, max_bytes: int | None) -> tuple[int, int]:
+    """Delete the least recently used cache files until the rest fit in
+    ``max_bytes`` (None: just measure); returns (bytes kept, files removed)."""
+    files = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    if max_bytes is not None:
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+    return total, removed
+
+
+def _write_new_file(path: str, data: bytes) -> bool:
+    """Write ``path`` unless it exists (then refresh its mtime); returns
+    whether it was written."""
+    if os.path.exists(path):
+        os.utime(path)
+        return False
+    _write_file_atomic(path, data)
+    return True
+
+
+def _write_file_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+cat_cache = CatCache()
+
+
+async def _pin_on(node: KuboNode, cids: list, timeout=TIMEOUT):
+    resp = await node.post("pin/add", params=[("arg", cid) for cid in cids], timeout=timeout)
+    resp.raise_for_status()
+
+
+def _not_pinned(resp: httpx.Response) -> bool:
+    """Whether a failed ``pin/rm`` only means the CID wasn't pinned."""
+    try:
+        return "not pinned" in resp.json().get("Message", "")
+    except ValueError:
+        return False
+
+
+async def _unpin_on(node: KuboNode, cids: list) -> list:
+    """Unpin ``cids`` on one node; returns the ones that were pinned there.
+
+    Kubo rejects the whole batch if any CID is not pinned; the rest are
+    then unpinned one by one. Any other error (a CID pinned indirectly, a
+    repo error) is raised, so ``_settle`` queues a repair for the node.
+    """
+    resp = await node.post("pin/rm", params=[("arg", cid) for cid in cids])
+    if resp.is_success:
+        return cids
+    if not _not_pinned(resp):
         resp.raise_for_status()
-        return resp.content
+    if len(cids) == 1:
+        return []  # already unpinned
+    removed = []
+    for cid in cids:
+        resp = await node.post("pin/rm", params={"arg": cid})
+        if resp.is_success:
+            removed.append(cid)
+        elif not _not_pinned(resp):
+            resp.raise_for_status()
+    return removed
 
 
 async def ipfs_pin(cid: str):
     """Ensure CID is pinned."""
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{KUBO_API}/pin/add", params={"arg": cid})
+    await ipfs_pin_many([cid])
 
 
 async def ipfs_unpin(cid: str):
-    """Unpin CID — content becomes garbage-collectible."""
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.post(f"{KUBO_API}/pin/rm", params={"arg": cid})
-            resp.raise_for_status()
-        except httpx.HTTPStatusError:
-            pass  # already unpinned
+    """Unpin CID — content becomes garbage-collectible by the next
+    scheduled ``repo/gc`` (see GcScheduler). The size counted toward gc's
+    threshold is the one in the pins table (0 if it was never sized)."""
+    import db as _db
+
+    sizes = await _db.get_pin_sizes([cid])
+    results = await _fan_out(lambda node: _unpin_on(node, [cid]))
+    await _settle(results, [cid], "unpin")
+    if any(_succeeded(results)):
+        gc_scheduler.note_unpinned(sizes.get(cid, 0))
+
+
+async def ipfs_pin_many(cids: list[str]):
+    """Pin several CIDs with one ``pin/add`` request per node."""
+    cids = list(dict.fromkeys(cids))
+    if cids:
+        await _settle(await _fan_out(lambda node: _pin_on(node, cids)), cids, "pin")
+
+
+async def ipfs_unpin_many(cids: list[str], sizes: dict | None = None):
+    """Unpin several CIDs with one ``pin/rm`` request per node.
+
+    ``sizes`` (``{cid: bytes}``) counts toward gc's byte threshold; CIDs
+    missing from it count toward its next run only.
+    """
+    cids = list(dict.fromkeys(cids))
+    if not cids:
+        return
+    sizes = sizes or {}
+    results = await _fan_out(lambda node: _unpin_on(node, cids))
+    await _settle(results, cids, "unpin")
+    for cid in set().union(*_succeeded(results)):
+        gc_scheduler.note_unpinned(sizes.get(cid) or 0)
+
+
+async def _pin_ls_on(node: KuboNode, batch: int = 500):
+    """The recursive pins on ``node``, streamed, in lists of ``batch``."""
+    async with node.stream("pin/ls", params={"type": "recursive", "stream": "true"}) as resp:
+        resp.raise_for_status()
+        chunk = []
+        async for line in resp.aiter_lines():
+            if not line.strip():
+                continue
+            chunk.append(json.loads(line)["Cid"])
+            if len(chunk) >= batch:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# ── Pin References ──
+
+# The pins table counts, per CID, the rows that store it (see
+# db.set_pin_refs). App code records ownership with track_pins instead of
+# unpinning: a CID is unpinned, in batches by pin_reconciler, only once no
+# row references it. So rows that share a CID (identical QR bytes, a card
+# copied from the profile) can't orphan each other.
+
+async def track_pins(user_id: str, refs: dict):
+    """Record ``user_id``'s rows as owners of CIDs:
+    ``{(table, row_id, column): cid}``, None releasing the slot."""
+    import db as _db
+
+    await _db.set_pin_refs(user_id, refs)
+
+
+async def _cumulative_size(cid: str) -> int:
+    """Total size of a DAG in bytes (0 if Kubo can't tell)."""
+    try:
+        resp = await _read("files/stat", params={"arg": f"/ipfs/{cid}"})
+        resp.raise_for_status()
+        return int(resp.json().get("CumulativeSize", 0))
+    except (httpx.HTTPError, ValueError):
+        return 0
+
+
+async def _repo_size_on(node: KuboNode) -> int:
+    resp = await node.post("repo/stat", params={"size-only": "true"})
+    resp.raise_for_status()
+    return int(resp.json()["RepoSize"])
+
+
+async def ipfs_repo_size() -> int:
+    """Repo size summed over the nodes that answer."""
+    results = await _fan_out(_repo_size_on)
+    sizes = _succeeded(results)
+    if not sizes:
+        raise results[0][1]
+    return sum(sizes)
+
+
+async def _gc_on(node: KuboNode):
+    resp = await node.post("repo/gc", timeout=LONG_TIMEOUT)
+    resp.raise_for_status()
 
 
 async def ipfs_gc():
-    """Run garbage collection to reclaim storage from unpinned objects."""
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        await client.post(f"{KUBO_API}/repo/gc")
+    """Run garbage collection on every node to reclaim storage from
+    unpinned objects.
+
+    Repo-wide and blocking for Kubo: app code should leave this to
+    ``gc_scheduler`` rather than call it directly.
+    """
+    await _settle(await _fan_out(_gc_on))
 
 
 # ── IPNS Key Management ──
 
-async def ipns_key_gen(name: str) -> str:
-    """Generate a new IPNS keypair, return the IPNS name (peer ID)."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            f"{KUBO_API}/key/gen",
-            params={"arg": name, "type": "ed25519"},
-        )
-        resp.raise_for_status()
-        return resp.json()["Id"]
+async def ipns_key_gen(name: str, placement: str = None) -> str:
+    """Generate a new IPNS keypair on the node ``placement`` (see
+    ``place_key``), return the IPNS name (peer ID)."""
+    resp = await key_node(placement).post(
+        "key/gen",
+        params={"arg": name, "type": "ed25519"},
+    )
+    resp.raise_for_status()
+    return resp.json()["Id"]
+
+
+async def ipns_key_import(name: str, key_bytes: bytes, placement: str = None) -> str:
+    """Import a keystore-format (libp2p protobuf) key, e.g. a decrypted
+    ``ipns_key_backup``; returns the IPNS name."""
+    resp = await key_node(placement).post(
+        "key/import", params={"arg": name}, files={"key": (name, key_bytes)},
+    )
+    resp.raise_for_status()
+    return resp.json()["Id"]
+
+
+async def ipns_key_remove(name: str, placement: str = None):
+    resp = await key_node(placement).post("key/rm", params={"arg": name})
+    resp.raise_for_status()
 
 
-def _keystore_path(name: str) -> str:
+def _keystore_path(name: str, ipfs_path: str) -> str:
     """Get the filesystem path for a key in Kubo's keystore.
 
     Kubo stores keys as files named 'key_{base32lower_nopad(name)}'
     in $IPFS_PATH/keystore/ (defaults to ~/.ipfs/keystore/).
     """
     encoded = base64.b32encode(name.encode()).decode().lower().rstrip("=")
-    ipfs_path = os.environ.get("IPFS_PATH", os.path.expanduser("~/.ipfs"))
     return os.path.join(ipfs_path, "keystore", f"key_{encoded}")
 
 
-async def ipns_key_export(name: str) -> bytes:
+async def ipns_key_export(name: str, placement: str = None) -> bytes:
     """Export raw IPNS key bytes from Kubo's keystore (for encrypted backup).
 
-    Reads directly from the keystore directory since the HTTP API
-    does not expose key/export.
+    Reads directly from the owning node's keystore directory since the
+    HTTP API does not expose key/export.
     """
-    path = _keystore_path(name)
-    with open(path, "rb") as f:
+    node = key_node(placement)
+    if node.repo_path is None:
+        raise RuntimeError(f"Keystore of {node.api} is not readable (set KUBO_REPLICA_REPOS)")
+    with open(_keystore_path(name, node.repo_path), "rb") as f:
         return f.read()
 
 
-async def ipns_publish(key_name: str, cid: str) -> str:
-    """Publish CID under IPNS key, return the IPNS name."""
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        resp = await client.post(
-            f"{KUBO_API}/name/publish",
-            params={
-                "arg": f"/ipfs/{cid}",
-                "key": key_name,
-                "allow-offline": "true",
-            },
-        )
-        resp.raise_for_status()
-        return resp.json()["Name"]
+async def _publish_on(node: KuboNode, key_name: str, cid: str) -> str:
+    resp = await node.post(
+        "name/publish",
+        params={
+            "arg": f"/ipfs/{cid}",
+            "key": key_name,
+            "allow-offline": "true",
+        },
+        timeout=LONG_TIMEOUT,
+    )
+    resp.raise_for_status()
+    return resp.json()["Name"]
+
+
+async def ipns_publish(key_name: str, cid: str, placement: str = None) -> str:
+    """Publish CID under IPNS key on the node holding it, return the IPNS
+    name. The signed record is then copied to the other nodes.
+
+    A node that misses the copy isn't repaired by the reconciler; the
+    user's next publish supersedes the record anyway.
+    """
+    owner = key_node(placement)
+    ipns_name = await _publish_on(owner, key_name, cid)
+    others = [node for node in nodes if node is not owner]
+    if others:
+        try:
+            record = await _get_record(owner, ipns_name)
+        except (httpx.HTTPError, ValueError):
+            return ipns_name  # published; the others resolve it via routing
+        await _fan_out(lambda node: _put_record(node, ipns_name, record), others)
+    return ipns_name
+
+
+async def _get_record(node: KuboNode, ipns_name: str) -> bytes:
+    """The marshalled IPNS record ``node`` holds for ``ipns_name``."""
+    resp = await node.post("routing/get", params={"arg": f"/ipns/{ipns_name}"})
+    resp.raise_for_status()
+    return base64.b64decode(resp.json()["Extra"])
+
+
+async def _put_record(node: KuboNode, ipns_name: str, record: bytes):
+    resp = await node.post(
+        "routing/put",
+        params={"arg": f"/ipns/{ipns_name}", "allow-offline": "true"},
+        files={"file": ("record", record)},
+    )
+    resp.raise_for_status()
+
+
+# ── App-held IPNS Keys ──
+
+# With IPNS_SIGNING=local the app holds each member's key (Guardian-encrypted
+# in users.ipns_key_backup), signs records itself and puts them on every
+# node. Any app node can publish for any member and Kubo's keystore is not
+# involved. Keys are in Kubo's keystore format, so a backup can still be
+# imported into a node with ipns_key_import.
+
+def encrypt_key_backup(key_bytes: bytes) -> str:
+    """Guardian-encrypt an IPNS private key for users.ipns_key_backup."""
+    encrypted = StellarSharedKey(BANKER_25519, GUARDIAN_25519.public_key()).encrypt(key_bytes)
+    return encrypted.decode() if isinstance(encrypted, bytes) else encrypted
+
+
+def decrypt_key_backup(backup) -> bytes:
+    decryptor = StellarSharedDecryption(GUARDIAN_25519, BANKER_25519.public_key())
+    if isinstance(backup, str):
+        backup = backup.encode()
+    return decryptor.decrypt(backup, from_address=BANKER_KP.public_key)
+
+
+_signer = None
+
+
+def _sign_executor():
+    global _signer
+    if _signer is None and IPNS_SIGN_PROCESSES > 0:
+        _signer = ProcessPoolExecutor(IPNS_SIGN_PROCESSES)
+    return _signer
+
+
+def shutdown_signer():
+    """Stop the signing processes (``app.on_shutdown``)."""
+    global _signer
+    signer, _signer = _signer, None
+    if signer is not None:
+        signer.shutdown(cancel_futures=True)
+
+
+async def _create_record(*args) -> bytes:
+    """``ipns_record.create_record`` in the IPNS_SIGN_PROCESSES pool, when
+    there is one, so concurrent publishes sign in parallel off the loop."""
+    executor = _sign_executor()
+    if executor is None:
+        return ipns_record.create_record(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, ipns_record.create_record, *args)
+
+
+async def ipns_publish_signed(user_id: str, private_key: bytes, cid: str) -> str:
+    """Sign a record for ``cid`` in-process and put it on every node with
+    ``routing/put``; returns the IPNS name.
+
+    The sequence number comes from ``user_id``'s row. Its time-based floor
+    keeps it ahead of any record Kubo published for the key before. The
+    record's expiry is stored for ``refresher``.
+    """
+    import db as _db
+
+    now = time.time()
+    sequence = await _db.claim_ipns_sequence(user_id, int(now * 1000))
+    if sequence is None:
+        raise LookupError(f"No user {user_id}")
+    eol = now + IPNS_RECORD_LIFETIME
+    record = await _create_record(
+        private_key, f"/ipfs/{cid}", sequence,
+        datetime.fromtimestamp(eol, timezone.utc), IPNS_RECORD_TTL,
+    )
+    ipns_name = ipns_record.ipns_name(private_key)
+    await _settle(await _fan_out(lambda node: _put_record(node, ipns_name, record)))
+    await _db.update_user(user_id, ipns_expires_at=int(eol))
+    return ipns_name
 
 
 async def ipns_resolve(ipns_name: str) -> str:
     """Resolve IPNS name to current CID."""
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        resp = await client.post(
-            f"{KUBO_API}/name/resolve",
-            params={"arg": ipns_name},
-        )
-        resp.raise_for_status()
-        path = resp.json()["Path"]  # "/ipfs/bafy..."
-        return path.split("/ipfs/")[-1]
+    resp = await _read(
+        "name/resolve",
+        params={"arg": ipns_name},
+    )
+    resp.raise_for_status()
+    path = resp.json()["Path"]  # "/ipfs/bafy..."
+    return path.split("/ipfs/")[-1]
 
 
 # ── High-Level Operations ──
 
 async def publish_linktree(key_name: str, linktree: dict,
-                           old_json_cid: str = None) -> tuple[str, str]:
+                           old_json_cid: str = None, placement: str = None, *,
+                           user_id: str = None, private_key: bytes = None,
+                           refresh: bool = False) -> tuple[str, str]:
     """Pin linktree JSON and publish via IPNS.
     Returns (new_json_cid, ipns_name).
-    Unpins old JSON CID if provided."""
-    new_cid = await ipfs_add_json(linktree)
-    ipns_name = await ipns_publish(key_name, new_cid)
-    if old_json_cid and old_json_cid != new_cid:
+
+    With ``private_key`` the record is signed in-process for ``user_id``
+    (see ``ipns_publish_signed``); otherwise Kubo publishes with
+    ``key_name`` on the key's node. With ``user_id`` the JSON is stored as
+    the user's ``linktree_cid`` and tracked as its pin in one transaction;
+    otherwise the old JSON CID, if given, is unpinned. If the JSON is byte-identical to ``old_json_cid`` nothing is uploaded or
+    published and ``(old_json_cid, None)`` is returned, unless ``refresh``
+    asks for a new record anyway."""
+    data = _json_bytes(linktree)
+    unchanged = bool(old_json_cid) and compute_cid(data) == old_json_cid
+    if unchanged and not refresh:
+        return old_json_cid, None
+    new_cid = old_json_cid if unchanged else await ipfs_add(data, "linktree.json")
+    if private_key is not None:
+        ipns_name = await ipns_publish_signed(user_id, private_key, new_cid)
+    else:
+        ipns_name = await ipns_publish(key_name, new_cid, placement)
+    if user_id is not None:
+        import db as _db
+
+        async with _db.transaction():
+            if new_cid != old_json_cid:
+                await _db.update_user(user_id, linktree_cid=new_cid)
+            await track_pins(user_id, {("users", user_id, "linktree_cid"): new_cid})
+    elif old_json_cid and old_json_cid != new_cid:
         await ipfs_unpin(old_json_cid)
     return new_cid, ipns_name
 
 
 async def replace_asset(new_data: bytes, old_cid: str = None,
-                        filename: str = "asset") -> str:
-    """Pin new asset, unpin old one. Returns new CID."""
+                        filename: str = "asset", *,
+                        user_id: str = None, owner: tuple = None, save=None) -> str:
+    """Pin new asset and release the old one. Returns new CID (``old_cid``
+    itself, without touching Kubo, when the bytes are unchanged).
+
+    ``owner`` is the ``(table, row_id, column)`` slot the CID is stored in;
+    it is moved to the new CID with ``track_pins``, in one transaction with
+    ``save(new_cid)``, the caller's write of that column. Without an owner
+    the old CID is unpinned straight away."""
+    if old_cid and compute_cid(new_data) == old_cid:
+        return old_cid
     new_cid = await ipfs_add(new_data, filename)
-    if old_cid and old_cid != new_cid:
+    if owner is not None:
+        import db as _db
+
+        async with _db.transaction():
+            if save is not None:
+                await save(new_cid)
+            await track_pins(user_id, {owner: new_cid})
+    elif old_cid and old_cid != new_cid:
         await ipfs_unpin(old_cid)
     return new_cid
 
@@ -264,82 +1065,739 @@ async def fetch_linktree_json(user) -> dict:
     return json.loads(raw)
 
 
-async def build_linktree_fresh(user_id: str) -> dict:
-    """Build linktree JSON directly from SQLite (skips IPFS).
-    Used for owner preview so edits are visible immediately."""
-    import db as _db
+class VisitorStats:
+    """How public linktree views were served (see fetch_linktree_for_visitor)."""
+
+    def __init__(self):
+        self.served = self.degraded = self.timeouts = 0
+
+    def stats(self) -> dict:
+        return {"served": self.served, "degraded": self.degraded, "timeouts": self.timeouts}
+
+
+visitors = VisitorStats()
+
+
+async def fetch_linktree_for_visitor(user, budget=LINKTREE_FETCH_BUDGET) -> tuple[dict, bool]:
+    """Published linktree JSON for an external visitor, within ``budget``
+    seconds. Returns ``(linktree, degraded)``.
+
+    If IPFS can't deliver in time (nodes down or breakers open, a slow
+    ``cat``, bad JSON) the linktree is built from SQLite instead, like the
+    owner preview, and ``degraded`` is True. An open breaker fails fast, so
+    the fallback doesn't wait out the budget."""
+    visitors.served += 1
+    if user['linktree_cid']:
+        try:
+            return await asyncio.wait_for(fetch_linktree_json(user), budget), False
+        except asyncio.TimeoutError:
+            visitors.timeouts += 1
+        except (httpx.HTTPError, ValueError):
+            pass
+    visitors.degraded += 1
+    return await build_linktree_fresh(user['id']), True
 
-    user = await _db.get_user_by_id(user_id)
-    links = await _db.get_links(user_id)
-    colors = await _db.get_profile_colors(user_id)
-    settings = await _db.get_profile_settings(user_id)
-    denom_rows = await _db.get_denom_wallets(user_id)
 
+def _linktree_from_bundle(bundle: dict) -> dict:
+    """Assemble linktree JSON from a db.get_profile_bundle() result."""
+    user = bundle['user']
     return build_linktree_json(
         moniker=user['moniker'],
         member_type=user['member_type'],
         stellar_address=user['stellar_address'],
-        links=[dict(link) for link in links],
-        colors=colors,
-        avatar_cid=dict(user).get('avatar_cid'),
-        card_design_cid=dict(user).get('nfc_image_cid'),
-        qr_code_cid=dict(user).get('qr_code_cid'),
-        settings=settings,
-        denom_wallets=[dict(dw) for dw in denom_rows],
+        links=bundle['links'],
+        colors=bundle['colors'],
+        avatar_cid=user.get('avatar_cid'),
+        card_design_cid=user.get('nfc_image_cid'),
+        qr_code_cid=user.get('qr_code_cid'),
+        settings=bundle['settings'],
+        denom_wallets=bundle['denom_wallets'],
     )
 
 
-async def republish_linktree(user_id: str) -> str | None:
+async def build_linktree_fresh(user_id: str) -> dict:
+    """Build linktree JSON directly from SQLite (skips IPFS).
+    Used for owner preview so edits are visible immediately."""
+    import db as _db
+
+    bundle = await _db.get_profile_bundle(user_id)
+    return _linktree_from_bundle(bundle)
+
+
+async def republish_linktree(user_id: str, refresh: bool = False) -> str | None:
     """Rebuild linktree JSON from SQLite and re-publish to IPFS/IPNS.
 
-    Returns the new CID on success, None on failure.
-    Called after every linktree-relevant edit.
+    Returns the new CID, or None if the user has no IPNS key; Kubo and
+    signing errors propagate (RepublishScheduler records and retries them).
+    Called after every linktree-relevant edit; ``refresh`` re-signs the
+    record even if the JSON is unchanged.
     """
     import db as _db
 
-    user = await _db.get_user_by_id(user_id)
-    if not user or not user['ipns_key_name']:
+    bundle = await _db.get_profile_bundle(user_id)
+    if not bundle or not bundle['user']['ipns_key_name']:
         return None
+    user = bundle['user']
+    linktree = _linktree_from_bundle(bundle)
 
-    links = await _db.get_links(user_id)
-    colors = await _db.get_profile_colors(user_id)
-    settings = await _db.get_profile_settings(user_id)
-    denom_rows = await _db.get_denom_wallets(user_id)
-
-    linktree = build_linktree_json(
-        moniker=user['moniker'],
-        member_type=user['member_type'],
-        stellar_address=user['stellar_address'],
-        links=[dict(link) for link in links],
-        colors=colors,
-        avatar_cid=dict(user).get('avatar_cid'),
-        card_design_cid=dict(user).get('nfc_image_cid'),
-        qr_code_cid=dict(user).get('qr_code_cid'),
-        settings=settings,
-        denom_wallets=[dict(dw) for dw in denom_rows],
+    private_key = None
+    if IPNS_SIGNING == "local" and user.get('ipns_key_backup'):
+        private_key = decrypt_key_backup(user['ipns_key_backup'])
+    new_cid, _ = await publish_linktree(
+        user['ipns_key_name'],
+        linktree,
+        old_json_cid=user.get('linktree_cid'),
+        placement=user.get('ipns_node'),
+        user_id=user_id,
+        private_key=private_key,
+        refresh=refresh,
     )
-
-    try:
-        new_cid, _ = await publish_linktree(
-            user['ipns_key_name'],
-            linktree,
-            old_json_cid=dict(user).get('linktree_cid'),
-        )
-        await _db.update_user(user_id, linktree_cid=new_cid)
-        return new_cid
-    except Exception:
-        return None
+    return new_cid
 
 
 def schedule_republish(user_id: str):
-    """Schedule a non-blocking linktree republish."""
-    asyncio.create_task(_safe_republish(user_id))
+    """Schedule a non-blocking linktree republish (see RepublishScheduler)."""
+    republisher.request(user_id)
 
 
-async def _safe_republish(user_id: str):
-    """Wrapper that catches all exceptions to avoid unhandled task errors."""
-    try:
-        await republish_linktree(user_id)
-        await ipfs_gc()
-    except Exception:
-        pass
+class RepublishScheduler:
+    """Coalesces linktree republishes.
+
+    Requests for a user within ``delay`` seconds of each other collapse into
+    one publish, and at most one publish per user is in flight: edits that
+    arrive meanwhile trigger a single follow-up round. ``concurrency``
+    bounds publishes across all users. Pending users are recorded in the
+    republish_queue table until published, so ``start()`` resumes them
+    after a restart. Each row is claimed by the app node working on it;
+    ``start()`` only resumes rows whose claim has run out, so a rolling
+    restart publishes each user once. ``request(user_id, refresh=True)`` re-signs the record
+    even if nothing changed (see IpnsRefresher).
+
+    A failed publish is kept in ``errors`` and retried after
+    ``retry_delay`` seconds, doubling each time. After ``retries`` failures
+    the user stays in republish_queue until the next ``start()``.
+    """
+
+    ERROR_LOG_SIZE = 100
+    # Seconds a queue row stays claimed past its publish window
+    CLAIM_TTL = max(KUBO_LONG_TIMEOUT * 2, 60)
+
+    def __init__(self, delay=REPUBLISH_DEBOUNCE, concurrency=REPUBLISH_CONCURRENCY,
+                 retry_delay=REPUBLISH_RETRY_DELAY, retries=REPUBLISH_RETRIES):
+        self.delay = delay
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self.retries = retries
+        self.errors = deque(maxlen=self.ERROR_LOG_SIZE)
+        self._reset()
+
+    def _reset(self):
+        self._loop = None
+        self._slots = None
+        self._workers = {}     # user_id -> worker task
+        self._due = {}         # user_id -> loop time the quiet window ends
+        self._generation = {}  # user_id -> requests seen so far
+        self._refresh = set()  # users whose next round must publish
+        self.in_flight = 0
+        self.published = self.failed = self.retried = self.abandoned = 0
+        self.total_ms = self.max_ms = self.last_ms = 0.0
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Workers and the semaphore belong to the loop that made them
+            self._reset()
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.concurrency)
+        return loop
+
+    def request(self, user_id: str, refresh: bool = False):
+        loop = self._bind()
+        if refresh:
+            self._refresh.add(user_id)
+        self._due[user_id] = loop.time() + self.delay
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        if user_id not in self._workers:
+            self._workers[user_id] = loop.create_task(self._worker(user_id))
+
+    async def _worker(self, user_id: str):
+        import db as _db
+
+        loop = asyncio.get_running_loop()
+        attempts = 0
+        try:
+            while True:
+                # Claimed until this round can have finished publishing
+                ttl = max(self._due[user_id] - loop.time(), 0) + self.CLAIM_TTL
+                try:
+                    version = await _db.mark_republish_pending(user_id, NODE_ID, ttl)
+                except Exception:
+                    version = None  # still publish; it just won't survive a restart
+                while (wait := self._due[user_id] - loop.time()) > 0:
+                    await asyncio.sleep(wait)
+                generation = self._generation[user_id]
+                refresh = user_id in self._refresh
+                self._refresh.discard(user_id)
+                async with self._slots:
+                    ok = await self._publish(user_id, refresh)
+                if not ok:
+                    if refresh:
+                        self._refresh.add(user_id)
+                    if attempts >= self.retries:
+                        self.abandoned += 1
+                        return  # left in republish_queue for the next start()
+                    backoff = self.retry_delay * 2 ** attempts
+                    attempts += 1
+                    self.retried += 1
+                    self._due[user_id] = max(self._due[user_id], loop.time() + backoff)
+                    continue
+                attempts = 0
+                if self._generation[user_id] != generation:
+                    continue  # edited while publishing: one more round
+                if version is not None:
+                    await _db.clear_republish_pending(user_id, version)
+                if self._generation[user_id] == generation:
+                    return
+        except Exception:
+            pass  # the queue row (if any) is retried on next start()
+        finally:
+            self._workers.pop(user_id, None)
+            self._due.pop(user_id, None)
+            self._generation.pop(user_id, None)
+            self._refresh.discard(user_id)
+
+    async def _publish(self, user_id: str, refresh: bool = False) -> bool:
+        self.in_flight += 1
+        start = time.perf_counter()
+        ok = True
+        try:
+            await republish_linktree(user_id, refresh)
+        except Exception as exc:
+            ok = False
+            self.errors.append({
+                "user_id": user_id,
+                "error": f"{type(exc).__name__}: {exc}",
+                "at": time.time(),
+            })
+        finally:
+            self.in_flight -= 1
+        ms = (time.perf_counter() - start) * 1000
+        self.published += ok
+        self.failed += not ok
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.last_ms = ms
+        return ok
+
+    async def start(self):
+        """Resume republishes left pending by a previous run, except those
+        another app node has claimed (``app.on_startup``)."""
+        import db as _db
+
+        for user_id in await _db.claim_republishes(NODE_ID, self.delay + self.CLAIM_TTL):
+            self.request(user_id)
+
+    async def join(self):
+        """Wait until every queued republish has finished."""
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
+
+    async def stop(self):
+        """Cancel pending work; queued users stay in republish_queue."""
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def stats(self) -> dict:
+        runs = self.published + self.failed
+        return {
+            "queued": len(self._workers) - self.in_flight,
+            "in_flight": self.in_flight,
+            "published": self.published,
+            "failed": self.failed,
+            "retried": self.retried,
+            "abandoned": self.abandoned,
+            "avg_ms": round(self.total_ms / runs, 3) if runs else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+republisher = RepublishScheduler()
+
+
+# ── Garbage Collection ──
+
+# Identifies this process as a lease holder across app nodes
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class GcScheduler:
+    """Batches ``repo/gc`` instead of collecting after every unpin.
+
+    Unpins are tallied as they happen; gc runs every ``interval`` seconds,
+    or sooner once ``threshold_bytes`` of content has been unpinned. A
+    database lease makes sure only one app node collects at a time; the
+    node that collected keeps it for ``interval`` seconds.
+    """
+
+    LEASE = "ipfs-gc"
+
+    def __init__(self, interval=IPFS_GC_INTERVAL, threshold_bytes=int(IPFS_GC_THRESHOLD_MB * 2**20)):
+        self.interval = interval
+        self.threshold_bytes = threshold_bytes
+        self.pending_unpins = 0
+        self.pending_bytes = 0
+        self.runs = self.skipped = 0
+        self.last_run_at = None
+        self.last_duration_ms = 0.0
+        self.last_reclaimed_bytes = 0
+        self.total_reclaimed_bytes = 0
+        self._task = None
+        self._wake = None
+
+    def note_unpinned(self, size: int = 0):
+        self.pending_unpins += 1
+        self.pending_bytes += size
+        if self._wake is not None and self.pending_bytes >= self.threshold_bytes:
+            self._wake.set()
+
+    async def run(self) -> bool:
+        """Collect now if this node can take the lease; returns whether gc ran."""
+        import db as _db
+
+        lease_ttl = max(LONG_TIMEOUT.read * 2, 60)
+        if not await _db.acquire_lease(self.LEASE, NODE_ID, lease_ttl):
+            self.skipped += 1
+            return False
+        try:
+            # Unpins from here on count toward the next run
+            self.pending_unpins = self.pending_bytes = 0
+            start = time.perf_counter()
+            before = await ipfs_repo_size()
+            await ipfs_gc()
+            after = await ipfs_repo_size()
+        except Exception:
+            await _db.release_lease(self.LEASE, NODE_ID)
+            raise
+        # Held until the interval is up, so other nodes don't collect again
+        await _db.acquire_lease(self.LEASE, NODE_ID, max(self.interval, lease_ttl))
+        self.runs += 1
+        self.last_run_at = time.time()
+        self.last_duration_ms = (time.perf_counter() - start) * 1000
+        self.last_reclaimed_bytes = max(before - after, 0)
+        self.total_reclaimed_bytes += self.last_reclaimed_bytes
+        return True
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.run()
+            except Exception:
+                pass  # Kubo unreachable: try again next cycle
+
+    def start(self):
+        """Start the gc loop (``app.on_startup``; a no-op when interval is 0)."""
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        task, self._task, self._wake = self._task, None, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "pending_unpins": self.pending_unpins,
+            "pending_bytes": self.pending_bytes,
+            "runs": self.runs,
+            "skipped_lease_held": self.skipped,
+            "last_run_at": self.last_run_at,
+            "last_duration_ms": round(self.last_duration_ms, 3),
+            "last_reclaimed_bytes": self.last_reclaimed_bytes,
+            "total_reclaimed_bytes": self.total_reclaimed_bytes,
+        }
+
+
+gc_scheduler = GcScheduler()
+
+
+# ── IPNS Record Refresh ──
+
+class IpnsRefresher:
+    """Re-signs app-signed IPNS records before they expire.
+
+    Kubo republishes the keys in its keystore by itself, but records signed
+    with IPNS_SIGNING=local are only valid for IPNS_RECORD_LIFETIME. Every
+    ``interval`` seconds the users whose record is past half its lifetime
+    (or was never signed by the app) are queued on ``republisher`` with
+    ``refresh=True``. That way a refresh never races an edit's publish. A
+    database lease, held for the whole interval, keeps app nodes from
+    sweeping at the same time.
+    """
+
+    LEASE = "ipns-refresh"
+
+    def __init__(self, interval=IPNS_REFRESH_INTERVAL, batch=500):
+        self.interval = interval
+        self.batch = batch
+        self.runs = self.queued = 0
+        self._task = None
+
+    async def run(self) -> int:
+        """Queue every expiring record; returns how many were queued."""
+        import db as _db
+
+        if not await _db.acquire_lease(self.LEASE, NODE_ID, max(self.interval, 60)):
+            return 0
+        try:
+            before = int(time.time() + IPNS_RECORD_LIFETIME / 2)
+            user_ids = await _db.get_expiring_ipns_records(before, self.batch)
+        except Exception:
+            await _db.release_lease(self.LEASE, NODE_ID)
+            raise
+        # The lease runs out with the interval: another node sweeping
+        # sooner would queue the same records before they are re-signed
+        for user_id in user_ids:
+            republisher.request(user_id, refresh=True)
+        self.runs += 1
+        self.queued += len(user_ids)
+        return len(user_ids)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                pass  # database busy or gone: try again next cycle
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the refresh loop (``app.on_startup``; a no-op unless
+        IPNS_SIGNING is local, or when interval is 0)."""
+        if IPNS_SIGNING != "local" or self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "queued": self.queued}
+
+
+refresher = IpnsRefresher()
+
+
+# ── Replica Reconciliation ──
+
+class ReplicaReconciler:
+    """Replays pins and unpins that a node missed while it was unreachable.
+
+    Every ``interval`` seconds each node gets a health check, which also
+    closes its breaker once it answers again. Then its entries in the
+    replica_backlog table are applied in batches of ``batch``. Missed pins
+    are re-pinned by CID, and Kubo fetches the blocks from the other
+    gateways.
+    """
+
+    def __init__(self, interval=KUBO_RECONCILE_INTERVAL, batch=500):
+        self.interval = interval
+        self.batch = batch
+        self.runs = self.repaired = self.failed = 0
+        self._task = None
+
+    async def _repair(self, node: KuboNode) -> int:
+        import db as _db
+
+        repaired = 0
+        while True:
+            backlog = await _db.get_replica_backlog(node.api, self.batch)
+            if not backlog:
+                return repaired
+            pins = [cid for cid, action in backlog if action == "pin"]
+            unpins = [cid for cid, action in backlog if action == "unpin"]
+            if pins:
+                await _pin_on(node, pins, LONG_TIMEOUT)
+            if unpins:
+                await _unpin_on(node, unpins)
+            await _db.clear_replica_repairs(node.api, backlog)
+            repaired += len(backlog)
+            if len(backlog) < self.batch:
+                return repaired
+
+    async def run(self) -> int:
+        """Check every node and repair the reachable ones; returns the
+        number of backlog entries applied."""
+        repaired = 0
+        for node in list(nodes):
+            if not await node.check():
+                continue
+            try:
+                repaired += await self._repair(node)
+            except httpx.HTTPError:
+                self.failed += 1  # left in the backlog for the next run
+        self.runs += 1
+        self.repaired += repaired
+        return repaired
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception:
+                pass  # database busy or gone: try again next cycle
+
+    def start(self):
+        """Start the reconcile loop (``app.on_startup``; a no-op with a
+        single node or when interval is 0)."""
+        if self.interval <= 0 or len(nodes) < 2 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "repaired": self.repaired, "failed": self.failed}
+
+
+reconciler = ReplicaReconciler()
+
+
+class PinReconciler:
+    """Unpins CIDs no row references any more, and audits Kubo's pins.
+
+    Every ``interval`` seconds pins released (refcount 0) more than
+    ``grace`` seconds ago are unpinned with one ``pin/rm`` per ``batch``.
+    The grace period keeps content that is put back soon after (an undone
+    edit) from being unpinned and re-added. Every ``audit_interval``
+    seconds each node's ``pin/ls`` is streamed and compared with the pins
+    table. Referenced CIDs a node lacks are pinned again. Pins the table
+    doesn't know are reported as leaks but left alone, since Kubo may hold
+    pins the app didn't make. Each run also records the size of new pins,
+    for per-user storage accounting (``db.get_storage_usage``) and so
+    unpins count toward gc's byte threshold. A database lease, renewed as
+    the run goes, keeps app nodes from running at the same time; a second
+    one, held for ``audit_interval``, lets one node audit per interval.
+    """
+
+    LEASE = "ipfs-pins"
+    AUDIT_LEASE = "ipfs-pin-audit"
+    LEAK_SAMPLE = 20
+
+    def __init__(self, interval=IPFS_UNPIN_INTERVAL, grace=IPFS_UNPIN_GRACE,
+                 audit_interval=IPFS_PIN_AUDIT_INTERVAL, batch=500):
+        self.interval = interval
+        self.grace = grace
+        self.audit_interval = audit_interval
+        self.batch = batch
+        self.runs = self.unpinned = self.repinned = self.audits = self.failed = 0
+        self.last_audit_at = None
+        self.last_audit = {}
+        self._task = None
+
+    async def sweep(self) -> int:
+        """Unpin one batch of released pins; returns how many were claimed."""
+        import db as _db
+
+        claimed = await _db.claim_released_pins(int(time.time() - self.grace), self.batch)
+        if not claimed:
+            return 0
+        cids = list(claimed)
+        try:
+            await ipfs_unpin_many(cids, claimed)
+        except httpx.HTTPError:
+            await _db.unclaim_pins(claimed)
+            raise
+        # Referenced again while being unpinned (the same bytes added back)
+        again = [cid for cid, refs in (await _db.get_pin_refcounts(cids)).items() if refs > 0]
+        if again:
+            await ipfs_pin_many(again)
+        self.unpinned += len(cids) - len(again)
+        self.repinned += len(again)
+        return len(cids)
+
+    async def _audit(self, node: KuboNode) -> dict:
+        import db as _db
+
+        seen, leaks = set(), []
+        async for chunk in _pin_ls_on(node, self.batch):
+            seen.update(chunk)
+            known = await _db.get_pin_refcounts(chunk)
+            leaks.extend(cid for cid in chunk if cid not in known)
+        missing, after = [], ""
+        while page := await _db.get_referenced_pins(after, self.batch):
+            missing.extend(cid for cid in page if cid not in seen)
+            after = page[-1]
+        for i in range(0, len(missing), self.batch):
+            await _pin_on(node, missing[i:i + self.batch], LONG_TIMEOUT)
+        self.repinned += len(missing)
+        return {
+            "pinned": len(seen),
+            "leaks": len(leaks),
+            "missing": len(missing),
+            "leak_sample": leaks[:self.LEAK_SAMPLE],
+        }
+
+    async def _size_pins(self):
+        import db as _db
+
+        cids = await _db.get_unsized_pins(self.batch)
+        sizes = {cid: await _cumulative_size(cid) for cid in cids}
+        await _db.set_pin_sizes({cid: size for cid, size in sizes.items() if size})
+
+    async def audit(self, hold=None) -> dict | None:
+        """Compare every reachable node's pins with the pins table;
+        returns ``{api: {'pinned', 'leaks', 'missing', 'leak_sample'}}``.
+
+        ``hold()`` is awaited before each node to renew the run's lease; the
+        audit stops, returning None, once it reports the lease lost.
+        """
+        report = {}
+        for node in list(nodes):
+            if not node.available():
+                continue
+            if hold is not None and not await hold():
+                return None
+            try:
+                report[node.api] = await self._audit(node)
+            except httpx.HTTPError:
+                self.failed += 1
+        await self._size_pins()
+        self.audits += 1
+        self.last_audit_at = time.time()
+        self.last_audit = report
+        return report
+
+    async def _hold(self) -> bool:
+        """Take or renew the run's lease; False once another node holds it."""
+        import db as _db
+
+        return await _db.acquire_lease(self.LEASE, NODE_ID, max(LONG_TIMEOUT.read * 2, 60))
+
+    async def _audit_due(self) -> bool:
+        """Whether an audit is due on any app node. The node that audits
+        holds AUDIT_LEASE for ``audit_interval``, so the others skip."""
+        import db as _db
+
+        if self.audit_interval <= 0:
+            return False
+        if self.last_audit_at is not None and time.time() - self.last_audit_at < self.audit_interval:
+            return False
+        return await _db.acquire_lease(self.AUDIT_LEASE, NODE_ID, self.audit_interval)
+
+    async def run(self) -> int:
+        """Unpin every released pin past its grace period, then audit if
+        one is due (else size new pins); returns the number of pins claimed.
+
+        The lease is renewed between sweep batches and audited nodes; the
+        run stops early if another node has taken it over.
+        """
+        import db as _db
+
+        if not await self._hold():
+            return 0
+        claimed = 0
+        try:
+            while (swept := await self.sweep()):
+                claimed += swept
+                if swept < self.batch:
+                    break
+                if not await self._hold():
+                    return claimed
+            if await self._audit_due():
+                try:
+                    report = await self.audit(hold=self._hold)
+                except BaseException:
+                    await _db.release_lease(self.AUDIT_LEASE, NODE_ID)
+                    raise
+                if report is None:
+                    # Cut short: let the next run, on any node, audit again
+                    await _db.release_lease(self.AUDIT_LEASE, NODE_ID)
+                    return claimed
+            else:
+                # Size new pins while still pinned, for gc's byte threshold
+                await self._size_pins()
+        finally:
+            await _db.release_lease(self.LEASE, NODE_ID)
+        self.runs += 1
+        return claimed
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception:
+                pass  # Kubo or the database unavailable: try again next cycle
+
+    def start(self):
+        """Start the unpin/audit loop (``app.on_startup``; a no-op when
+        interval is 0)."""
+        if self.interval <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "unpinned": self.unpinned,
+            "repinned": self.repinned,
+            "audits": self.audits,
+            "failed": self.failed,
+            "last_audit_at": self.last_audit_at,
+            "last_audit": self.last_audit,
+        }
+
+
+pin_reconciler = PinReconciler()
+
+
+def stats() -> dict:
+    """Operational counters for /api/metrics/ipfs."""
+    return {
+        "republish": republisher.stats(),
+        "gc": gc_scheduler.stats(),
+        "cat_cache": cat_cache.stats(),
+        "nodes": [node.stats() for node in nodes],
+        "replication": {"policy": KUBO_WRITE_POLICY, **reconciler.stats()},
+        "ipns_refresh": refresher.stats(),
+        "visitors": visitors.stats(),
+        "pins": pin_reconciler.stats(),
+        "republish_errors": list(republisher.errors),
+    }
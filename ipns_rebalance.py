@@ -0,0 +1,101 @@
+"""Move IPNS keys onto the Kubo node the placement ring assigns them.
+
+New members' keys are placed with ``ipfs_client.place_key`` and the node
+is recorded in ``users.ipns_node``. After adding a node to KUBO_API /
+KUBO_REPLICAS (or removing one), run::
+
+    python ipns_rebalance.py [--dry-run]
+
+Only keys whose ring position changed move, roughly 1/N of them for an
+added node. A move imports the key from the member's Guardian-encrypted
+``ipns_key_backup`` into the new node and republishes the current linktree
+CID from there. It then records the new placement and removes the key from
+the old node. Keys without a backup are left where they are.
+
+Only keys held by Kubo (IPNS_SIGNING=kubo) have a placement; with
+app-signed records there is nothing to move.
+"""
+
+import argparse
+import asyncio
+
+import httpx
+
+import db
+import ipfs_client
+
+
+def plan(users) -> list:
+    """``[(user, target_api), ...]`` for users whose key isn't on its ring node."""
+    if ipfs_client.IPNS_SIGNING != 'kubo':
+        return []
+    moves = []
+    for user in users:
+        target = ipfs_client.place_key(user['ipns_key_name'])
+        if (user['ipns_node'] or ipfs_client.nodes[0].api) != target:
+            moves.append((user, target))
+    return moves
+
+
+async def move_key(user, target: str):
+    key_name = user['ipns_key_name']
+    ipns_name = await ipfs_client.ipns_key_import(
+        key_name, ipfs_client.decrypt_key_backup(user['ipns_key_backup']), target,
+    )
+    if user['ipns_name'] and ipns_name != user['ipns_name']:
+        raise ValueError(f"Backup for {key_name} does not match {user['ipns_name']}")
+    if user['linktree_cid']:
+        await ipfs_client.ipns_publish(key_name, user['linktree_cid'], target)
+    await db.update_user(user['id'], ipns_node=target)
+    try:
+        await ipfs_client.ipns_key_remove(key_name, user['ipns_node'])
+    except (httpx.HTTPError, LookupError):
+        pass  # old node gone, or the key was already removed
+
+
+async def rebalance(*, dry_run=False, report=None) -> dict:
+    """Move every misplaced key; returns ``{'moved', 'skipped', 'failed'}``.
+
+    ``report(user, target, outcome)`` is called per misplaced key.
+    """
+    counts = {'moved': 0, 'skipped': 0, 'failed': 0}
+    for user, target in plan(await db.get_ipns_placements()):
+        if dry_run:
+            outcome = 'planned'
+        elif not user['ipns_key_backup']:
+            outcome = 'skipped'
+        else:
+            try:
+                await move_key(user, target)
+                outcome = 'moved'
+            except Exception:
+                outcome = 'failed'
+        if outcome in counts:
+            counts[outcome] += 1
+        if report is not None:
+            report(user, target, outcome)
+    return counts
+
+
+async def _run(dry_run):
+    await db.init_db()
+    try:
+        return await rebalance(
+            dry_run=dry_run,
+            report=lambda user, target, outcome: print(f"{user['ipns_key_name']} -> {target}: {outcome}"),
+        )
+    finally:
+        await ipfs_client.close_client()
+        await db.close_pool()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move IPNS keys to their placement ring node.')
+    parser.add_argument('--dry-run', action='store_true', help='list the moves without making them')
+    args = parser.parse_args(argv)
+    counts = asyncio.run(_run(args.dry_run))
+    print(', '.join(f'{name}: {n}' for name, n in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
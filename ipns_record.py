@@ -0,0 +1,168 @@
+"""Create IPNS keys and signed IPNS records in-process, without Kubo.
+
+Keys are ed25519, serialized as a libp2p ``PrivateKey`` protobuf: the same
+bytes Kubo keeps in its keystore and accepts on ``key/import``, so keys
+move freely between the app and a Kubo node. Records follow the IPNS
+record spec: an ``IpnsEntry`` protobuf whose DAG-CBOR ``data`` is signed
+(signatureV2), plus the legacy V1 fields and signature for older
+resolvers. ``ipfs_client`` pushes them to Kubo with ``routing/put``.
+"""
+
+from datetime import datetime, timezone
+
+import nacl.exceptions
+import nacl.signing
+
+from ipfs_cid import _bytes_field, _uint_field, _varint
+
+_ED25519 = 1
+_LIBP2P_KEY = 0x72
+_IDENTITY = 0x00
+_B36_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+_V2_PREFIX = b"ipns-signature:"
+
+
+# ── Keys ──
+
+def _fields(buf: bytes) -> dict:
+    """Decode a flat protobuf message into ``{field_number: value}``."""
+    out, i = {}, 0
+    while i < len(buf):
+        key, i = _read_varint(buf, i)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            out[number], i = _read_varint(buf, i)
+        elif wire == 2:
+            size, i = _read_varint(buf, i)
+            out[number], i = buf[i:i + size], i + size
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire}")
+    return out
+
+
+def _read_varint(buf: bytes, i: int):
+    n = shift = 0
+    while True:
+        byte = buf[i]
+        i += 1
+        n |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return n, i
+        shift += 7
+
+
+def generate_key() -> bytes:
+    """A new ed25519 key as libp2p ``PrivateKey`` protobuf bytes."""
+    signing = nacl.signing.SigningKey.generate()
+    return _uint_field(1, _ED25519) + _bytes_field(2, bytes(signing) + bytes(signing.verify_key))
+
+
+def _signing_key(private_key: bytes) -> nacl.signing.SigningKey:
+    fields = _fields(private_key)
+    if fields.get(1, 0) != _ED25519:
+        raise ValueError("only ed25519 IPNS keys are supported")
+    return nacl.signing.SigningKey(fields[2][:32])  # seed, then the public key
+
+
+def _base36(raw: bytes) -> str:
+    n = int.from_bytes(raw, "big")
+    out = ""
+    while n:
+        n, rem = divmod(n, 36)
+        out = _B36_ALPHABET[rem] + out
+    pad = len(raw) - len(raw.lstrip(b"\0"))
+    return "0" * pad + out
+
+
+def ipns_name(private_key: bytes) -> str:
+    """The key's IPNS name: its peer ID as a base36 CIDv1 (``k51...``),
+    the form Kubo returns from ``key/gen``."""
+    public = bytes(_signing_key(private_key).verify_key)
+    public_key = _uint_field(1, _ED25519) + _bytes_field(2, public)
+    multihash = bytes([_IDENTITY, len(public_key)]) + public_key
+    return "k" + _base36(_varint(1) + _varint(_LIBP2P_KEY) + multihash)
+
+
+# ── Records ──
+
+def _cbor_head(major: int, n: int) -> bytes:
+    if n < 24:
+        return bytes([major << 5 | n])
+    for extra, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+        if n < 1 << (8 * size):
+            return bytes([major << 5 | extra]) + n.to_bytes(size, "big")
+    raise ValueError("integer too large for CBOR")
+
+
+def _cbor_map(entries: dict) -> bytes:
+    """DAG-CBOR map of text keys to bytes / unsigned ints, keys in
+    canonical (length, then bytewise) order."""
+    out = _cbor_head(5, len(entries))
+    for key in sorted(entries, key=lambda k: (len(k), k)):
+        value = entries[key]
+        out += _cbor_head(3, len(key)) + key.encode()
+        if isinstance(value, bytes):
+            out += _cbor_head(2, len(value)) + value
+        else:
+            out += _cbor_head(0, value)
+    return out
+
+
+def _validity(eol: datetime) -> bytes:
+    """RFC 3339 with nanoseconds in UTC, as go-ipns writes it."""
+    eol = eol.astimezone(timezone.utc)
+    return (eol.strftime("%Y-%m-%dT%H:%M:%S") + f".{eol.microsecond * 1000:09d}Z").encode()
+
+
+def create_record(private_key: bytes, value: str, sequence: int,
+                  eol: datetime, ttl: float) -> bytes:
+    """A signed, marshalled IPNS record pointing at ``value`` (e.g.
+    ``/ipfs/<cid>``), valid until ``eol`` and cacheable for ``ttl`` seconds.
+    ``sequence`` must grow with every record published for the key."""
+    signing = _signing_key(private_key)
+    value = value.encode()
+    validity = _validity(eol)
+    ttl_ns = int(ttl * 1e9)
+    data = _cbor_map({
+        "Value": value,
+        "Validity": validity,
+        "ValidityType": 0,  # EOL
+        "Sequence": sequence,
+        "TTL": ttl_ns,
+    })
+    signature_v1 = signing.sign(value + validity + b"EOL").signature
+    signature_v2 = signing.sign(_V2_PREFIX + data).signature
+    # ed25519 public keys are inlined in the name, so pubKey (7) is omitted
+    return (
+        _bytes_field(1, value)
+        + _bytes_field(2, signature_v1)
+        + _uint_field(3, 0)
+        + _bytes_field(4, validity)
+        + _uint_field(5, sequence)
+        + _uint_field(6, ttl_ns)
+        + _bytes_field(8, signature_v2)
+        + _bytes_field(9, data)
+    )
+
+
+def decode_record(record: bytes) -> dict:
+    """The main fields of a marshalled record (for inspection and tests)."""
+    fields = _fields(record)
+    return {
+        "value": fields.get(1, b"").decode(),
+        "validity": fields.get(4, b"").decode(),
+        "sequence": fields.get(5, 0),
+        "ttl": fields.get(6, 0) / 1e9,
+        "signature_v2": fields.get(8, b""),
+        "data": fields.get(9, b""),
+    }
+
+
+def verify_record(record: bytes, private_key: bytes) -> bool:
+    """Whether ``record`` carries a valid V2 signature by ``private_key``."""
+    fields = decode_record(record)
+    try:
+        _signing_key(private_key).verify_key.verify(_V2_PREFIX + fields["data"], fields["signature_v2"])
+    except nacl.exceptions.BadSignatureError:
+        return False
+    return True
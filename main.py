@@ -1,5 +1,8 @@
 import config  # noqa: F401 — triggers startup validation
 import db
+import db_archive
+import db_backup
+import db_metrics
 from nicegui import ui, app
 from fastapi import Request, HTTPException
 import os
@@ -34,6 +37,60 @@ import time as _time
 static_files_dir = os.path.join(os.path.dirname(__file__), 'static')
 app.add_static_files('/static', static_files_dir)
 app.on_startup(db.init_db)
+app.on_startup(db_backup.start_scheduler)
+app.on_startup(db_archive.start_scheduler)
+app.on_startup(ipfs_client.open_client)
+app.on_startup(ipfs_client.republisher.start)
+app.on_startup(ipfs_client.gc_scheduler.start)
+app.on_startup(ipfs_client.reconciler.start)
+app.on_startup(ipfs_client.refresher.start)
+app.on_startup(ipfs_client.pin_reconciler.start)
+app.on_shutdown(db_backup.stop_scheduler)
+app.on_shutdown(db_archive.stop_scheduler)
+app.on_shutdown(ipfs_client.republisher.stop)
+app.on_shutdown(ipfs_client.gc_scheduler.stop)
+app.on_shutdown(ipfs_client.reconciler.stop)
+app.on_shutdown(ipfs_client.refresher.stop)
+app.on_shutdown(ipfs_client.pin_reconciler.stop)
+app.on_shutdown(ipfs_client.shutdown_signer)
+app.on_shutdown(ipfs_client.close_client)
+app.on_shutdown(db.close_pool)
+
+
+# ─── DB Metrics (opt-in via DATABASE_METRICS) ────────────────────────────────
+
+@app.middleware('http')
+async def db_query_scope(request: Request, call_next):
+    """Tally db calls per route so per-page query counts show up in metrics."""
+    if not db_metrics.registry.enabled:
+        return await call_next(request)
+    with db_metrics.page_scope() as scope:
+        response = await call_next(request)
+    route = request.scope.get('route')
+    db_metrics.registry.record_page(getattr(route, 'path', request.url.path), scope)
+    return response
+
+
+def _require_local(request: Request):
+    if not request.client or request.client.host not in ('127.0.0.1', '::1'):
+        raise HTTPException(status_code=403, detail='Forbidden')
+
+
+@app.get('/api/metrics/db')
+async def db_metrics_snapshot(request: Request):
+    """Dump the db metrics registry (local scrapers only)."""
+    if not db_metrics.registry.enabled:
+        raise HTTPException(status_code=404, detail='DB metrics are disabled')
+    _require_local(request)
+    return db_metrics.registry.snapshot()
+
+
+@app.get('/api/metrics/ipfs')
+async def ipfs_metrics_snapshot(request: Request):
+    """Republish, gc, IPNS refresh, pin, cache, replica node and visitor
+    counters (local scrapers only)."""
+    _require_local(request)
+    return ipfs_client.stats()
 
 
 # ─── Stripe Webhook (FastAPI route) ───────────────────────────────────────────
@@ -267,26 +324,32 @@ async def profile():
         return
 
     user_id = app.storage.user.get('user_id')
-    user = await db.get_user_by_id(user_id)
-    if not user:
+    bundle = await db.get_profile_bundle(user_id)
+    if not bundle:
         app.storage.user.clear()
         ui.navigate.to('/login')
         return
+    user = bundle['user']
     moniker = user['moniker']
     member_type = app.storage.user.get('member_type', 'free')
-    psettings = await db.get_profile_settings(user_id)
-    colors = await db.get_profile_colors(user_id)
+    psettings = bundle['settings']
+    colors = bundle['colors']
     dark_mode = bool(psettings.get('dark_mode', 0))
     palette = resolve_active_palette(colors, dark_mode)
 
-    avatar_cid = dict(user).get('avatar_cid')
+    avatar_cid = user.get('avatar_cid')
     header = dashboard_header(moniker, member_type, user_id=user_id,
                               override_enabled=bool(psettings['linktree_override']),
                               override_url=psettings['linktree_url'],
                               ipns_name=user['ipns_name'],
                               avatar_cid=avatar_cid)
     show_dashboard_chrome(header)
-    await load_and_apply_theme(user_id)
+    apply_theme(**palette)
+
+    # First render of the refreshable sections reuses the bundle's rows;
+    # later refreshes re-query.
+    prefetched_links = bundle['links']
+    prefetched_wallets = bundle['denom_wallets']
 
     # Avatar upload bridge (hidden trigger — same pattern as card editor)
     async def process_avatar_upload():
@@ -308,8 +371,11 @@ async def profile():
             img_bytes = base64.b64decode(b64)
             user_row = await db.get_user_by_id(user_id)
             old_cid = user_row['avatar_cid'] if user_row else None
-            new_cid = await ipfs_client.replace_asset(img_bytes, old_cid, 'avatar.png')
-            await db.update_user(user_id, avatar_cid=new_cid)
+            await ipfs_client.replace_asset(
+                img_bytes, old_cid, 'avatar.png',
+                user_id=user_id, owner=('users', user_id, 'avatar_cid'),
+                save=lambda cid: db.update_user(user_id, avatar_cid=cid),
+            )
             await regenerate_qr(user_id)
             await regenerate_all_link_qrs(user_id)
             await regenerate_qr_card_front(user_id)
@@ -339,14 +405,34 @@ async def profile():
 
             @ui.refreshable
             async def links_section():
-                links = await db.get_links(user_id)
+                nonlocal prefetched_links
+                links, prefetched_links = prefetched_links, None
+                if links is None:
+                    links = await db.get_links(user_id)
+                link_ids = [link['id'] for link in links]
+                dragged = {}
+
+                async def drop_on(target_id):
+                    source_id = dragged.pop('id', None)
+                    if source_id is None or source_id == target_id:
+                        return
+                    order = list(link_ids)
+                    order.insert(order.index(target_id), order.pop(order.index(source_id)))
+                    await db.reorder_links(user_id, order)
+                    ipfs_client.schedule_republish(user_id)
+                    links_section.refresh()
+
                 if links:
                     for link in links:
                         link_id = link['id']
                         with ui.row().classes(
-                            'items-center bg-gray-100 py-2 px-4 rounded-full w-full gap-3'
-                        ):
-                            qr_cid = dict(link).get('qr_cid')
+                            'items-center bg-gray-100 py-2 px-4 rounded-full w-full gap-3 cursor-move'
+                        ).props('draggable') as link_row:
+                            link_row.on('dragstart', lambda lid=link_id: dragged.update(id=lid))
+                            link_row.on('dragover.prevent', lambda: None)
+                            link_row.on('drop', lambda lid=link_id: drop_on(lid))
+                            ui.icon('drag_indicator').classes('text-gray-400')
+                            qr_cid = link.get('qr_cid')
                             qr_thumb = (f'{config.KUBO_GATEWAY}/ipfs/{qr_cid}'
                                         if qr_cid else
                                         link['icon_url'] or '/static/placeholder.png')
@@ -375,6 +461,7 @@ async def profile():
                                 user_id=user_id,
                                 label=add_label.value.strip(),
                                 url=url_val,
+                                sort_order=len(link_ids),
                             )
                             await generate_link_qr(user_id, link_id, url_val)
                             ipfs_client.schedule_republish(user_id)
@@ -409,11 +496,8 @@ async def profile():
                         async def save_edit():
                             if edit_label.value and edit_url.value:
                                 new_url = edit_url.value.strip()
-                                # Regenerate QR if URL changed
+                                # Regenerate QR if URL changed (releases the old one)
                                 if new_url != current_url:
-                                    old_link = await db.get_link_by_id(link_id)
-                                    if old_link and dict(old_link).get('qr_cid'):
-                                        await ipfs_client.ipfs_unpin(dict(old_link)['qr_cid'])
                                     await generate_link_qr(user_id, link_id, new_url)
                                 await db.update_link(
                                     link_id,
@@ -435,11 +519,12 @@ async def profile():
                         ui.button('Cancel', on_click=dialog.close).props('flat')
 
                         async def do_delete():
-                            # Unpin QR before deleting
-                            old_link = await db.get_link_by_id(link_id)
-                            if old_link and dict(old_link).get('qr_cid'):
-                                await ipfs_client.ipfs_unpin(dict(old_link)['qr_cid'])
-                            await db.delete_link(link_id)
+                            # Release the QR; it is unpinned once no row uses it
+                            async with db.transaction():
+                                await ipfs_client.track_pins(
+                                    user_id, {('link_tree', link_id, 'qr_cid'): None}
+                                )
+                                await db.delete_link(link_id)
                             ipfs_client.schedule_republish(user_id)
                             dialog.close()
                             links_section.refresh()
@@ -457,9 +542,11 @@ async def profile():
 
                 @ui.refreshable
                 async def wallets_section():
-                    wallets = await db.get_denom_wallets(user_id)
+                    nonlocal prefetched_wallets
+                    wallets, prefetched_wallets = prefetched_wallets, None
+                    if wallets is None:
+                        wallets = await db.get_denom_wallets(user_id)
                     for w in wallets:
-                        w = dict(w)
                         wallet_id = w['id']
                         denom = w['denomination']
                         addr = w['stellar_address']
@@ -524,10 +611,11 @@ async def profile():
                             ui.button('Cancel', on_click=dialog.close).props('flat')
 
                             async def do_delete():
-                                w = await db.get_denom_wallet_by_id(wallet_id)
-                                if w and dict(w).get('qr_cid'):
-                                    await ipfs_client.ipfs_unpin(dict(w)['qr_cid'])
-                                await db.discard_denom_wallet(wallet_id)
+                                async with db.transaction():
+                                    await ipfs_client.track_pins(
+                                        user_id, {('denom_wallets', wallet_id, 'qr_cid'): None}
+                                    )
+                                    await db.discard_denom_wallet(wallet_id)
                                 ipfs_client.schedule_republish(user_id)
                                 dialog.close()
                                 wallets_section.refresh()
@@ -554,10 +642,8 @@ async def card_editor():
     # Get or create a draft card (NFC)
     draft = await db.get_draft_card(user_id)
     if not draft:
-        card_id = await db.create_user_card(user_id)
-        draft = await db.get_draft_card(user_id)
-    else:
-        card_id = draft['id']
+        draft = await db.create_user_card(user_id, returning=True)
+    card_id = draft['id']
 
     existing_front_cid = draft['front_image_cid'] if draft else None
     existing_back_cid = draft['back_image_cid'] if draft else None
@@ -624,8 +710,11 @@ async def card_editor():
                 content = base64.b64decode(b64_data)
                 qr_row = await db.get_qr_card(user_id)
                 old_cid = dict(qr_row).get('back_image_cid') if qr_row else None
-                new_cid = await ipfs_client.replace_asset(content, old_cid, 'qr_card_back.png')
-                await db.upsert_qr_card(user_id, back_image_cid=new_cid)
+                new_cid = await ipfs_client.replace_asset(
+                    content, old_cid, 'qr_card_back.png',
+                    user_id=user_id, owner=('qr_cards', user_id, 'back_image_cid'),
+                    save=lambda cid: db.upsert_qr_card(user_id, back_image_cid=cid),
+                )
                 texture_url = f'{config.KUBO_GATEWAY}/ipfs/{new_cid}'
                 await ui.run_javascript(f"window.updateCardTexture('back', '{texture_url}')")
                 ui.notify('QR card back image saved', type='positive')
@@ -645,8 +734,11 @@ async def card_editor():
             content = base64.b64decode(b64_data)
             current_draft = await db.get_draft_card(user_id)
             old_cid = current_draft[cid_field] if current_draft else None
-            new_cid = await ipfs_client.replace_asset(content, old_cid, filename)
-            await db.update_card_images(card_id, **{cid_field: new_cid})
+            new_cid = await ipfs_client.replace_asset(
+                content, old_cid, filename,
+                user_id=user_id, owner=('user_cards', card_id, cid_field),
+                save=lambda cid: db.update_card_images(card_id, **{cid_field: cid}),
+            )
             ipfs_client.schedule_republish(user_id)
             texture_url = f'{config.KUBO_GATEWAY}/ipfs/{new_cid}'
             await ui.run_javascript(f"window.updateCardTexture('{face}', '{texture_url}')")
@@ -989,21 +1081,22 @@ def _open_shipping_dialog(card_id, payment_method, amount_usd, tx_hash=None):
                 return
 
             try:
-                order_id = await db.create_card_order(
-                    user_id=user_id,
-                    card_id=card_id,
-                    payment_method=payment_method,
-                    amount_usd=amount_usd,
-                    shipping_name=name_field.value.strip(),
-                    shipping_street=street_field.value.strip(),
-                    shipping_city=city_field.value.strip(),
-                    shipping_state=state_field.value.strip(),
-                    shipping_zip=zip_field.value.strip(),
-                    shipping_country=country_field.value.strip(),
-                    tx_hash=tx_hash,
-                    payment_status='paid' if payment_method == 'entitlement' else 'paid',
-                )
-                await db.finalize_card_order(order_id, tx_hash=tx_hash)
+                async with db.transaction():
+                    order_id = await db.create_card_order(
+                        user_id=user_id,
+                        card_id=card_id,
+                        payment_method=payment_method,
+                        amount_usd=amount_usd,
+                        shipping_name=name_field.value.strip(),
+                        shipping_street=street_field.value.strip(),
+                        shipping_city=city_field.value.strip(),
+                        shipping_state=state_field.value.strip(),
+                        shipping_zip=zip_field.value.strip(),
+                        shipping_country=country_field.value.strip(),
+                        tx_hash=tx_hash,
+                        payment_status='paid' if payment_method == 'entitlement' else 'paid',
+                    )
+                    await db.finalize_card_order(order_id, tx_hash=tx_hash)
 
                 # Send vendor fulfillment email (best-effort)
                 try:
@@ -1337,23 +1430,24 @@ def _open_qr_shipping_dialog(user_id, payment_method, amount_usd, quantity,
                 return
 
             try:
-                order_id = await db.create_card_order(
-                    user_id=user_id,
-                    card_id=user_id,  # QR cards use user_id as card_id
-                    payment_method=payment_method,
-                    amount_usd=amount_usd,
-                    shipping_name=name_field.value.strip(),
-                    shipping_street=street_field.value.strip(),
-                    shipping_city=city_field.value.strip(),
-                    shipping_state=state_field.value.strip(),
-                    shipping_zip=zip_field.value.strip(),
-                    shipping_country=country_field.value.strip(),
-                    tx_hash=tx_hash,
-                    payment_status='paid',
-                    card_type='qr',
-                    quantity=quantity,
-                )
-                await db.finalize_card_order(order_id, tx_hash=tx_hash)
+                async with db.transaction():
+                    order_id = await db.create_card_order(
+                        user_id=user_id,
+                        card_id=user_id,  # QR cards use user_id as card_id
+                        payment_method=payment_method,
+                        amount_usd=amount_usd,
+                        shipping_name=name_field.value.strip(),
+                        shipping_street=street_field.value.strip(),
+                        shipping_city=city_field.value.strip(),
+                        shipping_state=state_field.value.strip(),
+                        shipping_zip=zip_field.value.strip(),
+                        shipping_country=country_field.value.strip(),
+                        tx_hash=tx_hash,
+                        payment_status='paid',
+                        card_type='qr',
+                        quantity=quantity,
+                    )
+                    await db.finalize_card_order(order_id, tx_hash=tx_hash)
 
                 # Send vendor fulfillment email (best-effort)
                 try:
@@ -1422,6 +1516,39 @@ async def qr_card_order_success(session_id: str = ''):
 
 # ─── Card Wallet (3D) ────────────────────────────────────────────────────────
 
+def _peer_card_data(peer):
+    return {
+        'type': 'peer',
+        'moniker': peer.moniker,
+        'front_url': (f'{config.KUBO_GATEWAY}/ipfs/{peer.nfc_image_cid}'
+                      if peer.nfc_image_cid else ''),
+        'back_url': (f'{config.KUBO_GATEWAY}/ipfs/{peer.nfc_back_image_cid}'
+                     if peer.nfc_back_image_cid else ''),
+        'linktree_url': f'/profile/{db.moniker_slug(peer.moniker)}',
+    }
+
+
+def _next_peer_cursor(peers):
+    """Cursor token for the page after ``peers``, or None on the last page."""
+    if len(peers) < db.PAGE_SIZE:
+        return None
+    last = peers[-1]
+    return db.encode_cursor((last['collected_at'], last['peer_card_id']))
+
+
+@app.get('/api/card-case/peers')
+async def card_case_peers(after: str = ''):
+    """Next page of the signed-in member's peer cards for the card wallet."""
+    if not app.storage.user.get('authenticated'):
+        raise HTTPException(status_code=401, detail='Not signed in')
+    user_id = app.storage.user.get('user_id')
+    peers = await db.get_peer_cards(
+        user_id, after=db.decode_cursor(after), limit=db.PAGE_SIZE,
+    )
+    return {'cards': [_peer_card_data(p) for p in peers],
+            'next': _next_peer_cursor(peers)}
+
+
 @ui.page('/card/case')
 async def card_case():
     if not require_auth():
@@ -1432,41 +1559,29 @@ async def card_case():
     moniker = user['moniker'] if user else app.storage.user.get('moniker', 'Unknown')
     member_type = app.storage.user.get('member_type', 'free')
     psettings = await db.get_profile_settings(user_id)
-    moniker_slug = moniker.lower().replace(' ', '-')
+    moniker_slug = db.moniker_slug(moniker)
 
     # Own finalized cards
     own_cards = await db.get_user_cards(user_id, exclude_draft=True)
     own_data = []
     for c in own_cards:
-        cd = dict(c)
         own_data.append({
             'type': 'own',
-            'card_id': cd['id'],
+            'card_id': c.id,
             'moniker': moniker,
-            'front_url': (f'{config.KUBO_GATEWAY}/ipfs/{cd["front_image_cid"]}'
-                          if cd.get('front_image_cid') else ''),
-            'back_url': (f'{config.KUBO_GATEWAY}/ipfs/{cd["back_image_cid"]}'
-                         if cd.get('back_image_cid') else ''),
-            'is_active': bool(cd['is_active']),
-            'status': cd['status'],
+            'front_url': (f'{config.KUBO_GATEWAY}/ipfs/{c.front_image_cid}'
+                          if c.front_image_cid else ''),
+            'back_url': (f'{config.KUBO_GATEWAY}/ipfs/{c.back_image_cid}'
+                         if c.back_image_cid else ''),
+            'is_active': bool(c.is_active),
+            'status': c.status,
             'linktree_url': f'/profile/{moniker_slug}',
         })
 
-    # Peer cards (peer's active card via updated query)
-    peers = await db.get_peer_cards(user_id)
-    peer_data = []
-    for p in peers:
-        pd = dict(p)
-        peer_slug = pd['moniker'].lower().replace(' ', '-')
-        peer_data.append({
-            'type': 'peer',
-            'moniker': pd['moniker'],
-            'front_url': (f'{config.KUBO_GATEWAY}/ipfs/{pd["nfc_image_cid"]}'
-                          if pd.get('nfc_image_cid') else ''),
-            'back_url': (f'{config.KUBO_GATEWAY}/ipfs/{pd["nfc_back_image_cid"]}'
-                         if pd.get('nfc_back_image_cid') else ''),
-            'linktree_url': f'/profile/{peer_slug}',
-        })
+    # First page of peer cards; card_wallet.js fetches the rest on demand
+    peers = await db.get_peer_cards(user_id, limit=db.PAGE_SIZE)
+    peer_data = [_peer_card_data(p) for p in peers]
+    next_peers = _next_peer_cursor(peers)
 
     all_cards = own_data + peer_data
 
@@ -1509,7 +1624,7 @@ async def card_case():
 
         await db.add_peer_card(user_id, peer['id'])
         peer_moniker = peer['moniker']
-        peer_moniker_slug = peer_moniker.lower().replace(' ', '-')
+        peer_moniker_slug = db.moniker_slug(peer_moniker)
         # Get peer's active card images
         peer_active = await db.get_active_card(peer['id'])
         front_cid = peer_active['front_image_cid'] if peer_active else peer.get('nfc_image_cid')
@@ -1542,7 +1657,7 @@ async def card_case():
             ).classes('w-full')
 
             async def do_add():
-                slug = slug_input.value.strip().lower().replace(' ', '-')
+                slug = db.moniker_slug(slug_input.value)
                 if not slug:
                     ui.notify('Enter a moniker', type='warning')
                     return
@@ -1555,7 +1670,7 @@ async def card_case():
                     return
                 await db.add_peer_card(user_id, peer['id'])
                 peer_moniker = peer['moniker']
-                peer_moniker_slug = peer_moniker.lower().replace(' ', '-')
+                peer_moniker_slug = db.moniker_slug(peer_moniker)
                 peer_active = await db.get_active_card(peer['id'])
                 front_cid = peer_active['front_image_cid'] if peer_active else peer.get('nfc_image_cid')
                 back_cid = peer_active['back_image_cid'] if peer_active else peer.get('nfc_back_image_cid')
@@ -1601,7 +1716,7 @@ async def card_case():
     cards_json = json.dumps(all_cards)
     ui.add_body_html(f'''
     <div id="card-scene"></div>
-    <script id="card-data" type="application/json">{cards_json}</script>
+    <script id="card-data" type="application/json" data-next="{next_peers or ''}">{cards_json}</script>
     <script type="module" src="/static/js/card_wallet.js?v={_cache_v}"></script>
     ''')
 
@@ -1628,12 +1743,12 @@ async def qr_view():
     hide_dashboard_chrome(header)
 
     # Get or generate QR code
-    qr_cid = dict(user).get('qr_code_cid') if user else None
+    qr_cid = user.get('qr_code_cid') if user else None
     if not qr_cid:
         try:
             await regenerate_qr(user_id)
             user = await db.get_user_by_id(user_id)
-            qr_cid = dict(user).get('qr_code_cid')
+            qr_cid = user.get('qr_code_cid')
         except Exception:
             pass
 
@@ -2031,7 +2146,8 @@ async def linktree_page(ipns_name: str):
     if is_owner:
         linktree = await ipfs_client.build_linktree_fresh(user['id'])
     else:
-        linktree = await ipfs_client.fetch_linktree_json(user)
+        # Bounded wait on IPFS; falls back to the SQLite build when degraded
+        linktree, _ = await ipfs_client.fetch_linktree_for_visitor(user)
 
     if linktree.get('override_url'):
         ui.navigate.to(linktree['override_url'])
@@ -2046,16 +2162,7 @@ async def linktree_page(ipns_name: str):
 async def public_profile(moniker_slug: str):
     """Public profile route. Redirects to /lt/{ipns_name} when available,
     or renders directly from DB for the owner when IPNS isn't set up."""
-    import aiosqlite
-    from config import DATABASE_PATH
-
-    async with aiosqlite.connect(DATABASE_PATH) as conn:
-        conn.row_factory = aiosqlite.Row
-        cursor = await conn.execute(
-            "SELECT id, ipns_name FROM users WHERE LOWER(REPLACE(moniker, ' ', '-')) = ?",
-            (moniker_slug.lower(),)
-        )
-        user = await cursor.fetchone()
+    user = await db.get_user_by_moniker_slug(moniker_slug)
 
     if not user:
         ui.page_title('Heavymeta Profile')
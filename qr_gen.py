@@ -63,6 +63,9 @@ async def get_avatar_path(avatar_cid: str | None) -> str:
         return PLACEHOLDER
 
     import ipfs_client
+    cached = await ipfs_client.ipfs_cat_path(avatar_cid)
+    if cached:
+        return cached
     data = await ipfs_client.ipfs_cat(avatar_cid)
     tmp = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
     tmp.write(data)
@@ -89,12 +92,15 @@ async def _load_qr_style(user_id: str):
     fg = colors.get('dark_accent_color' if dark else 'accent_color', '#7a48a9')
     bg = colors.get('dark_bg_color' if dark else 'bg_color', '#efeff4')
 
-    avatar_path = await get_avatar_path(dict(user).get('avatar_cid'))
-    return fg, bg, avatar_path, dict(user)
+    avatar_path = await get_avatar_path(user.get('avatar_cid'))
+    return fg, bg, avatar_path, user
 
 
 def _cleanup_avatar(user_dict, avatar_path):
     """Remove temp avatar file if it was fetched from IPFS."""
+    import ipfs_client
+    if ipfs_client.cat_cache.owns(avatar_path):
+        return
     if user_dict.get('avatar_cid') and avatar_path != PLACEHOLDER:
         try:
             os.unlink(avatar_path)
@@ -113,13 +119,15 @@ async def regenerate_qr(user_id: str):
     fg, bg, avatar_path, user = style
 
     try:
-        slug = user['moniker'].lower().replace(' ', '-')
-        url = f'/profile/{slug}'
+        url = f'/profile/{_db.moniker_slug(user["moniker"])}'
 
         png_bytes = generate_user_qr(url, avatar_path, fg, bg)
         old_cid = user.get('qr_code_cid')
-        new_cid = await ipfs_client.replace_asset(png_bytes, old_cid, 'qr_code.png')
-        await _db.update_user(user_id, qr_code_cid=new_cid)
+        await ipfs_client.replace_asset(
+            png_bytes, old_cid, 'qr_code.png',
+            user_id=user_id, owner=('users', user_id, 'qr_code_cid'),
+            save=lambda cid: _db.update_user(user_id, qr_code_cid=cid),
+        )
     finally:
         _cleanup_avatar(user, avatar_path)
 
@@ -142,7 +150,9 @@ async def generate_link_qr(user_id: str, link_id: str, url: str):
     try:
         png_bytes = generate_user_qr(url, avatar_path, fg, bg)
         new_cid = await ipfs_client.ipfs_add(png_bytes, 'link_qr.png')
-        await _db.update_link(link_id, qr_cid=new_cid)
+        async with _db.transaction():
+            await _db.update_link(link_id, qr_cid=new_cid)
+            await ipfs_client.track_pins(user_id, {('link_tree', link_id, 'qr_cid'): new_cid})
         return new_cid
     finally:
         _cleanup_avatar(user, avatar_path)
@@ -163,14 +173,29 @@ async def regenerate_all_link_qrs(user_id: str):
 
     try:
         links = await _db.get_links(user_id)
+        changed = []
         for link in links:
-            link = dict(link)
-            old_cid = link.get('qr_cid')
-            if old_cid:
-                await ipfs_client.ipfs_unpin(old_cid)
             png_bytes = generate_user_qr(link['url'], avatar_path, fg, bg)
-            new_cid = await ipfs_client.ipfs_add(png_bytes, 'link_qr.png')
-            await _db.update_link(link['id'], qr_cid=new_cid)
+            # Unchanged QRs (same URL, colors and avatar) keep their CID
+            if link.qr_cid and ipfs_client.compute_cid(png_bytes) == link.qr_cid:
+                continue
+            changed.append((link, png_bytes))
+        if not changed:
+            return
+        # One add for every new QR and one commit for the CIDs; the
+        # replaced QRs are released together and unpinned in one batch
+        # once no other row uses them
+        new_cids = await ipfs_client.ipfs_add_many(
+            [('link_qr.png', png_bytes) for _, png_bytes in changed]
+        )
+        async with _db.transaction():
+            await _db.set_link_qr_cids(
+                {link['id']: cid for (link, _), cid in zip(changed, new_cids)}
+            )
+            await ipfs_client.track_pins(user_id, {
+                ('link_tree', link['id'], 'qr_cid'): cid
+                for (link, _), cid in zip(changed, new_cids)
+            })
     finally:
         _cleanup_avatar(user, avatar_path)
 
@@ -254,8 +279,7 @@ async def regenerate_qr_card_front(user_id: str) -> str | None:
     fg, bg, avatar_path, user = style
 
     try:
-        slug = user['moniker'].lower().replace(' ', '-')
-        url = f'/profile/{slug}'
+        url = f'/profile/{_db.moniker_slug(user["moniker"])}'
 
         qr_bytes = generate_user_qr(url, avatar_path, fg, bg)
         card_front_bytes = generate_qr_card_front(qr_bytes, bg)
@@ -263,9 +287,10 @@ async def regenerate_qr_card_front(user_id: str) -> str | None:
         qr_card = await _db.get_qr_card(user_id)
         old_cid = dict(qr_card).get('front_image_cid') if qr_card else None
         new_cid = await ipfs_client.replace_asset(
-            card_front_bytes, old_cid, 'qr_card_front.png'
+            card_front_bytes, old_cid, 'qr_card_front.png',
+            user_id=user_id, owner=('qr_cards', user_id, 'front_image_cid'),
+            save=lambda cid: _db.upsert_qr_card(user_id, front_image_cid=cid),
         )
-        await _db.upsert_qr_card(user_id, front_image_cid=new_cid)
         return new_cid
     finally:
         _cleanup_avatar(user, avatar_path)
@@ -285,7 +310,9 @@ async def generate_denom_wallet_qr(user_id: str, wallet_id: str, pay_uri: str,
     try:
         png_bytes = generate_denom_qr(pay_uri, avatar_path, denomination, fg, bg)
         new_cid = await ipfs_client.ipfs_add(png_bytes, 'denom_qr.png')
-        await _db.update_denom_wallet(wallet_id, qr_cid=new_cid)
+        async with _db.transaction():
+            await _db.update_denom_wallet(wallet_id, qr_cid=new_cid)
+            await ipfs_client.track_pins(user_id, {('denom_wallets', wallet_id, 'qr_cid'): new_cid})
         return new_cid
     finally:
         _cleanup_avatar(user, avatar_path)
@@ -109,12 +109,18 @@ async def seed():
         back_png = make_card_image(peer["back"], peer["text"], moniker, "back")
 
         try:
-            front_cid = await ipfs_client.ipfs_add(front_png, f"{moniker}_front.png")
-            back_cid = await ipfs_client.ipfs_add(back_png, f"{moniker}_back.png")
+            front_cid, back_cid = await ipfs_client.ipfs_add_many([
+                (f"{moniker}_front.png", front_png),
+                (f"{moniker}_back.png", back_png),
+            ])
             print(f"    front CID: {front_cid}")
             print(f"    back  CID: {back_cid}")
 
             await db.update_user(peer_id, nfc_image_cid=front_cid, nfc_back_image_cid=back_cid)
+            await ipfs_client.track_pins(peer_id, {
+                ('users', peer_id, 'nfc_image_cid'): front_cid,
+                ('users', peer_id, 'nfc_back_image_cid'): back_cid,
+            })
         except Exception as e:
             print(f"    IPFS error (skipping pin): {e}")
             front_cid = None
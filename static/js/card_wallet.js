@@ -7,6 +7,8 @@ if (!container) console.error('[card_wallet] #card-scene not found');
 
 const cardDataEl = document.getElementById('card-data');
 const peers = cardDataEl ? JSON.parse(cardDataEl.textContent) : [];
+// Cursor for the next page of peer cards (served by /api/card-case/peers)
+let nextPeersCursor = cardDataEl ? cardDataEl.dataset.next || null : null;
 
 // ─── Renderer ──────────────────────────────────────────────────────────────
 
@@ -130,6 +132,34 @@ cards.forEach(card => {
 function animateToPositions() {
   computeTargets();
   // Lerp handles the rest in the render loop
+  maybeLoadMorePeers();
+}
+
+// ─── Paged Peer Loading ───────────────────────────────────────────────────
+
+const LOAD_AHEAD = 5;  // fetch the next page this many cards before the end
+let loadingPeers = false;
+
+async function maybeLoadMorePeers() {
+  if (!nextPeersCursor || loadingPeers) return;
+  if (centerIndex < cards.length - LOAD_AHEAD) return;
+  loadingPeers = true;
+  try {
+    const resp = await fetch(`/api/card-case/peers?after=${encodeURIComponent(nextPeersCursor)}`);
+    if (!resp.ok) return;
+    const page = await resp.json();
+    // Peers added live by scan/manual add may reappear in a later page
+    const shown = new Set(cards.map(c => c.userData.peer.linktree_url));
+    page.cards.filter(entry => !shown.has(entry.linktree_url)).forEach(entry => {
+      const card = createCard(entry);
+      card._target = { x: 0, y: 0, z: 0, sx: 1, sy: 1, sz: 1, opacity: 1.0 };
+      cards.push(card);
+    });
+    nextPeersCursor = page.next;
+    computeTargets();
+  } finally {
+    loadingPeers = false;
+  }
 }
 
 // ─── Selection State ───────────────────────────────────────────────────────
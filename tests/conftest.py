@@ -10,19 +10,42 @@ os.environ["STRIPE_WEBHOOK_SECRET"] = "whsec_fake"
 os.environ["MAILTRAP_API_TOKEN"] = "fake_token"
 os.environ["APP_SECRET_KEY"] = "test-secret"
 os.environ["DATABASE_PATH"] = "./data/test_collective.db"
+# Point at a disposable Postgres (e.g. postgresql://localhost/collective_test)
+# to run the suite against the Postgres backend; empty runs it on SQLite
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", "")
 os.environ["STELLAR_NETWORK"] = "testnet"
 
 import pytest
 import db
 
 
+def _remove_db_files(db_path):
+    for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def _drop_postgres_schema():
+    async with db._pool.writer() as conn:
+        await conn.executescript("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+    await db.close_pool()
+
+
+def _reset_database(loop):
+    if db.DIALECT == 'postgres':
+        loop.run_until_complete(_drop_postgres_schema())
+    else:
+        _remove_db_files(db.DATABASE_PATH)
+
+
 @pytest.fixture(autouse=True)
 def setup_test_db():
     """Reset test database before each test (sync wrapper)."""
-    db_path = db.DATABASE_PATH
-    if os.path.exists(db_path):
-        os.remove(db_path)
-    asyncio.get_event_loop().run_until_complete(db.init_db())
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(db.close_pool())
+    db.clear_caches()
+    _reset_database(loop)
+    loop.run_until_complete(db.init_db())
     yield
-    if os.path.exists(db_path):
-        os.remove(db_path)
+    loop.run_until_complete(db.close_pool())
+    _reset_database(loop)
@@ -0,0 +1,542 @@
+import asyncio
+import pytest
+import db
+
+sqlite_only = pytest.mark.skipif(
+    db.DIALECT != 'sqlite', reason='exercises SQLite pool internals / query plans'
+)
+
+
+async def _make_user(moniker='tester', email=None):
+    return await db.create_user(
+        email=email or f'{moniker}@example.com',
+        moniker=moniker,
+        member_type='free',
+        password_hash='x',
+    )
+
+
+@sqlite_only
+@pytest.mark.asyncio
+async def test_pool_pragmas():
+    async with db._pool.writer() as conn:
+        row = await db._fetchone(conn, "PRAGMA journal_mode")
+        assert row[0] == 'wal'
+    async with db._pool.reader() as conn:
+        row = await db._fetchone(conn, "PRAGMA synchronous")
+        assert row[0] == 1  # NORMAL
+        row = await db._fetchone(conn, "PRAGMA query_only")
+        assert row[0] == 1
+
+
+@pytest.mark.asyncio
+async def test_reads_see_committed_writes():
+    user_id = await _make_user()
+    await db.update_user(user_id, avatar_cid='bafy-avatar')
+    user = await db.get_user_by_id(user_id)
+    assert user['avatar_cid'] == 'bafy-avatar'
+
+
+@pytest.mark.asyncio
+async def test_writer_rolls_back_on_error():
+    user_id = await _make_user()
+    with pytest.raises(RuntimeError):
+        async with db._pool.writer() as conn:
+            await conn.execute(
+                "UPDATE users SET avatar_cid = ? WHERE id = ?", ('bafy-x', user_id)
+            )
+            raise RuntimeError('boom')
+    user = await db.get_user_by_id(user_id)
+    assert user['avatar_cid'] is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads_and_writes():
+    user_id = await _make_user()
+
+    async def add(i):
+        await db.create_link(user_id=user_id, label=f'l{i}', url=f'https://{i}.example')
+        return await db.get_links(user_id)
+
+    await asyncio.gather(*(add(i) for i in range(20)))
+    assert len(await db.get_links(user_id)) == 20
+
+
+@pytest.mark.asyncio
+async def test_migrations_run_once():
+    assert await db.get_schema_version() == db.SCHEMA_VERSION
+    await db.init_db()
+    async with db._pool.reader() as conn:
+        rows = await conn.execute_fetchall("SELECT version FROM schema_version")
+    assert sorted(r[0] for r in rows) == list(range(1, db.SCHEMA_VERSION + 1))
+
+
+@pytest.mark.asyncio
+async def test_legacy_database_upgrades():
+    # Simulate a pre-schema_version database whose columns already exist
+    async with db._pool.writer() as conn:
+        await conn.execute("DELETE FROM schema_version")
+        await conn.execute("DROP INDEX idx_users_ipns_name")
+    await db.init_db()
+    assert await db.get_schema_version() == db.SCHEMA_VERSION
+
+
+@sqlite_only
+@pytest.mark.asyncio
+@pytest.mark.parametrize('sql, index', [
+    ("SELECT * FROM link_tree WHERE user_id = ? ORDER BY sort_order",
+     'idx_link_tree_user_sort'),
+    ("SELECT * FROM denom_wallets WHERE user_id = ? AND status = 'active' ORDER BY sort_order",
+     'idx_denom_wallets_user_status_sort'),
+    ("SELECT * FROM users WHERE ipns_name = ?", 'idx_users_ipns_name'),
+    ("SELECT * FROM payments WHERE memo = ?", 'idx_payments_memo'),
+])
+async def test_hot_queries_use_indexes(sql, index):
+    params = (None,) * sql.count('?')
+    async with db._pool.reader() as conn:
+        plan = await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}", params)
+    detail = ' '.join(row[3] for row in plan)
+    assert index in detail
+    assert 'TEMP B-TREE' not in detail
+
+
+@pytest.mark.asyncio
+async def test_moniker_slug_lookup():
+    user_id = await _make_user('Jane Doe', email='jane@example.com')
+    user = await db.get_user_by_moniker_slug('jane-doe')
+    assert user['id'] == user_id
+    assert user['moniker_slug'] == 'jane-doe'
+
+    await db.update_user(user_id, moniker='Jane Q Doe')
+    assert await db.get_user_by_moniker_slug('jane-doe') is None
+    assert (await db.get_user_by_moniker_slug('Jane-Q-Doe'))['id'] == user_id
+
+
+@pytest.mark.asyncio
+async def test_moniker_slug_collision():
+    await _make_user('Jane Doe', email='jane@example.com')
+    assert not await db.check_moniker_available('jane-doe')
+    with pytest.raises(db.IntegrityError):
+        await _make_user('jane-doe', email='other@example.com')
+
+
+@sqlite_only
+@pytest.mark.asyncio
+async def test_moniker_slug_index_used():
+    async with db._pool.reader() as conn:
+        plan = await conn.execute_fetchall(
+            "EXPLAIN QUERY PLAN SELECT * FROM users WHERE moniker_slug = ?", ('x',)
+        )
+    assert 'idx_users_moniker_slug' in ' '.join(row[3] for row in plan)
+
+
+@pytest.mark.asyncio
+async def test_profile_bundle():
+    user_id = await _make_user()
+    assert (await db.get_profile_bundle('missing')) is None
+
+    bundle = await db.get_profile_bundle(user_id)
+    assert bundle['user']['moniker'] == 'tester'
+    assert bundle['colors'] == await db.get_profile_colors(user_id)
+    assert bundle['settings'] == await db.get_profile_settings(user_id)
+    assert bundle['links'] == [] and bundle['denom_wallets'] == []
+
+    await db.create_link(user_id=user_id, label='b', url='https://b', sort_order=1)
+    await db.create_link(user_id=user_id, label='a', url='https://a', sort_order=0)
+    await db.upsert_profile_colors(user_id, bg_color='#000000')
+    await db.upsert_profile_settings(user_id, 1, 'https://x', dark_mode=1)
+    await db.create_denom_wallet(user_id=user_id, denomination=5,
+                                 stellar_address='GX', token='t')
+
+    bundle = await db.get_profile_bundle(user_id)
+    assert [l['label'] for l in bundle['links']] == ['a', 'b']
+    assert bundle['colors']['bg_color'] == '#000000'
+    assert bundle['colors'] == await db.get_profile_colors(user_id)
+    assert bundle['settings']['dark_mode'] == 1
+    assert bundle['settings'] == await db.get_profile_settings(user_id)
+    assert bundle['denom_wallets'][0]['denomination'] == 5
+    assert 'colors.bg_color' not in bundle['user'].keys()
+
+
+@pytest.mark.asyncio
+async def test_user_cache_hits_and_invalidation():
+    user_id = await _make_user()
+    before = db.cache_stats()['users']
+    await db.get_user_by_id(user_id)
+    await db.get_user_by_id(user_id)
+    after = db.cache_stats()['users']
+    assert after['misses'] == before['misses'] + 1
+    assert after['hits'] == before['hits'] + 1
+
+    await db.update_user(user_id, avatar_cid='bafy-new')
+    assert (await db.get_user_by_id(user_id))['avatar_cid'] == 'bafy-new'
+
+    await db.update_user(user_id, ipns_name='k51-test')
+    assert (await db.get_user_by_ipns_name('k51-test'))['id'] == user_id
+    await db.update_user(user_id, ipns_name='k51-other')
+    assert await db.get_user_by_ipns_name('k51-test') is None
+
+
+@pytest.mark.asyncio
+async def test_colors_and_settings_cache_invalidation():
+    user_id = await _make_user()
+    colors = await db.get_profile_colors(user_id)
+    colors['bg_color'] = '#mutated'
+    assert (await db.get_profile_colors(user_id))['bg_color'] != '#mutated'
+
+    await db.upsert_profile_colors(user_id, bg_color='#111111')
+    assert (await db.get_profile_colors(user_id))['bg_color'] == '#111111'
+
+    await db.get_profile_settings(user_id)
+    await db.upsert_profile_settings(user_id, 0, '', dark_mode=1)
+    assert (await db.get_profile_settings(user_id))['dark_mode'] == 1
+
+
+def test_ttl_cache_expiry_and_eviction(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(db.time, 'monotonic', lambda: now[0])
+    cache = db.TTLCache('t', maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # evicts 'b', the least recently used
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+    now[0] += 11
+    assert cache.get('a') is None
+
+    generation = cache.generation
+    cache.invalidate('c')
+    cache.set('c', 'stale', generation)
+    assert cache.get('c') is None
+
+
+@pytest.mark.asyncio
+async def test_transaction_commits_once():
+    user_id = await _make_user()
+    async with db.transaction():
+        card = await db.create_user_card(user_id, returning=True)
+        assert card['status'] == 'draft'
+        assert (await db.get_draft_card(user_id))['id'] == card['id']
+        order = await db.create_card_order(
+            user_id=user_id, card_id=card['id'], payment_method='stellar',
+            amount_usd=10, shipping_name='n', shipping_street='s',
+            shipping_city='c', shipping_state='st', shipping_zip='z',
+            shipping_country='us', returning=True,
+        )
+        await db.finalize_card_order(order['id'], tx_hash='abc')
+    active = await db.get_active_card(user_id)
+    assert active['id'] == card['id'] and active['status'] == 'ordered'
+
+
+@pytest.mark.asyncio
+async def test_transaction_rolls_back_and_invalidates():
+    user_id = await _make_user()
+    await db.get_user_by_id(user_id)  # warm the cache
+    with pytest.raises(RuntimeError):
+        async with db.transaction():
+            await db.update_user(user_id, avatar_cid='bafy-tx')
+            assert (await db.get_user_by_id(user_id))['avatar_cid'] == 'bafy-tx'
+            await db.create_link(user_id=user_id, label='x', url='https://x')
+            raise RuntimeError('boom')
+    assert (await db.get_user_by_id(user_id))['avatar_cid'] is None
+    assert await db.get_links(user_id) == []
+
+
+@pytest.mark.asyncio
+async def test_update_link_returning():
+    user_id = await _make_user()
+    link_id = await db.create_link(user_id=user_id, label='a', url='https://a')
+    row = await db.update_link(link_id, returning=True, qr_cid='bafy-qr')
+    assert row['id'] == link_id and row['qr_cid'] == 'bafy-qr'
+
+
+@pytest.mark.asyncio
+async def test_bulk_link_operations():
+    user_id = await _make_user()
+    first = await db.create_link(user_id=user_id, label='first', url='https://0')
+    ids = await db.create_links(user_id, [
+        {'label': 'a', 'url': 'https://a'},
+        {'label': 'b', 'url': 'https://b'},
+        {'label': 'c', 'url': 'https://c'},
+    ])
+    assert [l['label'] for l in await db.get_links(user_id)] == ['first', 'a', 'b', 'c']
+
+    await db.reorder_links(user_id, [ids[2], ids[0], first])
+    assert [l['label'] for l in await db.get_links(user_id)] == ['c', 'a', 'first', 'b']
+
+    await db.set_link_qr_cids({ids[0]: 'bafy-a', ids[1]: 'bafy-b'})
+    cids = {l['id']: l['qr_cid'] for l in await db.get_links(user_id)}
+    assert cids[ids[0]] == 'bafy-a' and cids[ids[1]] == 'bafy-b' and cids[first] is None
+
+
+@pytest.mark.asyncio
+async def test_reorder_links_ignores_other_users():
+    owner = await _make_user()
+    other = await _make_user('other')
+    theirs = await db.create_link(user_id=other, label='x', url='https://x', sort_order=5)
+    await db.reorder_links(owner, [theirs])
+    assert (await db.get_link_by_id(theirs))['sort_order'] == 5
+
+
+@sqlite_only
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_group_commit(monkeypatch):
+    user_id = await _make_user()
+    writer = db._pool._writer
+    commits = []
+    real_commit = writer.commit
+
+    async def counting_commit():
+        commits.append(1)
+        await real_commit()
+
+    monkeypatch.setattr(writer, 'commit', counting_commit)
+    await asyncio.gather(*(
+        db.create_link(user_id=user_id, label=f'l{i}', url=f'https://{i}')
+        for i in range(30)
+    ))
+    assert len(await db.get_links(user_id)) == 30
+    assert len(commits) < 30
+
+
+@pytest.mark.asyncio
+async def test_failed_write_does_not_abort_its_group():
+    user_id = await _make_user()
+
+    async def failing():
+        async with db._pool.writer() as conn:
+            await conn.execute(
+                "UPDATE users SET avatar_cid = 'bafy-bad' WHERE id = ?", (user_id,)
+            )
+            raise RuntimeError('boom')
+
+    results = await asyncio.gather(
+        db.create_link(user_id=user_id, label='a', url='https://a'),
+        failing(),
+        db.create_link(user_id=user_id, label='b', url='https://b'),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], RuntimeError)
+    assert len(await db.get_links(user_id)) == 2
+    assert (await db.get_user_by_id(user_id))['avatar_cid'] is None
+
+
+def test_backend_selected_by_url():
+    assert db._create_pool('sqlite:///tmp/x.db').path == 'tmp/x.db'
+    assert db._create_pool('').dialect == 'sqlite'
+    with pytest.raises(ValueError):
+        db._create_pool('mysql://localhost/x')
+
+
+def test_postgres_placeholder_translation():
+    pytest.importorskip('asyncpg')
+    import db_postgres
+    assert db_postgres._translate(
+        "SELECT * FROM t WHERE a = ? AND b = '?' AND \"c?\" IN (?, ?)"
+    ) == "SELECT * FROM t WHERE a = $1 AND b = '?' AND \"c?\" IN ($2, $3)"
+
+
+@pytest.mark.asyncio
+async def test_peer_cards_keyset_pages():
+    owner = await _make_user()
+    peers = [await _make_user(f'peer{i}') for i in range(7)]
+    for peer_id in peers:
+        await db.add_peer_card(owner, peer_id)
+
+    seen, after = [], None
+    while True:
+        page = await db.get_peer_cards(owner, after=after, limit=3)
+        seen += [row['peer_id'] for row in page]
+        if len(page) < 3:
+            break
+        after = db.decode_cursor(
+            db.encode_cursor((page[-1]['collected_at'], page[-1]['peer_card_id']))
+        )
+    assert sorted(seen) == sorted(peers) and len(seen) == len(set(seen))
+    assert len(await db.get_peer_cards(owner)) == 7
+
+
+@pytest.mark.asyncio
+async def test_payments_and_orders_pages_newest_first():
+    user_id = await _make_user()
+    for i in range(5):
+        await db.create_payment(user_id=user_id, method='card', amount=str(i), memo=f'm{i}')
+    first = await db.get_payments(user_id, limit=2)
+    rest = await db.get_payments(
+        user_id, after=(first[-1]['created_at'], first[-1]['id']), limit=db.MAX_PAGE_SIZE + 1,
+    )
+    assert len(first) == 2 and len(rest) == 3
+    assert {r['id'] for r in first}.isdisjoint(r['id'] for r in rest)
+    assert await db.get_card_orders(user_id) == []
+    assert db.decode_cursor('not-a-cursor') is None
+    for bad in ([], ['2024-01-01'], ['2024-01-01', 'a', 'b'], [1, 'a'], ['2024-01-01', None]):
+        assert db.decode_cursor(db.encode_cursor(bad)) is None
+    assert db.decode_cursor(db.encode_cursor(('2024-01-01', 'a'))) == ('2024-01-01', 'a')
+
+
+@pytest.mark.asyncio
+async def test_row_types():
+    user_id = await _make_user()
+    user = await db.get_user_by_id(user_id)
+    assert isinstance(user, db.User)
+    assert user.moniker == user['moniker'] == user.get('moniker') == 'tester'
+    assert user.get('missing', 'x') == 'x'
+    assert dict(user)['id'] == user_id
+    with pytest.raises(KeyError):
+        user['missing']
+    # Tuple attributes aren't columns
+    row = db.User.from_mapping({'id': '1', 'moniker': 'x'})
+    for name in ('count', 'index', '_fields', '_asdict'):
+        with pytest.raises(KeyError):
+            row[name]
+        assert row.get(name) is None and row.get(name, 'd') == 'd'
+    assert row['moniker'] == row.get('moniker') == 'x'
+
+    await db.create_link(user_id=user_id, label='a', url='https://a')
+    links = await db.get_links(user_id)
+    assert isinstance(links[0], db.Link) and links[0].label == 'a'
+    # One generated class per (record type, column list)
+    assert type(links[0]) is type((await db.get_links(user_id))[0])
+    assert db.Link.for_columns(('id',)) is not db.User.for_columns(('id',))
+    assert await db.get_user_by_id('missing') is None
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    import db_metrics
+    monkeypatch.setattr(db_metrics.registry, 'enabled', True)
+    db_metrics.registry.reset()
+    yield db_metrics
+    db_metrics.registry.reset()
+
+
+@pytest.mark.asyncio
+async def test_metrics_record_calls_rows_and_pages(metrics):
+    user_id = await _make_user()
+    await db.create_link(user_id=user_id, label='a', url='https://a')
+    with metrics.page_scope() as scope:
+        await db.get_links(user_id)
+        await db.get_profile_bundle(user_id)
+    metrics.registry.record_page('/profile/edit', scope)
+
+    snap = metrics.registry.snapshot()
+    links = snap['functions']['get_links']
+    assert links['calls'] == 1 and links['rows'] == 1 and links['queries'] == 1
+    assert sum(links['histogram'].values()) == 1
+    assert snap['functions']['get_profile_bundle']['queries'] == 3
+    page = snap['pages']['/profile/edit']
+    assert page['requests'] == 1 and page['queries'] == 4
+
+
+@pytest.mark.asyncio
+async def test_metrics_slow_query_log_captures_plan(metrics, monkeypatch):
+    monkeypatch.setattr(metrics.registry, 'slow_ms', 0)
+    user_id = await _make_user()
+    await db.get_links(user_id)
+    entry = next(e for e in metrics.registry.slow_queries if e['function'] == 'get_links')
+    assert entry['sql'].startswith('SELECT * FROM link_tree')
+    assert entry['plan']
+
+
+@pytest.mark.asyncio
+async def test_metrics_disabled_is_passthrough():
+    import db_metrics
+    db_metrics.registry.reset()
+    await _make_user()
+    assert db_metrics.registry.snapshot()['functions'] == {}
+
+
+@sqlite_only
+@pytest.mark.asyncio
+async def test_backup_snapshot_verifies_and_prunes(tmp_path):
+    import db_backup
+    await _make_user()
+    paths = [await db_backup.backup(str(tmp_path), keep=2, pages=1) for _ in range(3)]
+    assert db_backup.snapshots(str(tmp_path)) == paths[1:]
+    assert paths[-1].endswith('.db.gz')
+
+    result = await db_backup.verify(paths[-1])
+    assert result['ok'] and result['schema_version'] == len(db.MIGRATIONS)
+
+    plain = await db_backup.backup(str(tmp_path), compress=False, keep=5)
+    assert (await db_backup.verify(plain))['ok']
+    with open(plain, 'r+b') as f:
+        f.seek(100)
+        f.write(b'\xff' * 4096)
+    assert not (await db_backup.verify(plain))['ok']
+
+
+@pytest.mark.asyncio
+async def test_archive_moves_cold_rows_and_views_keep_them():
+    user_id = await _make_user()
+    spent = await db.create_denom_wallet(user_id=user_id, denomination=5, stellar_address='GA', token='t')
+    active = await db.create_denom_wallet(user_id=user_id, denomination=8, stellar_address='GB', token='t')
+    await db.mark_denom_spent(spent, merge_hash='m', payout_hash='p', fee_xlm=0.1)
+    done = await db.create_payment(user_id=user_id, method='card', amount='1', status='completed')
+    await db.create_payment(user_id=user_id, method='card', amount='2')
+    order = await db.create_card_order(
+        user_id=user_id, card_id='qr', payment_method='card', amount_usd=5,
+        shipping_name='n', shipping_street='s', shipping_city='c', shipping_state='st',
+        shipping_zip='z', shipping_country='US', card_type='qr', quantity=3,
+    )
+    await db.finalize_card_order(order)
+    for status in ('processing', 'shipped'):
+        await db.set_card_order_status(order, status)
+    async with db._pool.writer() as conn:
+        await conn.execute("UPDATE card_orders SET created_at = '2000-01-01 00:00:00'")
+    # Shipped but not yet delivered: stays in the hot table
+    assert (await db.archive_cold_rows(older_than_days=30))['card_orders'] == 0
+    await db.set_card_order_status(order, 'delivered')
+    with pytest.raises(ValueError):
+        await db.set_card_order_status(order, 'fulfilled')
+    async with db._pool.writer() as conn:
+        for table in ('denom_wallets', 'payments', 'card_orders'):
+            await conn.execute(f"UPDATE {table} SET created_at = '2000-01-01 00:00:00'")
+        await conn.execute("UPDATE denom_wallets SET spent_at = '2000-01-01 00:00:00'")
+
+    moved = await db.archive_cold_rows(older_than_days=30, batch=1)
+    assert moved == {'denom_wallets': 1, 'payments': 1, 'card_orders': 1}
+    assert await db.archive_cold_rows(older_than_days=30) == {
+        'denom_wallets': 0, 'payments': 0, 'card_orders': 0,
+    }
+
+    assert [w.id for w in await db.get_all_active_denom_wallets()] == [active]
+    assert await db.get_denom_wallets(user_id, 'spent') == []
+    [archived] = await db.get_denom_wallets(user_id, 'spent', include_archived=True)
+    assert archived.id == spent and archived.archived_at is not None
+    assert (await db.get_denom_wallet_by_id(spent)).merge_hash == 'm'
+    assert len(await db.get_payments(user_id)) == 1
+    assert done in {p.id for p in await db.get_payments(user_id, include_archived=True)}
+    assert await db.get_card_orders(user_id) == []
+    assert await db.count_ordered_qr_cards(user_id) == 3
+
+
+@pytest.mark.asyncio
+async def test_pin_refcounts_and_backfill():
+    user_id = await _make_user()
+    link_ids = await db.create_links(user_id, [
+        {'label': 'a', 'url': 'https://a'},
+        {'label': 'b', 'url': 'https://b'},
+    ])
+    await db.set_link_qr_cids({link_ids[0]: 'bafy-same', link_ids[1]: 'bafy-same'})
+    await db.update_user(user_id, avatar_cid='bafy-avatar')
+
+    # Rows written before the pins table existed are picked up on upgrade
+    async with db._pool.writer() as conn:
+        await db._backfill_pins(conn)
+    assert await db.get_pin_refcounts(['bafy-same', 'bafy-avatar']) == {'bafy-same': 2, 'bafy-avatar': 1}
+
+    await db.set_pin_refs(user_id, {('link_tree', link_ids[0], 'qr_cid'): None})
+    assert await db.claim_released_pins(2**40) == {}
+    await db.set_pin_refs(user_id, {('link_tree', link_ids[1], 'qr_cid'): 'bafy-new'})
+    assert await db.get_pin_refcounts(['bafy-same', 'bafy-new']) == {'bafy-same': 0, 'bafy-new': 1}
+    assert await db.count_pins() == {'referenced': 2, 'released': 1, 'bytes': 0}
+    assert await db.claim_released_pins(0) == {}  # still within the grace period
+    assert await db.claim_released_pins(2**40) == {'bafy-same': None}
+
+    await db.set_pin_sizes({'bafy-new': 10, 'bafy-avatar': 5})
+    other = await _make_user('other')
+    await db.set_pin_refs(other, {('users', other, 'avatar_cid'): 'bafy-avatar'})
+    assert await db.get_storage_usage() == {user_id: 15, other: 5}
+    assert await db.get_storage_usage(other) == {other: 5}
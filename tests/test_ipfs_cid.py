@@ -0,0 +1,57 @@
+"""Local CID computation against CIDs produced by Kubo's ipfs add."""
+
+import pytest
+
+import ipfs_cid
+
+
+@pytest.mark.parametrize("data, cid_version, expected", [
+    # ipfs add (defaults: CIDv0, dag-pb leaves)
+    (b"", 0, "QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH"),
+    (b"hello world", 0, "Qmf412jQZiuVUtdgnB36FXFX7xg5V6KEbSJ4dpQuhkLyfD"),
+    (b"hello world\n", 0, "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"),
+    # ipfs add --cid-version=1 (raw leaves)
+    (b"", 1, "bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku"),
+    (b"hello world", 1, "bafkreifzjut3te2nhyekklss27nh3k72ysco7y32koao5eei66wof36n5e"),
+])
+def test_known_cids(data, cid_version, expected):
+    assert ipfs_cid.compute_cid(data, cid_version) == expected
+
+
+def test_cidv1_without_raw_leaves_shares_the_v0_multihash():
+    v1 = ipfs_cid.compute_cid(b"hello world", 1, raw_leaves=False)
+    assert v1.startswith("bafybei")
+    with pytest.raises(ValueError):
+        ipfs_cid.compute_cid(b"x", 0, raw_leaves=True)
+
+
+def test_add_params():
+    assert ipfs_cid.add_params() == {
+        "cid-version": "0", "raw-leaves": "false", "chunker": "size-262144",
+    }
+    assert ipfs_cid.add_params(1)["raw-leaves"] == "true"
+
+
+@pytest.mark.parametrize("chunks", [2, 4, 5, 9, 10])
+def test_balanced_layout(monkeypatch, chunks):
+    """Each new root adopts the full previous root, then fills up with
+    same-depth subtrees (go-unixfs balanced builder)."""
+    monkeypatch.setattr(ipfs_cid, "CHUNK_SIZE", 1)
+    monkeypatch.setattr(ipfs_cid, "MAX_LINKS", 3)
+    data = bytes(range(chunks))
+    b = ipfs_cid._Builder(0, False)
+    leaves = [b.leaf(data[i:i + 1]) for i in range(chunks)]
+
+    # Hand-built trees for fan-out 3
+    depth1 = b.branch(leaves[:3])
+    expected = {
+        2: b.branch(leaves[:2]),
+        4: b.branch([depth1, b.branch(leaves[3:4])]),
+        5: b.branch([depth1, b.branch(leaves[3:5])]),
+        9: b.branch([depth1, b.branch(leaves[3:6]), b.branch(leaves[6:9])]),
+        10: b.branch([
+            b.branch([depth1, b.branch(leaves[3:6]), b.branch(leaves[6:9])]),
+            b.branch([b.branch(leaves[9:10])]),
+        ]),
+    }[chunks]
+    assert ipfs_cid.compute_cid(data) == ipfs_cid._base58(expected[0])
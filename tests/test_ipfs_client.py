@@ -1,17 +1,145 @@
 """Integration tests for ipfs_client against local Kubo node."""
 
+import asyncio
+import base64
 import json
+import os
+import time
 import uuid
 import pytest
 import httpx
 
+import ipfs_cid
+
 # Skip entire module if Kubo isn't reachable
 pytestmark = pytest.mark.asyncio
 
 
+class FakeKubo:
+    """In-memory stand-in for the Kubo HTTP API (see ``mock_kubo``)."""
+
+    def __init__(self):
+        self.blocks = {}
+        self.pins = set()
+        self.keys = set()
+        self.records = {}
+        self.indirect = {}  # cid -> parent pinned recursively on this node
+        self.calls = []
+        self.down = False
+
+    @staticmethod
+    def _files(request):
+        boundary = request.headers["content-type"].split("boundary=")[1].encode()
+        for part in request.content.split(b"--" + boundary)[1:-1]:
+            head, body = part.split(b"\r\n\r\n", 1)
+            name = head.split(b'filename="', 1)[1].split(b'"', 1)[0].decode()
+            yield name, body.rsplit(b"\r\n", 1)[0]
+
+    def handler(self, request):
+        op = request.url.path.split("/api/v0/", 1)[1]
+        arg = request.url.params.get("arg")
+        args = request.url.params.get_list("arg")
+        if self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        self.calls.append(op)
+        if op == "add":
+            lines = []
+            for name, data in self._files(request):
+                cid = ipfs_cid.compute_cid(
+                    data, int(request.url.params["cid-version"]),
+                    request.url.params["raw-leaves"] == "true",
+                )
+                self.blocks[cid] = data
+                self.pins.add(cid)
+                lines.append(json.dumps({"Name": name, "Hash": cid, "Size": str(len(data))}))
+            return httpx.Response(200, content="\n".join(lines).encode())
+        if op == "cat":
+            if arg not in self.blocks:
+                return httpx.Response(500, json={"Message": "not found"})
+            return httpx.Response(200, content=self.blocks[arg])
+        if op == "pin/add":
+            self.pins.update(args)
+            return httpx.Response(200, json={"Pins": args})
+        if op == "pin/rm":
+            for cid in set(args) & set(self.indirect):
+                return httpx.Response(500, json={
+                    "Message": f"{cid} is pinned indirectly under {self.indirect[cid]}",
+                })
+            if not self.pins.issuperset(args):
+                return httpx.Response(500, json={"Message": "not pinned or pinned indirectly"})
+            self.pins.difference_update(args)
+            return httpx.Response(200, json={"Pins": args})
+        if op == "pin/ls":
+            lines = [json.dumps({"Cid": cid, "Type": "recursive"}) for cid in sorted(self.pins)]
+            return httpx.Response(200, content="\n".join(lines).encode())
+        if op == "repo/gc":
+            for cid in set(self.blocks) - self.pins:
+                del self.blocks[cid]
+            return httpx.Response(200, content=b"")
+        if op == "files/stat":
+            cid = arg.split("/ipfs/")[-1]
+            return httpx.Response(200, json={"CumulativeSize": len(self.blocks.get(cid, b""))})
+        if op == "repo/stat":
+            return httpx.Response(200, json={"RepoSize": sum(map(len, self.blocks.values()))})
+        if op == "name/publish":
+            name = "k51-" + request.url.params["key"]
+            self.records[name] = f"record:{arg}".encode()
+            return httpx.Response(200, json={"Name": name})
+        if op == "routing/get":
+            record = self.records[arg.split("/ipns/")[-1]]
+            return httpx.Response(200, json={"Extra": base64.b64encode(record).decode()})
+        if op == "routing/put":
+            self.records[arg.split("/ipns/")[-1]] = next(self._files(request))[1]
+            return httpx.Response(200, json={})
+        if op in ("key/gen", "key/import"):
+            self.keys.add(arg)
+            return httpx.Response(200, json={"Name": arg, "Id": "k51-" + arg})
+        if op == "key/rm":
+            self.keys.discard(arg)
+            return httpx.Response(200, json={"Keys": [{"Name": arg}]})
+        if op == "version":
+            return httpx.Response(200, json={"Version": "fake"})
+        return httpx.Response(404, json={"Message": f"unsupported: {op}"})
+
+
+@pytest.fixture
+async def mock_kubo(monkeypatch):
+    """Route ipfs_client through an in-memory FakeKubo instead of a node."""
+    import ipfs_client
+
+    kubo = FakeKubo()
+    monkeypatch.setattr(
+        ipfs_client, "_client_args",
+        lambda api=None: ("http://kubo/api/v0", httpx.MockTransport(kubo.handler)),
+    )
+    monkeypatch.setattr(ipfs_client, "nodes", [ipfs_client.KuboNode(ipfs_client.KUBO_API)])
+    monkeypatch.setattr(ipfs_client, "cat_cache", ipfs_client.CatCache(directory=None))
+    await ipfs_client.close_client()
+    yield kubo
+    await ipfs_client.close_client()
+
+
+@pytest.fixture
+async def kubo_cluster(monkeypatch):
+    """Three FakeKubo gateways; the first is the primary."""
+    import ipfs_client
+
+    cluster = {f"http://kubo{i}/api/v0": FakeKubo() for i in range(3)}
+    monkeypatch.setattr(
+        ipfs_client, "_client_args",
+        lambda api: (api, httpx.MockTransport(cluster[api].handler)),
+    )
+    monkeypatch.setattr(ipfs_client, "nodes", [ipfs_client.KuboNode(api) for api in cluster])
+    monkeypatch.setattr(ipfs_client, "cat_cache", ipfs_client.CatCache(directory=None))
+    yield list(cluster.values())
+    await ipfs_client.close_client()
+
+
 @pytest.fixture(autouse=True)
-async def require_kubo():
+async def require_kubo(request):
     """Skip all tests if Kubo isn't running on localhost:5001."""
+    if {"mock_kubo", "kubo_cluster"} & set(request.fixturenames) or request.node.get_closest_marker("offline"):
+        return
     try:
         async with httpx.AsyncClient() as c:
             r = await c.post("http://127.0.0.1:5001/api/v0/id")
@@ -72,6 +200,22 @@ async def test_pin_unpin():
     await ipfs_client.ipfs_unpin(cid)
 
 
+@pytest.mark.parametrize("chunks", [1, ipfs_cid.MAX_LINKS + 1])
+@pytest.mark.parametrize("cid_version", [0, 1])
+async def test_local_cid_matches_kubo_for_multi_chunk_files(chunks, cid_version):
+    """Past one chunk (256 KiB) and past one level of links (174 chunks),
+    the locally computed CID is the one Kubo's add returns."""
+    import random
+
+    data = random.Random(chunks).randbytes(chunks * ipfs_cid.CHUNK_SIZE + 1)
+    params = {**ipfs_cid.add_params(cid_version), "only-hash": "true"}
+    async with httpx.AsyncClient(timeout=120) as c:
+        r = await c.post("http://127.0.0.1:5001/api/v0/add", params=params,
+                         files={"file": ("big.bin", data)})
+        r.raise_for_status()
+    assert ipfs_cid.compute_cid(data, cid_version) == r.json()["Hash"]
+
+
 async def test_key_gen_and_export(temp_key_name):
     """Generate IPNS key, export, verify bytes returned."""
     import ipfs_client
@@ -203,3 +347,693 @@ async def test_build_linktree_json_legacy_colors():
     assert doc["colors"]["light"]["secondary"] == "#444444"
     # Dark mode should use defaults
     assert doc["colors"]["dark"]["bg"] == "#1a1a1a"
+
+
+async def test_shared_client_is_reused(mock_kubo):
+    """All calls go through one pooled client on the same loop."""
+    import ipfs_client
+
+    cid = await ipfs_client.ipfs_add(b"pooled", "p.txt")
+    primary = ipfs_client.nodes[0]
+    client = primary._client
+    assert await ipfs_client.ipfs_cat(cid) == b"pooled"
+    await ipfs_client.ipfs_unpin(cid)
+    assert primary._client is client
+    assert mock_kubo.calls == ["add", "cat", "pin/rm"]
+
+    await ipfs_client.close_client()
+    assert primary._client is None
+
+
+@pytest.mark.offline
+async def test_unix_socket_api():
+    """unix:// KUBO_API values use a UDS transport with the /api/v0 prefix."""
+    import ipfs_client
+
+    base_url, transport = ipfs_client._client_args("unix:///run/kubo/api.sock")
+    assert base_url == "http://kubo/api/v0"
+    assert transport._pool._uds == "/run/kubo/api.sock"
+    base_url, _ = ipfs_client._client_args("http://127.0.0.1:5001/api/v0")
+    assert base_url == "http://127.0.0.1:5001/api/v0"
+
+
+async def _user_with_key(moniker="pub"):
+    import db
+
+    user_id = await db.create_user(
+        email=f"{moniker}@example.com", moniker=moniker,
+        member_type="free", password_hash="x",
+    )
+    await db.update_user(user_id, ipns_key_name=f"{moniker}-key")
+    return user_id
+
+
+async def test_republish_coalesces_edits(mock_kubo, monkeypatch):
+    """A burst of edits yields one publish; edits during it yield one more."""
+    import db
+    import ipfs_client
+
+    monkeypatch.setattr(ipfs_client.republisher, "delay", 0.2)
+    user_id = await _user_with_key()
+    for _ in range(5):
+        ipfs_client.schedule_republish(user_id)
+    await asyncio.sleep(0.05)  # persisted while still inside the quiet window
+    assert await db.get_pending_republishes() == [user_id]
+    await ipfs_client.republisher.join()
+
+    assert mock_kubo.calls.count("name/publish") == 1
+    assert await db.get_pending_republishes() == []
+    assert (await db.get_user_by_id(user_id))["linktree_cid"] in mock_kubo.pins
+    stats = ipfs_client.stats()["republish"]
+    assert stats["published"] == 1 and stats["queued"] == 0
+
+    real_publish = ipfs_client.republish_linktree
+    rounds = []
+
+    async def slow_publish(uid, *args):
+        rounds.append(uid)
+        await asyncio.sleep(0.1)
+        return await real_publish(uid, *args)
+
+    monkeypatch.setattr(ipfs_client, "republish_linktree", slow_publish)
+    monkeypatch.setattr(ipfs_client.republisher, "delay", 0.02)
+    ipfs_client.schedule_republish(user_id)
+    await asyncio.sleep(0.05)  # first round is now publishing
+    ipfs_client.schedule_republish(user_id)
+    ipfs_client.schedule_republish(user_id)
+    await ipfs_client.republisher.join()
+    assert rounds == [user_id, user_id]
+
+
+async def test_republish_queue_survives_restart(mock_kubo, monkeypatch):
+    """Users left in republish_queue are published on start()."""
+    import db
+    import ipfs_client
+
+    monkeypatch.setattr(ipfs_client.republisher, "delay", 0)
+    user_id = await _user_with_key()
+    await db.mark_republish_pending(user_id)
+    # Another app node is already publishing this one
+    claimed = await _user_with_key("claimed")
+    await db.mark_republish_pending(claimed, "other-node", 60)
+
+    await ipfs_client.republisher.start()
+    await ipfs_client.republisher.join()
+    assert mock_kubo.calls.count("name/publish") == 1
+    assert await db.get_pending_republishes() == [claimed]
+    # A second node restarting meanwhile finds nothing left to claim
+    assert await db.claim_republishes("third-node", 60) == []
+
+    # The other node died: its claim runs out and the row is resumed
+    await db.mark_republish_pending(claimed, "other-node", -1)
+    await ipfs_client.republisher.start()
+    await ipfs_client.republisher.join()
+    assert mock_kubo.calls.count("name/publish") == 2
+    assert await db.get_pending_republishes() == []
+
+
+async def test_gc_batches_unpins_and_reports_reclaimed(mock_kubo, monkeypatch):
+    """Unpins only accumulate; one scheduled gc reclaims them all."""
+    import db
+    import ipfs_client
+
+    gc = ipfs_client.GcScheduler(interval=3600, threshold_bytes=10**9)
+    monkeypatch.setattr(ipfs_client, "gc_scheduler", gc)
+    cids = [await ipfs_client.ipfs_add(b"x" * 100 * (i + 1), f"{i}.bin") for i in range(3)]
+    await ipfs_client.track_pins(None, {("assets", cid, "cid"): cid for cid in cids})
+    await db.set_pin_sizes({cid: 100 * (i + 1) for i, cid in enumerate(cids)})
+    for cid in cids:
+        await ipfs_client.replace_asset(b"new" + cid.encode(), cid)
+    assert "repo/gc" not in mock_kubo.calls
+    assert gc.pending_unpins == 3 and gc.pending_bytes == 600
+
+    assert await db.acquire_lease(gc.LEASE, "other-node", 60)
+    assert not await gc.run()
+    await db.release_lease(gc.LEASE, "other-node")
+
+    assert await gc.run()
+    assert mock_kubo.calls.count("repo/gc") == 1
+    stats = gc.stats()
+    assert stats["last_reclaimed_bytes"] == 600 and stats["pending_bytes"] == 0
+    assert stats["skipped_lease_held"] == 1
+    # The lease is kept for the interval: no other node collects straight away
+    assert not await db.acquire_lease(gc.LEASE, "other-node", 60)
+
+
+async def test_gc_threshold_triggers_early_run(mock_kubo, monkeypatch):
+    import ipfs_client
+
+    gc = ipfs_client.GcScheduler(interval=3600, threshold_bytes=50)
+    monkeypatch.setattr(ipfs_client, "gc_scheduler", gc)
+    gc.start()
+    try:
+        cid = await ipfs_client.ipfs_add(b"y" * 64, "y.bin")
+        owner = ("assets", cid, "cid")
+        await ipfs_client.track_pins(None, {owner: cid})
+        sweeper = ipfs_client.PinReconciler(grace=0, audit_interval=0)
+        await sweeper.run()  # sizes the pin
+        await ipfs_client.track_pins(None, {owner: None})
+        await sweeper.run()  # the swept bytes pass the threshold
+        for _ in range(50):
+            if gc.runs:
+                break
+            await asyncio.sleep(0.01)
+        assert gc.runs == 1 and gc.last_reclaimed_bytes == 64
+    finally:
+        await gc.stop()
+
+
+async def test_unchanged_content_skips_kubo(mock_kubo, monkeypatch):
+    """Identical bytes/JSON are recognised by CID and never re-uploaded."""
+    import db
+    import ipfs_client
+
+    cid = await ipfs_client.ipfs_add(b"same bytes", "a.png")
+    assert cid == ipfs_client.compute_cid(b"same bytes")
+    assert await ipfs_client.replace_asset(b"same bytes", cid, "a.png") == cid
+    assert mock_kubo.calls == ["add"]
+
+    monkeypatch.setattr(ipfs_client.republisher, "delay", 0)
+    user_id = await _user_with_key()
+    assert await ipfs_client.republish_linktree(user_id)
+    assert await ipfs_client.republish_linktree(user_id)
+    assert mock_kubo.calls.count("name/publish") == 1
+    assert mock_kubo.calls.count("add") == 2
+
+
+@pytest.mark.parametrize("size", [0, 1, 262144, 262145, 3 * 262144 + 7])
+async def test_local_cid_matches_kubo(size):
+    """compute_cid agrees with a real Kubo node across chunk boundaries."""
+    import ipfs_client
+
+    data = bytes(i % 251 for i in range(size))
+    cid = await ipfs_client.ipfs_add(data, "cid.bin")
+    assert ipfs_client.compute_cid(data) == cid
+    await ipfs_client.ipfs_unpin(cid)
+
+
+async def test_cat_cache_memory_hits_and_single_flight(mock_kubo):
+    import ipfs_client
+
+    cid = await ipfs_client.ipfs_add(b"avatar bytes", "a.png")
+    results = await asyncio.gather(*(ipfs_client.ipfs_cat(cid) for _ in range(5)))
+    assert results == [b"avatar bytes"] * 5
+    assert await ipfs_client.ipfs_cat(cid) == b"avatar bytes"
+    assert mock_kubo.calls.count("cat") == 1
+    stats = ipfs_client.stats()["cat_cache"]
+    assert stats["misses"] == 1 and stats["shared_fetches"] == 4 and stats["hits"] == 1
+
+
+async def test_cat_cache_is_bounded_by_bytes(mock_kubo, monkeypatch):
+    import ipfs_client
+
+    cache = ipfs_client.CatCache(max_bytes=250, directory=None)
+    monkeypatch.setattr(ipfs_client, "cat_cache", cache)
+    cids = [await ipfs_client.ipfs_add(bytes([i]) * 100, f"{i}.bin") for i in range(3)]
+    for cid in cids:
+        await ipfs_client.ipfs_cat(cid)
+    assert cache.stats()["entries"] == 2 and cache.bytes == 200
+    await ipfs_client.ipfs_cat(cids[0])  # evicted (least recently used)
+    assert mock_kubo.calls.count("cat") == 4
+
+
+async def test_cat_cache_disk_tier(mock_kubo, monkeypatch, tmp_path):
+    import ipfs_client
+
+    cache = ipfs_client.CatCache(directory=str(tmp_path))
+    monkeypatch.setattr(ipfs_client, "cat_cache", cache)
+    cid = await ipfs_client.ipfs_add(b"on disk", "d.bin")
+    path = await ipfs_client.ipfs_cat_path(cid)
+    assert cache.owns(path) and open(path, "rb").read() == b"on disk"
+
+    cache.clear()  # e.g. after a restart
+    assert await ipfs_client.ipfs_cat(cid) == b"on disk"
+    assert mock_kubo.calls.count("cat") == 1 and cache.stats()["disk_hits"] == 1
+    # Relative spellings of the directory name the same cache
+    relative = os.path.relpath(path)
+    assert ipfs_client.CatCache(directory=os.path.relpath(str(tmp_path))).owns(relative)
+    assert cache.owns(relative) and not cache.owns(str(tmp_path / "sub" / cid))
+
+
+async def test_cat_cache_counts_each_file_once(mock_kubo, monkeypatch, tmp_path):
+    """disk_bytes is the real size on disk, however often a CID is stored."""
+    import ipfs_client
+
+    cache = ipfs_client.CatCache(directory=str(tmp_path))
+    monkeypatch.setattr(ipfs_client, "cat_cache", cache)
+    cid = await ipfs_client.ipfs_add(b"z" * 1000, "z.bin")
+    await ipfs_client.ipfs_cat_path(cid)
+    on_disk = sum(p.stat().st_size for p in tmp_path.iterdir())
+    assert on_disk == 1000 and cache.stats()["disk_bytes"] == on_disk
+    for _ in range(3):
+        await cache.store(cid, b"z" * 1000)
+    await ipfs_client.ipfs_cat_path(cid)
+    assert cache.stats()["disk_bytes"] == 1000
+
+
+async def test_cat_cache_disk_tier_is_bounded(mock_kubo, monkeypatch, tmp_path):
+    """The least recently used files go once the directory passes its bound."""
+    import ipfs_client
+
+    cache = ipfs_client.CatCache(directory=str(tmp_path), disk_max_bytes=250)
+    monkeypatch.setattr(ipfs_client, "cat_cache", cache)
+    old, kept = await ipfs_client.ipfs_add_many([("a.bin", b"a" * 100), ("b.bin", b"b" * 100)])
+    for cid, age in ((old, 20), (kept, 10)):
+        await ipfs_client.ipfs_cat_path(cid)
+        os.utime(cache.path(cid), (time.time() - age,) * 2)
+    cache.clear()
+    await ipfs_client.ipfs_cat(old)  # a disk hit makes it recently used
+    new = await ipfs_client.ipfs_add(b"c" * 100, "c.bin")
+    await ipfs_client.ipfs_cat(new)
+    assert sorted(os.listdir(tmp_path)) == sorted([old, new])
+    stats = cache.stats()
+    assert stats["disk_bytes"] == 200 and stats["disk_evictions"] == 1
+
+
+async def test_batch_add_pin_unpin(mock_kubo):
+    import ipfs_client
+
+    files = [("a.png", b"one"), ("a.png", b"two"), ("b.png", b"one")]
+    cids = await ipfs_client.ipfs_add_many(files)
+    assert cids == [ipfs_client.compute_cid(data) for _, data in files]
+    assert cids[0] == cids[2]
+
+    await ipfs_client.ipfs_unpin_many(cids)
+    assert mock_kubo.pins == set()
+    await ipfs_client.ipfs_pin_many(cids[:2])
+    assert mock_kubo.pins == set(cids[:2])
+    # One CID already unpinned: falls back to per-CID unpins
+    await ipfs_client.ipfs_unpin_many([cids[0], "QmNotPinned"])
+    assert mock_kubo.pins == {cids[1]}
+    assert mock_kubo.calls[:4] == ["add", "pin/rm", "pin/add", "pin/rm"]
+
+
+async def test_link_qr_regeneration_is_batched(mock_kubo):
+    """Re-theming N links: one add and one unpin, not 2N requests."""
+    import db
+    import ipfs_client
+    import qr_gen
+
+    user_id = await _user_with_key()
+    for i in range(6):
+        await db.create_link(user_id=user_id, label=f"l{i}", url=f"https://{i}.example", sort_order=i)
+    await qr_gen.regenerate_all_link_qrs(user_id)
+    first = [link.qr_cid for link in await db.get_links(user_id)]
+    assert all(first) and mock_kubo.calls == ["add"]
+
+    await db.upsert_profile_colors(user_id, accent_color="#123456")
+    mock_kubo.calls.clear()
+    await qr_gen.regenerate_all_link_qrs(user_id)
+    second = [link.qr_cid for link in await db.get_links(user_id)]
+    assert mock_kubo.calls == ["add"]
+    assert await ipfs_client.PinReconciler(grace=0).sweep() == len(set(first))
+    assert mock_kubo.calls == ["add", "pin/rm"]
+    assert not set(first) & set(second) and mock_kubo.pins >= set(second)
+    assert not mock_kubo.pins & set(first)
+
+    mock_kubo.calls.clear()
+    await qr_gen.regenerate_all_link_qrs(user_id)  # nothing changed
+    assert mock_kubo.calls == []
+
+
+async def test_shared_cids_are_unpinned_at_refcount_zero(mock_kubo):
+    """Rows sharing a CID keep it pinned until the last one lets go."""
+    import db
+    import ipfs_client
+
+    user_id = await _user_with_key("sharer")
+    cid = await ipfs_client.ipfs_add(b"same qr bytes", "link_qr.png")
+    await ipfs_client.track_pins(user_id, {
+        ("link_tree", "a", "qr_cid"): cid,
+        ("link_tree", "b", "qr_cid"): cid,
+    })
+    sweeper = ipfs_client.PinReconciler(grace=0)
+    await ipfs_client.track_pins(user_id, {("link_tree", "a", "qr_cid"): None})
+    assert await sweeper.sweep() == 0 and cid in mock_kubo.pins
+
+    await ipfs_client.PinReconciler(audit_interval=0).run()  # sizes the pin
+    await ipfs_client.track_pins(user_id, {("link_tree", "b", "qr_cid"): None})
+    assert await ipfs_client.PinReconciler(grace=3600).sweep() == 0
+    mock_kubo.down = True
+    with pytest.raises(httpx.HTTPError):
+        await sweeper.sweep()
+    assert (await db.count_pins())["released"] == 1  # put back for the next sweep
+    mock_kubo.down = False
+    pending = ipfs_client.gc_scheduler.pending_bytes
+    assert await sweeper.sweep() == 1
+    assert cid not in mock_kubo.pins and mock_kubo.calls.count("pin/rm") == 1
+    assert sweeper.stats()["unpinned"] == 1
+    assert ipfs_client.gc_scheduler.pending_bytes - pending == len(b"same qr bytes")
+
+
+async def test_replace_asset_moves_the_pin_with_the_row_write(mock_kubo):
+    """A failed column write leaves the pin reference where it was."""
+    import db
+    import ipfs_client
+
+    user_id = await _user_with_key("avatar")
+    owner = ("users", user_id, "avatar_cid")
+
+    async def fail(cid):
+        await db.update_user(user_id, avatar_cid=cid)
+        raise RuntimeError("write failed")
+
+    with pytest.raises(RuntimeError):
+        await ipfs_client.replace_asset(b"lost", None, "a.png", user_id=user_id, owner=owner, save=fail)
+    assert (await db.get_user_by_id(user_id))["avatar_cid"] is None
+    assert await db.count_pins() == {"referenced": 0, "released": 0, "bytes": 0}
+
+    cid = await ipfs_client.replace_asset(
+        b"kept", None, "a.png", user_id=user_id, owner=owner,
+        save=lambda cid: db.update_user(user_id, avatar_cid=cid),
+    )
+    assert (await db.get_user_by_id(user_id))["avatar_cid"] == cid
+    assert await db.get_pin_refcounts([cid]) == {cid: 1}
+
+
+async def test_pin_audit_finds_leaks_and_missing_pins(mock_kubo):
+    """pin/ls is diffed against the pins table; missing pins come back."""
+    import db
+    import ipfs_client
+
+    user_id = await _user_with_key("audited")
+    kept, lost = await ipfs_client.ipfs_add_many([("a.png", b"kept"), ("b.png", b"lost!")])
+    await ipfs_client.track_pins(user_id, {
+        ("users", user_id, "avatar_cid"): kept,
+        ("users", user_id, "qr_code_cid"): lost,
+    })
+    mock_kubo.pins.discard(lost)
+    mock_kubo.pins.add("QmLeak")
+
+    auditor = ipfs_client.PinReconciler(audit_interval=3600)
+    report = (await auditor.audit())[ipfs_client.nodes[0].api]
+    assert report == {"pinned": 2, "leaks": 1, "missing": 1, "leak_sample": ["QmLeak"]}
+    assert lost in mock_kubo.pins and "QmLeak" in mock_kubo.pins
+    assert await db.get_storage_usage(user_id) == {user_id: len(b"kept") + len(b"lost!")}
+    assert (await auditor.audit())[ipfs_client.nodes[0].api]["missing"] == 0
+
+
+async def test_pin_reconciler_lease_spans_the_run(mock_kubo, monkeypatch):
+    """One audit per interval across nodes; a run stops once its lease is lost."""
+    import db
+    import ipfs_client
+
+    await ipfs_client.PinReconciler(audit_interval=3600).run()
+    monkeypatch.setattr(ipfs_client, "NODE_ID", "other-node")
+    other = ipfs_client.PinReconciler(grace=0, audit_interval=3600, batch=1)
+    await other.run()
+    assert other.audits == 0  # audited on the first node within the interval
+
+    cids = await ipfs_client.ipfs_add_many([("a.bin", b"a"), ("b.bin", b"b")])
+    await ipfs_client.track_pins(None, {("assets", cid, "cid"): cid for cid in cids})
+    await ipfs_client.track_pins(None, {("assets", cid, "cid"): None for cid in cids})
+    sweep = other.sweep
+
+    async def sweep_then_lose_lease():
+        swept = await sweep()
+        await db.release_lease(other.LEASE, "other-node")
+        assert await db.acquire_lease(other.LEASE, "third-node", 60)
+        return swept
+
+    monkeypatch.setattr(other, "sweep", sweep_then_lose_lease)
+    assert await other.run() == 1
+    assert (await db.count_pins())["released"] == 1  # left for the new holder
+
+
+async def test_writes_fan_out_to_every_gateway(kubo_cluster):
+    import ipfs_client
+
+    primary = kubo_cluster[0]
+    cid = await ipfs_client.ipfs_add(b"replicated", "r.txt")
+    assert all(cid in kubo.pins for kubo in kubo_cluster)
+
+    await ipfs_client.ipfs_unpin(cid)
+    assert not any(kubo.pins for kubo in kubo_cluster)
+    assert "files/stat" not in primary.calls  # the size comes from the pins table
+
+
+async def test_lagging_gateway_is_reconciled(kubo_cluster):
+    import db
+    import ipfs_client
+
+    lagging = kubo_cluster[2]
+    node = ipfs_client.nodes[2]
+    kept = await ipfs_client.ipfs_add(b"kept", "k.txt")
+    lagging.down = True
+    cids = await ipfs_client.ipfs_add_many([("a.txt", b"a"), ("b.txt", b"b")])
+    await ipfs_client.ipfs_unpin(kept)
+    assert kubo_cluster[0].pins == set(cids)
+    assert await db.count_replica_backlog() == {node.api: 3}
+
+    # A third failure opens the breaker; later writes skip the node
+    await ipfs_client.ipfs_pin(cids[0])
+    assert not node.healthy and node.trips == 1
+    requests = node.requests
+    await ipfs_client.ipfs_pin(cids[1])
+    assert node.rejected == 1 and node.requests == requests
+
+    assert await ipfs_client.reconciler.run() == 0  # still down
+    lagging.down = False
+    node.opened_at -= node.cooldown  # cooled down
+    assert await ipfs_client.reconciler.run() == 3
+    assert node.healthy and lagging.pins == set(cids)
+    assert await db.count_replica_backlog() == {}
+
+
+async def test_only_not_pinned_counts_as_unpinned(kubo_cluster):
+    """Other pin/rm errors are queued as repairs, not taken as done."""
+    import db
+    import ipfs_client
+
+    cid, other = await ipfs_client.ipfs_add_many([("a.txt", b"a"), ("b.txt", b"b")])
+    stuck = kubo_cluster[1]
+    stuck.pins.discard(other)
+    stuck.indirect[cid] = "QmParent"
+    await ipfs_client.ipfs_unpin_many([cid, other])
+    assert not kubo_cluster[0].pins and not kubo_cluster[2].pins
+    assert await db.count_replica_backlog() == {ipfs_client.nodes[1].api: 2}
+
+    await ipfs_client.ipfs_unpin(other)  # already gone everywhere: nothing queued
+    assert await db.count_replica_backlog() == {ipfs_client.nodes[1].api: 2}
+    for kubo in kubo_cluster[::2]:
+        kubo.indirect[cid] = "QmParent"
+    with pytest.raises(httpx.HTTPStatusError):
+        await ipfs_client.ipfs_unpin(cid)
+
+
+async def test_quorum_policy_needs_a_majority(kubo_cluster, monkeypatch):
+    import db
+    import ipfs_client
+
+    monkeypatch.setattr(ipfs_client, "KUBO_WRITE_POLICY", "quorum")
+    kubo_cluster[1].down = True
+    cid = await ipfs_client.ipfs_add(b"two of three", "q.txt")
+    assert await db.get_replica_backlog(ipfs_client.nodes[1].api) == [(cid, "pin")]
+
+    kubo_cluster[2].down = True
+    with pytest.raises(httpx.ConnectError):
+        await ipfs_client.ipfs_add(b"one of three", "q.txt")
+
+    monkeypatch.setattr(ipfs_client, "KUBO_WRITE_POLICY", "best-effort")
+    assert await ipfs_client.ipfs_add(b"one of three", "q.txt")
+
+
+async def test_reads_fail_over_when_primary_is_down(kubo_cluster):
+    import ipfs_client
+
+    cid = await ipfs_client.ipfs_add(b"readable", "r.txt")
+    kubo_cluster[0].down = True
+    assert await ipfs_client.ipfs_cat(cid) == b"readable"
+    assert kubo_cluster[1].calls.count("cat") == 1
+    stats = ipfs_client.stats()["nodes"]
+    assert stats[0]["errors"] == 1 and stats[0]["healthy"]
+
+
+@pytest.mark.offline
+async def test_calls_get_per_operation_budgets(monkeypatch):
+    """Reads get a short budget, publishes a long one, callers may override."""
+    import ipfs_client
+
+    seen = []
+
+    def handler(request):
+        seen.append(request.extensions["timeout"]["read"])
+        return httpx.Response(200, json={})
+
+    monkeypatch.setattr(
+        ipfs_client, "_client_args",
+        lambda api: (api, httpx.MockTransport(handler)),
+    )
+    node = ipfs_client.KuboNode("http://budget/api/v0")
+    for path in ("cat", "pin/add", "name/publish"):
+        await node.post(path)
+    await node.post("cat", timeout=0.5)
+    await node.close()
+    assert seen == [ipfs_client.KUBO_READ_TIMEOUT, ipfs_client.KUBO_WRITE_TIMEOUT,
+                    ipfs_client.KUBO_LONG_TIMEOUT, 0.5]
+
+
+async def test_visitors_get_sqlite_linktree_when_ipfs_is_degraded(mock_kubo, monkeypatch):
+    """Public views fall back to the SQLite build, within the budget."""
+    import db
+    import ipfs_client
+
+    monkeypatch.setattr(ipfs_client, "visitors", ipfs_client.VisitorStats())
+    user_id = await _user_with_key("visited")
+    await ipfs_client.republish_linktree(user_id)
+    user = await db.get_user_by_id(user_id)
+    linktree, degraded = await ipfs_client.fetch_linktree_for_visitor(user)
+    assert not degraded and linktree["moniker"] == "visited"
+
+    # Breaker open: the fallback doesn't touch Kubo at all
+    monkeypatch.setattr(ipfs_client, "cat_cache", ipfs_client.CatCache(directory=None))
+    mock_kubo.down = True
+    node = ipfs_client.nodes[0]
+    for _ in range(node.max_failures):
+        assert (await ipfs_client.fetch_linktree_for_visitor(user))[1]
+    assert not node.healthy
+    requests = node.requests
+    linktree, degraded = await ipfs_client.fetch_linktree_for_visitor(user)
+    assert degraded and linktree["moniker"] == "visited"
+    assert node.requests == requests
+
+    # A hung fetch is cut off at the budget
+    async def hang(user):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(ipfs_client, "fetch_linktree_json", hang)
+    start = time.monotonic()
+    linktree, degraded = await ipfs_client.fetch_linktree_for_visitor(user, budget=0.05)
+    assert degraded and linktree["moniker"] == "visited"
+    assert time.monotonic() - start < 1
+    assert ipfs_client.visitors.stats() == {"served": 6, "degraded": 5, "timeouts": 1}
+
+
+async def test_failed_republish_is_recorded_and_retried(mock_kubo, monkeypatch):
+    """Failures are logged, stay queued and are retried with backoff."""
+    import db
+    import ipfs_client
+
+    republisher = ipfs_client.RepublishScheduler(delay=0.01, retry_delay=0.2, retries=1)
+    monkeypatch.setattr(ipfs_client, "republisher", republisher)
+    user_id = await _user_with_key("flaky")
+    mock_kubo.down = True
+    ipfs_client.schedule_republish(user_id)
+    await asyncio.sleep(0.1)  # first attempt failed, retry pending
+    assert [e["user_id"] for e in republisher.errors] == [user_id]
+    assert "ConnectError" in republisher.errors[0]["error"]
+    assert await db.get_pending_republishes() == [user_id]
+
+    mock_kubo.down = False
+    await republisher.join()
+    stats = republisher.stats()
+    assert (stats["published"], stats["failed"], stats["retried"]) == (1, 1, 1)
+    assert (await db.get_user_by_id(user_id))["linktree_cid"]
+    assert await db.get_pending_republishes() == []
+
+    # Out of retries: left in the queue for the next start()
+    await db.update_user(user_id, moniker="flaky2")
+    mock_kubo.down = True
+    ipfs_client.schedule_republish(user_id)
+    await republisher.join()
+    assert republisher.stats()["abandoned"] == 1
+    assert await db.get_pending_republishes() == [user_id]
+    assert len(ipfs_client.stats()["republish_errors"]) == 3
+
+
+async def test_ipns_keys_are_sharded_and_rebalanced(kubo_cluster, monkeypatch):
+    """Keys live on their ring node; adding a node moves only keys to it."""
+    import db
+    import ipfs_client
+    import ipns_rebalance
+
+    all_nodes = ipfs_client.nodes
+    monkeypatch.setattr(ipfs_client, "nodes", all_nodes[:2])
+    monkeypatch.setattr(ipfs_client, "IPNS_SIGNING", "kubo")
+    placed = {}
+    for i in range(24):
+        user_id = await _user_with_key(f"member{i}")
+        key_name = f"member{i}-key"
+        node = ipfs_client.place_key(key_name)
+        ipns_name = await ipfs_client.ipns_key_gen(key_name, node)
+        await db.update_user(
+            user_id, ipns_name=ipns_name, ipns_node=node, linktree_cid=f"Qm{i}",
+            ipns_key_backup=ipfs_client.encrypt_key_backup(key_name.encode()),
+        )
+        placed[key_name] = node
+    assert set(placed.values()) == {n.api for n in all_nodes[:2]}
+
+    # Publishing runs on the owner only; the record is copied to the rest
+    await ipfs_client.ipns_publish("member0-key", "QmNew", placed["member0-key"])
+    owner = kubo_cluster[[n.api for n in all_nodes].index(placed["member0-key"])]
+    assert sum(k.calls.count("name/publish") for k in kubo_cluster) == 1
+    assert owner.calls.count("name/publish") == 1
+    assert kubo_cluster[0].records["k51-member0-key"] == kubo_cluster[1].records["k51-member0-key"]
+
+    monkeypatch.setattr(ipfs_client, "nodes", all_nodes)
+    moves = ipns_rebalance.plan(await db.get_ipns_placements())
+    assert moves and all(target == all_nodes[2].api for _, target in moves)
+    assert len(moves) < len(placed)
+
+    assert await ipns_rebalance.rebalance() == {"moved": len(moves), "skipped": 0, "failed": 0}
+    moved = {user["ipns_key_name"] for user, _ in moves}
+    assert kubo_cluster[2].keys == moved
+    assert not (kubo_cluster[0].keys | kubo_cluster[1].keys) & moved
+    assert ipns_rebalance.plan(await db.get_ipns_placements()) == []
+
+
+async def test_signed_sequence_fits_postgres(mock_kubo, monkeypatch):
+    """Sequence numbers floor at the millisecond clock, past int4's range."""
+    import db
+    import ipfs_client
+    import ipns_record
+
+    if db.DIALECT != "postgres":
+        pytest.skip("int4 overflow only applies to PostgreSQL")
+    monkeypatch.setattr(ipfs_client, "IPNS_SIGNING", "local")
+    key = ipns_record.generate_key()
+    user_id = await _user_with_key("bigseq")
+    await db.update_user(
+        user_id, ipns_name=ipns_record.ipns_name(key),
+        ipns_key_backup=ipfs_client.encrypt_key_backup(key),
+    )
+    await ipfs_client.republish_linktree(user_id)
+    user = await db.get_user_by_id(user_id)
+    assert user["ipns_sequence"] > 2**31
+
+
+async def test_locally_signed_records_go_to_every_node(kubo_cluster, monkeypatch):
+    """App-signed records are put on all nodes; Kubo's keystore is unused."""
+    import db
+    import ipfs_client
+    import ipns_record
+
+    monkeypatch.setattr(ipfs_client, "IPNS_SIGNING", "local")
+    key = ipns_record.generate_key()
+    name = ipns_record.ipns_name(key)
+    user_id = await _user_with_key("signer")
+    await db.update_user(user_id, ipns_name=name, ipns_key_backup=ipfs_client.encrypt_key_backup(key))
+
+    cid = await ipfs_client.republish_linktree(user_id)
+    records = [k.records[name] for k in kubo_cluster]
+    assert records[0] == records[1] == records[2]
+    assert ipns_record.verify_record(records[0], key)
+    assert ipns_record.decode_record(records[0])["value"] == f"/ipfs/{cid}"
+    assert not any(k.calls.count("name/publish") or k.keys for k in kubo_cluster)
+    user = await db.get_user_by_id(user_id)
+    first = user["ipns_sequence"]
+    assert user["ipns_expires_at"] > time.time() + ipfs_client.IPNS_RECORD_LIFETIME - 60
+
+    # An unchanged linktree publishes nothing, unless the record needs refreshing
+    assert await ipfs_client.republish_linktree(user_id) == cid
+    assert sum(k.calls.count("routing/put") for k in kubo_cluster) == 3
+    await db.update_user(user_id, ipns_expires_at=int(time.time()))
+    monkeypatch.setattr(ipfs_client.republisher, "delay", 0.01)
+    refresher = ipfs_client.IpnsRefresher(interval=60)
+    assert await refresher.run() == 1
+    await ipfs_client.republisher.join()
+    refreshed = ipns_record.decode_record(kubo_cluster[0].records[name])
+    assert refreshed["value"] == f"/ipfs/{cid}" and refreshed["sequence"] > first
+    assert sum(k.calls.count("add") for k in kubo_cluster) == 3
+    assert await refresher.run() == 0
+    assert not await db.acquire_lease(refresher.LEASE, "other-node", 60)
@@ -0,0 +1,60 @@
+"""In-process IPNS keys and records (ipns_record.py)."""
+
+from datetime import datetime, timezone
+
+import nacl.signing
+import pytest
+
+import ipns_record
+
+EOL = datetime(2030, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+
+
+def test_key_is_a_libp2p_private_key():
+    key = ipns_record.generate_key()
+    assert key[:4] == bytes([0x08, 0x01, 0x12, 0x40])  # Type=Ed25519, Data=64 bytes
+    seed, public = key[4:36], key[36:]
+    assert bytes(nacl.signing.SigningKey(seed).verify_key) == public
+
+
+def test_ipns_name_is_a_base36_libp2p_key_cid():
+    key = ipns_record.generate_key()
+    name = ipns_record.ipns_name(key)
+    assert name.startswith("k51qzi5uqu5d")
+    assert len(name) == 62
+    assert ipns_record.ipns_name(key) == name
+    assert ipns_record.ipns_name(ipns_record.generate_key()) != name
+
+
+def test_rejects_non_ed25519_keys():
+    with pytest.raises(ValueError):
+        ipns_record.ipns_name(bytes([0x08, 0x00, 0x12, 0x01, 0x00]))  # Type=RSA
+
+
+def test_record_fields_and_signature():
+    key = ipns_record.generate_key()
+    record = ipns_record.create_record(key, "/ipfs/QmTest", 7, EOL, 300)
+    fields = ipns_record.decode_record(record)
+    assert fields["value"] == "/ipfs/QmTest"
+    assert fields["validity"] == "2030-01-02T03:04:05.678901000Z"
+    assert fields["sequence"] == 7
+    assert fields["ttl"] == 300
+    assert ipns_record.verify_record(record, key)
+    assert not ipns_record.verify_record(record, ipns_record.generate_key())
+
+
+def test_signed_data_is_canonical_dag_cbor():
+    """Map keys sorted by length, then bytewise, as DAG-CBOR requires."""
+    record = ipns_record.create_record(ipns_record.generate_key(), "/ipfs/Qm", 1, EOL, 1)
+    data = ipns_record.decode_record(record)["data"]
+    assert data[0] == 0xA5  # map of 5
+    keys = ["TTL", "Value", "Sequence", "Validity", "ValidityType"]
+    positions = [data.index(bytes([0x60 | len(k)]) + k.encode()) for k in keys]
+    assert positions == sorted(positions)
+
+
+def test_tampered_record_fails_verification():
+    key = ipns_record.generate_key()
+    record = ipns_record.create_record(key, "/ipfs/QmA", 1, EOL, 300)
+    tampered = record.replace(b"/ipfs/QmA", b"/ipfs/QmB")
+    assert not ipns_record.verify_record(tampered, key)
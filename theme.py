@@ -98,10 +98,14 @@ def apply_theme(primary, secondary, text, bg, card, border):
     ''')
 
 
+def apply_profile_theme(colors: dict, settings: dict):
+    """Apply an already-loaded color scheme + settings to the current page."""
+    dark = bool(settings.get('dark_mode', 0))
+    apply_theme(**resolve_active_palette(colors, dark))
+
+
 async def load_and_apply_theme(user_id):
     """Load user's color scheme from DB and apply to current page."""
     colors = await db.get_profile_colors(user_id)
     settings = await db.get_profile_settings(user_id)
-    dark = bool(settings.get('dark_mode', 0))
-    palette = resolve_active_palette(colors, dark)
-    apply_theme(**palette)
+    apply_profile_theme(colors, settings)